@@ -0,0 +1,112 @@
+"""
+Cold-start cost of the Python SDK: import time of `sibna` and
+`secure_protocol`, and latency of the first message after launch: context
+creation, store open, loading the session established by an earlier process,
+and one encryption. Every sample runs in a fresh interpreter so nothing is
+cached in-process; the session is set up beforehand, untimed.
+
+Exits non-zero when a median exceeds its budget, so it can gate CI:
+
+    python benchmarks/bench_cold_start.py --runs 15 --import-budget-ms 50 --first-message-budget-ms 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BINDINGS = os.path.join(ROOT, 'bindings/python')
+
+# Each snippet prints the milliseconds it measured.
+IMPORT_SIBNA = """
+import time
+t = time.perf_counter()
+import sibna
+print((time.perf_counter() - t) * 1000)
+"""
+
+IMPORT_SECURE_PROTOCOL = """
+import time
+t = time.perf_counter()
+import secure_protocol
+print((time.perf_counter() - t) * 1000)
+"""
+
+ESTABLISH = """
+import os, sys
+from secure_protocol import Config, SecureContext
+SecureContext(Config(db_path=sys.argv[1])).establish_session(b"cold-start-peer", os.urandom(32), True)
+print(0)
+"""
+
+FIRST_MESSAGE = """
+import sys, time
+t = time.perf_counter()
+from secure_protocol import Config, SecureContext
+ctx = SecureContext(Config(db_path=sys.argv[1]))
+ctx.load_session(b"cold-start-peer")
+ctx.encrypt_message(b"cold-start-peer", b"hello")
+print((time.perf_counter() - t) * 1000)
+"""
+
+def sample(snippet, runs, *args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, BINDINGS, os.environ.get("PYTHONPATH")])))
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", snippet, *args], env=env, check=True,
+                             capture_output=True, text=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=11)
+    parser.add_argument("--import-budget-ms", type=float, default=None,
+                        help="fail if either package takes longer to import (median)")
+    parser.add_argument("--first-message-budget-ms", type=float, default=None,
+                        help="fail if the first encrypted message takes longer (median)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {
+        "import_sibna": sample(IMPORT_SIBNA, args.runs),
+        "import_secure_protocol": sample(IMPORT_SECURE_PROTOCOL, args.runs),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        # A store per run holding only the established session, so each run
+        # reads it from disk as a relaunched app would.
+        results["first_message"] = []
+        for i in range(args.runs):
+            db = os.path.join(tmp, f"db{i}")
+            sample(ESTABLISH, 1, db)
+            results["first_message"].append(sample(FIRST_MESSAGE, 1, db)[0])
+
+    budgets = {
+        "import_sibna": args.import_budget_ms,
+        "import_secure_protocol": args.import_budget_ms,
+        "first_message": args.first_message_budget_ms,
+    }
+    summary = {}
+    failed = []
+    for name, times in results.items():
+        median = statistics.median(times)
+        summary[name] = {"median_ms": round(median, 3), "min_ms": round(min(times), 3), "budget_ms": budgets[name]}
+        if budgets[name] is not None and median > budgets[name]:
+            failed.append(name)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{'metric':<24} {'median ms':>10} {'min ms':>10} {'budget':>10}")
+        for name, row in summary.items():
+            budget = "-" if row["budget_ms"] is None else f"{row['budget_ms']:.1f}"
+            print(f"{name:<24} {row['median_ms']:10.2f} {row['min_ms']:10.2f} {budget:>10}")
+    if failed:
+        print(f"over budget: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Core-scaling benchmark for the parallel batch APIs of the Python bindings.
+
+Seals one large buffer with ChunkCipher.seal_buffer using 1..N native worker
+threads and reports GB/s and speedup over a single thread.
+
+    python benchmarks/bench_parallel_chunks.py --size-mib 512 --chunk-kib 1024
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'bindings/python'))
+
+from secure_protocol import ChunkCipher
+
+def measure(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mib", type=int, default=256)
+    parser.add_argument("--chunk-kib", type=int, default=1024)
+    parser.add_argument("--max-threads", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mib * 1024 * 1024)
+    chunk_size = args.chunk_kib * 1024
+    cipher = ChunkCipher(os.urandom(32))
+
+    print(f"{args.size_mib} MiB in {args.chunk_kib} KiB chunks")
+    print(f"{'threads':>7} {'GB/s':>8} {'speedup':>8}")
+    counts = sorted({1 << i for i in range(args.max_threads.bit_length()) if 1 << i <= args.max_threads} | {args.max_threads})
+    baseline = None
+    for threads in counts:
+        seconds = measure(lambda: cipher.seal_buffer(data, chunk_size, threads=threads), args.repeat)
+        baseline = baseline or seconds
+        print(f"{threads:>7} {len(data) / seconds / 1e9:8.3f} {baseline / seconds:8.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Relay cluster throughput from 1 to --max-nodes relay processes on localhost.
+
+For each cluster size, --clients client processes each register --users
+mailboxes spread over the nodes, then SEND --size byte messages to random
+users for --seconds and FETCH their own mailboxes. Reports messages
+stored per second and the share of traffic the nodes had to forward.
+
+By default each mailbox connects to an arbitrary node, so most SENDs and
+FETCHes take an extra hop over the peer links. With --direct clients hash
+keys onto the same ring as the nodes and connect each mailbox to its owner:
+FETCH is then never proxied, though a SEND still goes wherever it arrives
+and is forwarded from there. All nodes and clients share this machine's
+cores, so scaling flattens out once they are busy.
+
+    python benchmarks/bench_relay_cluster.py --max-nodes 4 --clients 8 --direct
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+RELAY = os.path.join(ROOT, "tools/relay-server.py")
+SECRET = "bench"
+
+def load_relay():
+    spec = importlib.util.spec_from_file_location("relay_server", RELAY)
+    relay = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(relay)
+    return relay
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_cluster(count, vnodes):
+    nodes = {f"n{i}": free_port() for i in range(count)}
+    procs = []
+    for node, port in nodes.items():
+        peers = ",".join(f"{n}=127.0.0.1:{p}" for n, p in nodes.items() if n != node)
+        procs.append(subprocess.Popen([sys.executable, RELAY, "--host", "127.0.0.1", "--port", str(port),
+                                       "--node-id", node, "--peers", peers, "--vnodes", str(vnodes),
+                                       "--cluster-secret", SECRET],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    for port in nodes.values():
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+    return nodes, procs
+
+def recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("relay closed the connection")
+        data += chunk
+    return data
+
+def stats(port):
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(b'\x05')
+        return json.loads(recv_exact(sock, struct.unpack('>I', recv_exact(sock, 4))[0]))
+
+def client(worker, nodes, args, barrier, results):
+    rng = random.Random(worker)
+    ports = list(nodes.values())
+    ring = None
+    if args.direct:
+        relay = load_relay()
+        ring = relay.HashRing(list(nodes), args.vnodes)
+
+    def connect(pub):
+        port = nodes[ring.owner(pub)] if ring else rng.choice(ports)
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(b'\x01' + pub)
+        recv_exact(sock, 1)
+        return sock
+
+    users = [bytes([worker]) + os.urandom(31) for _ in range(args.users)]
+    socks = [connect(pub) for pub in users]
+    payload = os.urandom(args.size)
+    barrier.wait()
+
+    sent = fetched = 0
+    deadline = time.perf_counter() + args.seconds
+    while time.perf_counter() < deadline:
+        sock = socks[rng.randrange(len(users))]
+        # Send to one of this worker's own users, so recipients are always registered.
+        recipient = users[rng.randrange(len(users))]
+        sock.sendall(b'\x02' + recipient + struct.pack('>I', len(payload)) + payload)
+        if recv_exact(sock, 1) == b'\x00':
+            sent += 1
+        if sent % args.fetch_every == 0:
+            sock.sendall(b'\x03')
+            for _ in range(struct.unpack('>I', recv_exact(sock, 4))[0]):
+                meta = recv_exact(sock, 36)
+                recv_exact(sock, struct.unpack_from('>I', meta, 32)[0])
+                fetched += 1
+    for sock in socks:
+        sock.close()
+    results.put((sent, fetched))
+
+def run(count, args):
+    nodes, procs = start_cluster(count, args.vnodes)
+    try:
+        barrier = multiprocessing.Barrier(args.clients + 1)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=client, args=(w, nodes, args, barrier, results))
+                   for w in range(args.clients)]
+        for w in workers:
+            w.start()
+        barrier.wait()
+        start = time.perf_counter()
+        totals = [results.get() for _ in workers]
+        elapsed = time.perf_counter() - start
+        for w in workers:
+            w.join()
+        node_stats = [stats(port) for port in nodes.values()]
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+    sent = sum(s for s, _ in totals)
+    return {
+        "nodes": count,
+        "messages_per_sec": round(sent / elapsed),
+        "fetched": sum(f for _, f in totals),
+        "forwarded_share": round(sum(s["forwarded"] for s in node_stats) / max(sent, 1), 3),
+        "proxied_fetches": sum(s["proxied_fetches"] for s in node_stats),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-nodes", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--users", type=int, default=16, help="mailboxes per client process")
+    parser.add_argument("--size", type=int, default=256, help="message size (bytes)")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--fetch-every", type=int, default=20, help="FETCH after this many SENDs")
+    parser.add_argument("--vnodes", type=int, default=64, help="ring points per node")
+    parser.add_argument("--direct", action="store_true", help="clients connect to the owning node")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rows = [run(count, args) for count in range(1, args.max_nodes + 1)]
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'nodes':>5} {'msg/s':>10} {'forwarded':>10} {'proxied fetches':>16}")
+    for row in rows:
+        print(f"{row['nodes']:5d} {row['messages_per_sec']:10d} {row['forwarded_share']:10.1%} "
+              f"{row['proxied_fetches']:16d}")
+
+if __name__ == "__main__":
+    main()
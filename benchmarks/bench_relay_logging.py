@@ -0,0 +1,128 @@
+"""
+Cost of relay logging on the command path.
+
+In-process: nanoseconds per log call on the SEND path with the level off
+(WARNING) and on (DEBUG, through the async queue handler), against the
+synchronous print() with hex formatting it replaced.
+
+End to end: SEND round trips per second against a relay started at each
+--log-level, with its output discarded, so the difference is the relay's
+own logging work.
+
+    python benchmarks/bench_relay_logging.py --calls 200000 --seconds 5
+"""
+import argparse
+import importlib.util
+import logging
+import logging.handlers
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+RELAY = os.path.join(ROOT, "tools/relay-server.py")
+
+def load_relay():
+    spec = importlib.util.spec_from_file_location("relay_server", RELAY)
+    relay = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(relay)
+    return relay
+
+def per_call_ns(calls):
+    relay = load_relay()
+    key = os.urandom(32)
+    devnull = open(os.devnull, "w")
+
+    def legacy():
+        print(f"[*] Stored message for {key.hex()[:8]}...", file=devnull)
+
+    def event():
+        relay.log.debug("send recipient=%s size=%d stored=%d", relay.ShortKey(key), 64, 1)
+
+    # The listener writes to devnull; only the caller's cost is timed.
+    relay.log.handlers.clear()
+    records = relay.queue.SimpleQueue()
+    relay.log.addHandler(relay.AsyncLogHandler(records))
+    relay.log.propagate = False
+    listener = logging.handlers.QueueListener(records, logging.StreamHandler(devnull))
+    listener.start()
+    out = {}
+    for name, level in (("log, level off", logging.WARNING), ("log, level on (async)", logging.DEBUG)):
+        relay.log.setLevel(level)
+        out[name] = timeit.timeit(event, number=calls) / calls * 1e9
+    listener.stop()
+    out["print (previous)"] = timeit.timeit(legacy, number=calls) / calls * 1e9
+    devnull.close()
+    return out
+
+def recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("relay closed the connection")
+        data += chunk
+    return data
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def round_trips(level, seconds, size):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, RELAY, "--host", "127.0.0.1", "--port", str(port), "--log-level", level],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                sock = socket.create_connection(("127.0.0.1", port))
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        pub = os.urandom(32)
+        sock.sendall(b'\x01' + pub)
+        recv_exact(sock, 1)
+        frame = b'\x02' + pub + struct.pack('>I', size) + os.urandom(size)
+        done = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            sock.sendall(frame)
+            recv_exact(sock, 1)
+            done += 1
+            if done % 100 == 0:
+                # Drain the mailbox so quotas never kick in
+                sock.sendall(b'\x03')
+                for _ in range(struct.unpack('>I', recv_exact(sock, 4))[0]):
+                    recv_exact(sock, 36 + size)
+        sock.close()
+        return done / (time.perf_counter() - start)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--seconds", type=float, default=3.0, help="per log level, end to end")
+    parser.add_argument("--size", type=int, default=64, help="message size (bytes)")
+    args = parser.parse_args()
+
+    print(f"{'per call':<24} {'ns':>10}")
+    for name, ns in per_call_ns(args.calls).items():
+        print(f"{name:<24} {ns:10.0f}")
+
+    print(f"\n{'relay --log-level':<24} {'sends/s':>10}")
+    for level in ("WARNING", "INFO", "DEBUG"):
+        print(f"{level:<24} {round_trips(level, args.seconds, args.size):10.0f}")
+
+if __name__ == "__main__":
+    main()
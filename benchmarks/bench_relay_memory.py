@@ -0,0 +1,81 @@
+"""
+Relay mailbox memory, in bytes per queued message, measured with tracemalloc.
+
+Compares the arena-backed mailboxes of tools/relay-server.py with the
+previous representation (a list of (sender, payload) tuples per recipient)
+for the same traffic: --messages payloads of --size bytes from --senders
+senders to --recipients recipients, each sent to --fanout of them.
+
+    python benchmarks/bench_relay_memory.py --messages 500000 --size 64
+"""
+import argparse
+import importlib.util
+import os
+import random
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def load_relay():
+    spec = importlib.util.spec_from_file_location("relay_server", os.path.join(ROOT, "tools/relay-server.py"))
+    relay = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(relay)
+    return relay
+
+def traffic(args):
+    rng = random.Random(7)
+    # Keys arrive off the wire, so every message brings its own bytes objects.
+    senders = [os.urandom(32) for _ in range(args.senders)]
+    recipients = [os.urandom(32) for _ in range(args.recipients)]
+    for _ in range(args.messages):
+        to = rng.sample(recipients, args.fanout)
+        yield bytes(rng.choice(senders)), [bytes(r) for r in to], os.urandom(args.size)
+
+def measure(store, args):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state = store(args)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del state
+    return (after - before) / args.messages
+
+def tuple_lists(args):
+    mailbox = {}
+    for sender, to, payload in traffic(args):
+        entry = (sender, payload)
+        for recipient in to:
+            mailbox.setdefault(recipient, []).append(entry)
+    return mailbox
+
+def arena(relay):
+    def store(args):
+        for sender, to, payload in traffic(args):
+            for recipient in to:
+                if recipient not in relay.MAILBOX:
+                    relay.register(recipient)
+            relay.enqueue(sender, to, payload)
+        return relay.MAILBOX
+    return store
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--size", type=int, default=64, help="payload bytes")
+    parser.add_argument("--senders", type=int, default=1_000)
+    parser.add_argument("--recipients", type=int, default=10_000)
+    parser.add_argument("--fanout", type=int, default=1, help="recipients per message")
+    args = parser.parse_args()
+
+    print(f"{args.messages:,} messages of {args.size} bytes, fan-out {args.fanout}, "
+          f"{args.senders:,} senders, {args.recipients:,} recipients")
+    print(f"{'storage':<12} {'bytes/msg':>10} {'overhead/msg':>13}")
+    # Loaded outside the traced region; only the queued traffic is measured.
+    relay = load_relay()
+    relay.CONFIG.mailbox_max_messages = relay.CONFIG.mailbox_max_bytes = 1 << 62
+    for name, store in (("tuple lists", tuple_lists), ("arena", arena(relay))):
+        per_message = measure(store, args)
+        print(f"{name:<12} {per_message:10.1f} {per_message - args.size:13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Aggregate encryption throughput of worker processes sharing one session store
+through the session daemon (secure_protocol.daemon).
+
+Starts a daemon on a temporary store, then runs 1..N worker processes that
+each establish their own session and encrypt --messages messages on it in
+batches of --batch, and reports messages/s across all workers.
+
+    python benchmarks/bench_session_daemon.py --max-workers 8 --batch 64
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BINDINGS = os.path.join(ROOT, 'bindings/python')
+sys.path.append(BINDINGS)
+
+from secure_protocol.daemon import DaemonClient
+
+def wait_for_socket(path, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise RuntimeError("session daemon did not start")
+        time.sleep(0.05)
+
+def worker(args):
+    socket_path, worker_id, messages, batch, size, start = args
+    session_id = f"bench-worker-{worker_id}".encode()
+    payload = os.urandom(size)
+    with DaemonClient(socket_path) as client:
+        client.establish_session(session_id, os.urandom(32), True)
+        start.wait()
+        sent = 0
+        while sent < messages:
+            n = min(batch, messages - sent)
+            client.encrypt_batch(session_id, [payload] * n)
+            sent += n
+    return sent
+
+def run(socket_path, workers, messages, batch, size):
+    with multiprocessing.Manager() as manager:
+        start = manager.Event()
+        with multiprocessing.Pool(workers) as pool:
+            jobs = [(socket_path, i, messages, batch, size, start) for i in range(workers)]
+            result = pool.map_async(worker, jobs)
+            time.sleep(0.2)  # let every worker connect and establish its session
+            began = time.perf_counter()
+            start.set()
+            total = sum(result.get())
+            return total / (time.perf_counter() - began)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--messages", type=int, default=20000, help="messages per worker")
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--size", type=int, default=256, help="plaintext bytes")
+    parser.add_argument("--durability", choices=["immediate", "group"], default="group")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "daemon.sock")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [BINDINGS, os.environ.get("PYTHONPATH")])))
+        daemon = subprocess.Popen(
+            [sys.executable, "-m", "secure_protocol.daemon", "--socket", socket_path,
+             "--db-path", os.path.join(tmp, "db"), "--durability", args.durability],
+            env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_socket(socket_path)
+            print(f"{args.size}-byte messages, batch {args.batch}, durability={args.durability}")
+            print(f"{'workers':>7} {'msg/s':>12} {'per worker':>12}")
+            counts = sorted({1 << i for i in range(args.max_workers.bit_length()) if 1 << i <= args.max_workers} | {args.max_workers})
+            for workers in counts:
+                rate = run(socket_path, workers, args.messages, args.batch, args.size)
+                print(f"{workers:>7} {rate:12,.0f} {rate / workers:12,.0f}")
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""
+End-to-end benchmark suite with machine-readable results and stored baselines.
+
+Suites:
+  key_server  server/main.py under uvicorn: bundle upload and fetch rps, latency
+  relay       tools/relay-server.py: SEND and FETCH throughput, latency percentiles
+  bindings    secure_protocol: session and group encrypt/decrypt, chunk seal/open
+  sdk_queue   sibna.Client: outgoing queue enqueue and flush rates
+
+Servers are started on free localhost ports and stopped afterwards. A suite
+whose dependencies are missing is reported as skipped, not failed. A suite
+that raises is reported as failed and the others still run; the run then
+exits non-zero.
+
+Each suite runs --repeat times; every metric reports its median, and the
+individual runs are kept next to it. Metric names end in _per_s (higher is
+better) or _ms (lower is better).
+
+With --baseline the results are compared against benchmarks/baselines/NAME.json,
+and the run exits non-zero if any metric is worse than the baseline median by
+more than --tolerance or by more than the run-to-run spread seen in either the
+baseline or this run, whichever is larger. Noise on a busy machine therefore
+widens the threshold instead of failing the build.
+
+Baselines are machine-specific and are not committed: generate one on the
+fixed hardware that runs the comparison (a CI runner, say) with all suites
+available, and compare only on that same machine:
+
+    python benchmarks/run.py --json results.json
+    python benchmarks/run.py --repeat 5 --save-baseline ci
+    python benchmarks/run.py --repeat 5 --baseline ci --tolerance 0.2
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BINDINGS = os.path.join(ROOT, 'bindings/python')
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+sys.path.append(ROOT)
+sys.path.append(BINDINGS)
+
+class Skip(Exception):
+    """A suite cannot run in this environment."""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(name, cmd, port, cwd=None, env=None):
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None or time.time() > deadline:
+                proc.kill()
+                raise RuntimeError(f"{name} did not start")
+            time.sleep(0.05)
+
+def stop_server(proc):
+    proc.terminate()
+    proc.wait()
+
+def percentiles(prefix, latencies):
+    """p50/p95/p99 of latencies (seconds) as <prefix>_p50_ms, ..."""
+    if not latencies:
+        return {}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {f"{prefix}_p{p}_ms": round(cuts[p - 1] * 1000, 3) for p in (50, 95, 99)}
+
+def drive(worker, jobs, seconds):
+    """Run worker(job, start, seconds) in one process per job, all starting
+    together; each returns (operations, latencies). Returns (ops/s, all latencies)."""
+    with multiprocessing.Pool(len(jobs)) as pool:
+        start = time.time() + 0.5  # Let every process spin up first
+        results = pool.starmap(worker, [(job, start, seconds) for job in jobs])
+    ops = sum(n for n, _ in results)
+    return ops / seconds, [t for _, lat in results for t in lat]
+
+def wait_until(start):
+    time.sleep(max(0.0, start - time.time()))
+
+# --- key server ---
+
+def bundle(user_id):
+    return {
+        "user_id": user_id,
+        "identity_key": os.urandom(32).hex(),
+        "signed_pre_key": os.urandom(32).hex(),
+        "signed_pre_key_sig": os.urandom(64).hex(),
+        "one_time_pre_keys": [os.urandom(32).hex() for _ in range(10)],
+    }
+
+def upload_worker(job, start, seconds):
+    port, worker = job
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json"}
+    latencies = []
+    wait_until(start)
+    deadline = start + seconds
+    i = 0
+    while time.time() < deadline:
+        body = json.dumps(bundle(f"bench{worker}_{i}"))
+        t = time.perf_counter()
+        conn.request("POST", "/keys/upload", body, headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - t)
+        if response.status != 200:
+            raise RuntimeError(f"upload returned {response.status}")
+        i += 1
+    conn.close()
+    return i, latencies
+
+def fetch_bundle_worker(job, start, seconds):
+    port, worker = job
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    latencies = []
+    wait_until(start)
+    deadline = start + seconds
+    i = 0
+    while time.time() < deadline:
+        t = time.perf_counter()
+        # Users from the upload phase; the first few always exist
+        conn.request("GET", f"/keys/bench{worker}_{i % 16}")
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - t)
+        if response.status != 200:
+            raise RuntimeError(f"fetch returned {response.status}")
+        i += 1
+    conn.close()
+    return i, latencies
+
+def suite_key_server(args):
+    import importlib.util
+    missing = [m for m in ("fastapi", "uvicorn", "pydantic", "cryptography") if importlib.util.find_spec(m) is None]
+    if missing:
+        raise Skip(f"server/main.py needs {', '.join(missing)}")
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        # main.py keeps server_keys.db in its working directory
+        env = dict(os.environ, SIBNA_MAX_REQ_PER_MINUTE="0")
+        cmd = [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", os.path.join(ROOT, "server"),
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+        proc = start_server("server/main.py", cmd, port, cwd=tmp, env=env)
+        try:
+            jobs = [(port, w) for w in range(args.concurrency)]
+            upload_rps, upload_lat = drive(upload_worker, jobs, args.seconds)
+            fetch_rps, fetch_lat = drive(fetch_bundle_worker, jobs, args.seconds)
+        finally:
+            stop_server(proc)
+    return {
+        "bundle_upload_per_s": round(upload_rps, 1),
+        **percentiles("bundle_upload", upload_lat),
+        "bundle_fetch_per_s": round(fetch_rps, 1),
+        **percentiles("bundle_fetch", fetch_lat),
+    }
+
+# --- relay ---
+
+def recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("relay closed the connection")
+        data += chunk
+    return data
+
+def relay_connect(port, pub):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(b'\x01' + pub)
+    recv_exact(sock, 1)
+    return sock
+
+def relay_fetch(sock):
+    sock.sendall(b'\x03')
+    count = struct.unpack('>I', recv_exact(sock, 4))[0]
+    for _ in range(count):
+        meta = recv_exact(sock, 36)
+        recv_exact(sock, struct.unpack_from('>I', meta, 32)[0])
+    return count
+
+def relay_send_worker(job, start, seconds):
+    """SEND to a mailbox that a second connection keeps drained."""
+    port, size = job
+    sender = relay_connect(port, os.urandom(32))
+    recipient_pub = os.urandom(32)
+    recipient = relay_connect(port, recipient_pub)
+    frame = b'\x02' + recipient_pub + struct.pack('>I', size) + os.urandom(size)
+    latencies = []
+    wait_until(start)
+    deadline = start + seconds
+    while time.time() < deadline:
+        t = time.perf_counter()
+        sender.sendall(frame)
+        if recv_exact(sender, 1) != b'\x00':
+            raise RuntimeError("relay rejected a SEND")
+        latencies.append(time.perf_counter() - t)
+        if len(latencies) % 500 == 0:
+            relay_fetch(recipient)
+    sender.close()
+    recipient.close()
+    return len(latencies), latencies
+
+def relay_fetch_worker(job, start, seconds):
+    """Queue --relay-batch messages, then time the FETCH that drains them.
+    Only the FETCH time counts towards the rate."""
+    port, size, batch = job
+    pub = os.urandom(32)
+    sock = relay_connect(port, pub)
+    frame = b'\x02' + pub + struct.pack('>I', size) + os.urandom(size)
+    latencies = []
+    delivered = 0
+    wait_until(start)
+    deadline = start + seconds
+    while time.time() < deadline:
+        sock.sendall(frame * batch)
+        for _ in range(batch):
+            recv_exact(sock, 1)
+        t = time.perf_counter()
+        delivered += relay_fetch(sock)
+        latencies.append(time.perf_counter() - t)
+    sock.close()
+    return delivered, latencies
+
+def suite_relay(args):
+    port = free_port()
+    cmd = [sys.executable, os.path.join(ROOT, "tools/relay-server.py"), "--host", "127.0.0.1",
+           "--port", str(port), "--log-level", "WARNING"]
+    proc = start_server("tools/relay-server.py", cmd, port)
+    try:
+        send_rate, send_lat = drive(relay_send_worker, [(port, args.size)] * args.concurrency, args.seconds)
+        fetch_jobs = [(port, args.size, args.relay_batch)] * args.concurrency
+        with multiprocessing.Pool(len(fetch_jobs)) as pool:
+            start = time.time() + 0.5
+            results = pool.starmap(relay_fetch_worker, [(job, start, args.seconds) for job in fetch_jobs])
+    finally:
+        stop_server(proc)
+    delivered = sum(n for n, _ in results)
+    fetch_lat = [t for _, lat in results for t in lat]
+    return {
+        "relay_send_per_s": round(send_rate, 1),
+        **percentiles("relay_send", send_lat),
+        "relay_fetch_messages_per_s": round(delivered / sum(fetch_lat), 1) if fetch_lat else 0.0,
+        **percentiles("relay_fetch", fetch_lat),
+    }
+
+# --- bindings ---
+
+def rate(fn, seconds):
+    """Calls of fn per second over about `seconds`."""
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+def suite_bindings(args):
+    try:
+        from secure_protocol import ChunkCipher, Config, SecureContext
+    except ImportError:
+        raise Skip("secure_protocol native module not built")
+    payload = os.urandom(args.size)
+    seconds = args.seconds / 3
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        alice = SecureContext(Config(db_path=os.path.join(tmp, "alice")))
+        bob = SecureContext(Config(db_path=os.path.join(tmp, "bob")))
+
+        # Pairwise and group messages decrypt on another context, so both
+        # directions are real.
+        secret = os.urandom(32)
+        alice.establish_session(b"bob", secret, True)
+        bob.establish_session(b"alice", secret, False)
+        ciphertexts = []
+        results["session_encrypt_per_s"] = rate(
+            lambda: ciphertexts.append(alice.encrypt_message(b"bob", payload)), seconds)
+        start = time.perf_counter()
+        for ciphertext in ciphertexts:
+            bob.decrypt_message(b"alice", ciphertext)
+        results["session_decrypt_per_s"] = len(ciphertexts) / (time.perf_counter() - start)
+
+        bob.process_group_sender_key(b"alice", alice.group_sender_key(b"bench-group"))
+        messages = []
+        results["group_encrypt_per_s"] = rate(lambda: messages.append(alice.group_encrypt(b"bench-group", payload)),
+                                              seconds)
+        start = time.perf_counter()
+        for message in messages:
+            bob.group_decrypt(b"bench-group", b"alice", message)
+        results["group_decrypt_per_s"] = len(messages) / (time.perf_counter() - start)
+
+    cipher = ChunkCipher(os.urandom(32))
+    sealed = cipher.seal(0, payload)
+    results["chunk_seal_per_s"] = rate(lambda: cipher.seal(0, payload), seconds)
+    results["chunk_open_per_s"] = rate(lambda: cipher.open(0, sealed), seconds)
+    return {name: round(value, 1) for name, value in results.items()}
+
+# --- SDK queue ---
+
+def suite_sdk_queue(args):
+    from sibna.client import Client
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        # The client keeps its databases in the working directory
+        os.chdir(tmp)
+        client = Client("bench_user")
+        message = "x" * args.size
+        start = time.perf_counter()
+        for i in range(args.queue_messages):
+            client.send(f"peer{i % 100}", message)
+        enqueue = args.queue_messages / (time.perf_counter() - start)
+        start = time.perf_counter()
+        client._flush_outgoing()
+        flush = args.queue_messages / (time.perf_counter() - start)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {"queue_enqueue_per_s": round(enqueue, 1), "queue_flush_per_s": round(flush, 1)}
+
+SUITES = {
+    "key_server": suite_key_server,
+    "relay": suite_relay,
+    "bindings": suite_bindings,
+    "sdk_queue": suite_sdk_queue,
+}
+
+# --- baselines ---
+
+MIN_BASELINE_REPEAT = 3
+
+def spread(samples):
+    """Run-to-run spread of samples as a fraction of their median."""
+    median = statistics.median(samples)
+    return (max(samples) - min(samples)) / median if median else 0.0
+
+def regressions(current, baseline, tolerance):
+    """(suite, metric, baseline, current, allowed) for every metric worse than
+    the baseline median by more than allowed: tolerance (a fraction) or the
+    spread of either side's runs, whichever is larger."""
+    worse = []
+    for suite, metrics in current["results"].items():
+        for name, value in metrics.items():
+            before = baseline["results"].get(suite, {}).get(name)
+            if before is None:
+                continue
+            allowed = max(tolerance,
+                          spread(baseline.get("runs", {}).get(suite, {}).get(name, [before])),
+                          spread(current["runs"][suite][name]))
+            if name.endswith("_per_s") and value < before * (1 - allowed):
+                worse.append((suite, name, before, value, allowed))
+            elif name.endswith("_ms") and value > before * (1 + allowed):
+                worse.append((suite, name, before, value, allowed))
+    return worse
+
+def machine():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+def same_hardware(a, b):
+    return all(a.get(key) == b.get(key) for key in ("machine", "cpus"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", action="append", choices=list(SUITES),
+                        help="suite to run (repeatable; default: all)")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of each timed phase")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per suite; the median is reported")
+    parser.add_argument("--concurrency", type=int, default=4, help="client processes for server suites")
+    parser.add_argument("--size", type=int, default=256, help="message size (bytes)")
+    parser.add_argument("--relay-batch", type=int, default=100, help="messages queued per timed FETCH")
+    parser.add_argument("--queue-messages", type=int, default=2000, help="messages through the SDK queue")
+    parser.add_argument("--json", metavar="PATH", help="write the results document here ('-' for stdout)")
+    parser.add_argument("--baseline", metavar="NAME", help="compare against baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed fraction worse than the baseline before failing")
+    parser.add_argument("--save-baseline", metavar="NAME", help="store the results as baselines/NAME.json")
+    parser.add_argument("--any-machine", action="store_true",
+                        help="compare against a baseline recorded on different hardware")
+    args = parser.parse_args()
+    if args.save_baseline and args.repeat < MIN_BASELINE_REPEAT:
+        parser.error(f"--save-baseline needs --repeat {MIN_BASELINE_REPEAT} or more to measure noise")
+
+    document = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "machine": machine(),
+        "settings": {key: getattr(args, key)
+                     for key in ("seconds", "repeat", "concurrency", "size", "relay_batch", "queue_messages")},
+        "results": {},
+        "runs": {},
+        "skipped": {},
+        "failed": {},
+    }
+    for name in args.suite or SUITES:
+        print(f"[{name}]", file=sys.stderr)
+        try:
+            runs = [SUITES[name](args) for _ in range(args.repeat)]
+            document["runs"][name] = {metric: [run[metric] for run in runs] for metric in runs[0]}
+            document["results"][name] = {metric: statistics.median(samples)
+                                         for metric, samples in document["runs"][name].items()}
+        except Skip as e:
+            document["skipped"][name] = str(e)
+            print(f"  skipped: {e}", file=sys.stderr)
+            continue
+        except Exception as e:
+            # Report it and go on with the other suites; the run still fails.
+            document["failed"][name] = f"{type(e).__name__}: {e}"
+            print(f"  FAILED: {document['failed'][name]}", file=sys.stderr)
+            continue
+        for metric, value in document["results"][name].items():
+            print(f"  {metric:<32} {value:>12}  ±{spread(document['runs'][name][metric]):.0%}", file=sys.stderr)
+
+    if args.json:
+        text = json.dumps(document, indent=2)
+        if args.json == "-":
+            print(text)
+        else:
+            with open(args.json, "w") as f:
+                f.write(text + "\n")
+    if args.save_baseline:
+        missing = [*document["skipped"], *document["failed"]]
+        if missing:
+            print(f"warning: baseline {args.save_baseline} omits suites: {', '.join(missing)}", file=sys.stderr)
+        os.makedirs(BASELINES, exist_ok=True)
+        with open(os.path.join(BASELINES, f"{args.save_baseline}.json"), "w") as f:
+            f.write(json.dumps(document, indent=2) + "\n")
+
+    if args.baseline:
+        with open(os.path.join(BASELINES, f"{args.baseline}.json")) as f:
+            baseline = json.load(f)
+        if not same_hardware(baseline.get("machine", {}), document["machine"]):
+            print(f"baseline {args.baseline} was recorded on {baseline.get('machine')}, "
+                  f"this run is on {document['machine']}", file=sys.stderr)
+            if not args.any_machine:
+                sys.exit(2)
+        for suite in document["results"]:
+            if suite not in baseline["results"]:
+                print(f"note: baseline {args.baseline} has no {suite} results", file=sys.stderr)
+        worse = regressions(document, baseline, args.tolerance)
+        for suite, metric, before, after, allowed in worse:
+            print(f"REGRESSION {suite}.{metric}: {before} -> {after} (allowed {allowed:.0%})", file=sys.stderr)
+        if worse:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+    if document["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,29 @@
 import socket
 import struct
-from ._secure_protocol import PySecureContext as SecureContext
-from ._secure_protocol import PyConfig as Config
-from ._secure_protocol import PySessionHandle as SessionHandle
 
-__all__ = ["SecureContext", "Config", "SessionHandle", "RelayClient"]
+__all__ = ["SecureContext", "Config", "SessionHandle", "ChunkCipher", "MESSAGE_OVERHEAD", "GROUP_MESSAGE_OVERHEAD", "RelayClient"]
+
+# Public name -> name in the native module. The native module is loaded on
+# first access, so importing the package (or a pure-Python submodule such as
+# the daemon client) stays cheap.
+_NATIVE = {
+    "SecureContext": "PySecureContext",
+    "Config": "PyConfig",
+    "SessionHandle": "PySessionHandle",
+    "ChunkCipher": "PyChunkCipher",
+    "MESSAGE_OVERHEAD": "MESSAGE_OVERHEAD",
+    "GROUP_MESSAGE_OVERHEAD": "GROUP_MESSAGE_OVERHEAD",
+}
+
+
+def __getattr__(name):
+    if name in _NATIVE:
+        from . import _secure_protocol
+        value = getattr(_secure_protocol, _NATIVE[name])
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 class RelayClient:
     def __init__(self, host, port, identity_pub, identity_priv=None):
@@ -13,6 +32,7 @@ class RelayClient:
         self.identity_pub = identity_pub
         
         # Initialize Rust Core
+        from . import Config, SecureContext
         self.config = Config()
         self.context = SecureContext(self.config)
         
@@ -92,6 +112,24 @@ class RelayClient:
             # Let's assume OK.
             pass
             
+    def send_multi(self, recipient_pubs, data):
+        """Send one blob to several recipients in a single frame; the relay stores it once."""
+        # Cmd: 0x04
+        # Count: 2 bytes BE
+        # Recipients: 32 bytes each
+        # Len: 4 bytes BE
+        # Blob: bytes
+        recipients = list(recipient_pubs)
+        if not 0 < len(recipients) <= 0xFFFF or any(len(r) != 32 for r in recipients):
+            raise ValueError("send_multi needs 1 to 65535 recipient keys of 32 bytes")
+        
+        msg = b'\x04' + struct.pack('>H', len(recipients)) + b''.join(recipients) + struct.pack('>I', len(data)) + data
+        self.sock.sendall(msg)
+        
+        resp = self.sock.recv(1)
+        if resp != b'\x00':
+            raise Exception("Multi-recipient send failed")
+            
     def fetch_messages(self):
         # Cmd: 0x03
         cmd = b'\x03'
@@ -118,6 +156,13 @@ class RelayClient:
             
         return messages
         
+    def ping(self):
+        """Keepalive: the relay closes connections idle past its --idle-timeout."""
+        # Cmd: 0x06
+        self.sock.sendall(b'\x06')
+        if self._recv_exact(1) != b'\x00':
+            raise Exception("Ping failed")
+        
     def _recv_exact(self, n):
         data = b''
         while len(data) < n:
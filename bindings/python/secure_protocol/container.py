@@ -0,0 +1,299 @@
+"""
+Seekable encrypted file container.
+
+Layout (all integers big-endian):
+
+    header   magic "SPCF" | version (1) | flags (1) | reserved (2)
+             | chunk_size (4) | wrapped_key_len (4) | wrapped_key
+    chunks   chunk 0 .. chunk n-1, each ChunkCipher.seal() output
+             (chunk_size plaintext bytes + 16-byte tag; the last may be shorter)
+    index    sealed: n x [offset (8) | sealed_len (4)] | chunk_count (8) | plaintext_size (8)
+    trailer  index_len (4) | magic "SPCX"
+
+Every chunk is sealed with a per-file random key, a nonce derived from its
+index and the header as associated data, plus a flag marking the final chunk.
+Chunks can therefore be opened independently and in any order, swapping or
+reordering chunks fails authentication, and truncation is detected because no
+remaining chunk carries the final flag. The file key itself travels in the
+header wrapped by the caller (the CLI wraps it with the ratchet session).
+"""
+import mmap
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from . import ChunkCipher
+
+MAGIC = b"SPCF"
+TRAILER_MAGIC = b"SPCX"
+VERSION = 1
+TAG_LENGTH = 16
+KEY_LENGTH = 32
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_HEADER = struct.Struct(">4sBBHII")
+_INDEX_ENTRY = struct.Struct(">QI")
+_INDEX_FOOTER = struct.Struct(">QQ")
+_TRAILER = struct.Struct(">I4s")
+_INDEX_CHUNK = 0xFFFFFFFFFFFFFFFF
+
+_CHUNK = b"\x00"
+_FINAL_CHUNK = b"\x01"
+_INDEX = b"\x02"
+
+
+class ContainerError(Exception):
+    """Malformed, truncated or tampered container."""
+    pass
+
+
+def new_file_key():
+    return os.urandom(KEY_LENGTH)
+
+
+def _encode_header(chunk_size, wrapped_key):
+    return _HEADER.pack(MAGIC, VERSION, 0, 0, chunk_size, len(wrapped_key)) + wrapped_key
+
+
+class ContainerWriter:
+    """
+    Write a container incrementally. Data is buffered up to chunk_size and
+    sealed chunk by chunk; close() seals the final chunk, the index and the trailer.
+    """
+
+    def __init__(self, path, key, wrapped_key=b"", chunk_size=DEFAULT_CHUNK_SIZE, _resume_state=None):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        self.path = path
+        self.chunk_size = chunk_size
+        self._cipher = ChunkCipher(key)
+        self._buffer = bytearray()
+        self._closed = False
+
+        if _resume_state is None:
+            self._header = _encode_header(chunk_size, wrapped_key)
+            self._file = open(path, "wb")
+            self._file.write(self._header)
+            self._index = []
+            self.plaintext_size = 0
+        else:
+            self._header, self._index, self.plaintext_size = _resume_state
+            self._file = open(path, "r+b")
+            self._file.truncate(len(self._header) + sum(length for _, length in self._index))
+            self._file.seek(0, os.SEEK_END)
+
+    @classmethod
+    def resume(cls, path, key):
+        """
+        Reopen an interrupted (unclosed) container for appending. Partially
+        written chunks are discarded; the caller continues from `plaintext_size`.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        header, chunk_size = _parse_header(data)
+        sealed_chunk = chunk_size + TAG_LENGTH
+        if data.endswith(TRAILER_MAGIC):
+            raise ContainerError("container is already complete")
+
+        count = (len(data) - len(header)) // sealed_chunk
+        if count:
+            # Make sure the last full chunk belongs to this key/header before appending.
+            offset = len(header) + (count - 1) * sealed_chunk
+            try:
+                ChunkCipher(key).open(count - 1, data[offset:offset + sealed_chunk], header + _CHUNK)
+            except Exception:
+                raise ContainerError("cannot resume: last chunk fails authentication") from None
+
+        index = [(len(header) + i * sealed_chunk, sealed_chunk) for i in range(count)]
+        return cls(path, key, chunk_size=chunk_size, _resume_state=(header, index, count * chunk_size))
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError("container is closed")
+        self._buffer += data
+        self.plaintext_size += len(data)
+        while len(self._buffer) > self.chunk_size:
+            self._seal(bytes(self._buffer[:self.chunk_size]), final=False)
+            del self._buffer[:self.chunk_size]
+
+    def _seal(self, plaintext, final):
+        index = len(self._index)
+        sealed = self._cipher.seal(index, plaintext, self._header + (_FINAL_CHUNK if final else _CHUNK))
+        self._index.append((self._file.tell(), len(sealed)))
+        self._file.write(sealed)
+
+    def close(self):
+        if self._closed:
+            return
+        # Always emit a final chunk (possibly empty) so truncation is detectable.
+        self._seal(bytes(self._buffer), final=True)
+        self._buffer.clear()
+
+        index = b"".join(_INDEX_ENTRY.pack(off, length) for off, length in self._index)
+        index += _INDEX_FOOTER.pack(len(self._index), self.plaintext_size)
+        sealed_index = self._cipher.seal(_INDEX_CHUNK, index, self._header + _INDEX)
+        self._file.write(sealed_index)
+        self._file.write(_TRAILER.pack(len(sealed_index), TRAILER_MAGIC))
+        self._file.close()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave the partial container in place so it can be resumed.
+            self._file.close()
+            self._closed = True
+
+
+def _parse_header(data):
+    if len(data) < _HEADER.size:
+        raise ContainerError("file too short for a container header")
+    magic, version, _flags, _reserved, chunk_size, key_len = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ContainerError("not a secure container")
+    if version != VERSION:
+        raise ContainerError(f"unsupported container version {version}")
+    end = _HEADER.size + key_len
+    if len(data) < end or chunk_size == 0:
+        raise ContainerError("corrupted container header")
+    return bytes(data[:end]), chunk_size
+
+
+class ContainerReader:
+    """
+    Random-access reader. `key` is the file key; alternatively pass `unwrap`,
+    a callable that turns the header's wrapped key into the file key.
+    """
+
+    def __init__(self, path, key=None, unwrap=None):
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        self.header, self.chunk_size = _parse_header(self._map)
+        self.wrapped_key = self.header[_HEADER.size:]
+        if key is None:
+            if unwrap is None:
+                raise ValueError("either key or unwrap is required")
+            key = unwrap(self.wrapped_key)
+        self._cipher = ChunkCipher(key)
+        self._load_index(size)
+
+    def _load_index(self, size):
+        trailer_at = size - _TRAILER.size
+        self.complete = False
+        if trailer_at >= len(self.header):
+            index_len, magic = _TRAILER.unpack_from(self._map, trailer_at)
+            if magic == TRAILER_MAGIC and len(self.header) <= trailer_at - index_len:
+                start = trailer_at - index_len
+                try:
+                    index = self._cipher.open(_INDEX_CHUNK, self._map[start:trailer_at], self.header + _INDEX)
+                except Exception:
+                    raise ContainerError("chunk index fails authentication") from None
+                count, self.plaintext_size = _INDEX_FOOTER.unpack_from(index, len(index) - _INDEX_FOOTER.size)
+                self._index = [_INDEX_ENTRY.unpack_from(index, i * _INDEX_ENTRY.size) for i in range(count)]
+                self.complete = True
+                return
+
+        # Interrupted container: only whole chunks are usable, none of them final.
+        sealed_chunk = self.chunk_size + TAG_LENGTH
+        count = (size - len(self.header)) // sealed_chunk
+        self._index = [(len(self.header) + i * sealed_chunk, sealed_chunk) for i in range(count)]
+        self.plaintext_size = count * self.chunk_size
+
+    @property
+    def chunk_count(self):
+        return len(self._index)
+
+    def _sealed(self, index):
+        offset, length = self._index[index]
+        return self._map[offset:offset + length]
+
+    def read_chunk(self, index):
+        if not 0 <= index < len(self._index):
+            raise IndexError("chunk index out of range")
+        final = self.complete and index == len(self._index) - 1
+        ad = self.header + (_FINAL_CHUNK if final else _CHUNK)
+        try:
+            return self._cipher.open(index, self._sealed(index), ad)
+        except Exception:
+            raise ContainerError(f"chunk {index} fails authentication") from None
+
+    def read_range(self, offset, length):
+        """Decrypt plaintext bytes [offset, offset + length) touching only the chunks that cover them."""
+        if offset < 0 or length < 0:
+            raise ValueError("offset and length must be non-negative")
+        end = min(offset + length, self.plaintext_size)
+        if offset >= end:
+            return b""
+        first = offset // self.chunk_size
+        last = (end - 1) // self.chunk_size
+        data = b"".join(self.read_chunk(i) for i in range(first, last + 1))
+        start = offset - first * self.chunk_size
+        return data[start:start + (end - offset)]
+
+    def verify(self, workers=None):
+        """Authenticate every chunk in parallel. Returns the indexes of bad chunks."""
+        def check(index):
+            try:
+                self.read_chunk(index)
+                return None
+            except ContainerError:
+                return index
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            return [i for i in pool.map(check, range(self.chunk_count)) if i is not None]
+
+    def iter_chunks(self, workers=None, batch=64):
+        """
+        Yield decrypted chunks in order. Each batch of `batch` chunks is opened
+        in parallel by ChunkCipher.open_many on `workers` native threads.
+        """
+        # The final chunk has its own associated data and is opened separately.
+        bulk = self.chunk_count - 1 if self.complete else self.chunk_count
+        for start in range(0, bulk, batch):
+            stop = min(start + batch, bulk)
+            sealed = [self._sealed(i) for i in range(start, stop)]
+            try:
+                yield from self._cipher.open_many(sealed, start, self.header + _CHUNK, workers)
+            except Exception:
+                raise ContainerError(f"chunks {start}..{stop - 1} fail authentication") from None
+        if self.complete:
+            yield self.read_chunk(self.chunk_count - 1)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def pack_file(src_path, dst_path, key, wrapped_key=b"", chunk_size=DEFAULT_CHUNK_SIZE):
+    with open(src_path, "rb") as src, ContainerWriter(dst_path, key, wrapped_key, chunk_size) as writer:
+        while data := src.read(chunk_size):
+            writer.write(data)
+
+
+def resume_pack_file(src_path, dst_path, key):
+    """Continue an interrupted pack_file() from the last intact chunk."""
+    with open(src_path, "rb") as src, ContainerWriter.resume(dst_path, key) as writer:
+        src.seek(writer.plaintext_size)
+        while data := src.read(writer.chunk_size):
+            writer.write(data)
+
+
+def unpack_file(src_path, dst_path, key=None, unwrap=None, workers=None):
+    with ContainerReader(src_path, key, unwrap) as reader, open(dst_path, "wb") as dst:
+        if not reader.complete:
+            raise ContainerError("container is incomplete")
+        for chunk in reader.iter_chunks(workers):
+            dst.write(chunk)
@@ -0,0 +1,304 @@
+"""
+Local session daemon: one process owns the session store and worker
+processes encrypt and decrypt through it over a Unix socket.
+
+sled locks its database directory, so only one process can open a
+SecureContext on a given db_path. Run the daemon on that path instead:
+
+    python -m secure_protocol.daemon --socket /tmp/secure.sock --db-path ./secure_core_db
+
+and connect a DaemonClient from each worker. The socket is created with mode
+0600, so only the daemon's user can use the store through it.
+
+Sessions that encrypt are established from a secret shared with the peer
+(OP_ESTABLISH_SESSION, items: secret, role byte 1 for the initiator or 0);
+OP_CREATE_SESSION makes a bare session that cannot send yet. Requests carry whole batches, so
+a burst of N messages costs one round trip, one session lock and one persist.
+
+Framing (all integers big-endian), every frame is length (4) | body:
+
+    request   op (1) | session_id_len (2) | session_id | count (4) | count x [len (4) | data]
+    response  status (1) | count (4) | count x [status (1) | len (4) | data]
+
+A failed request has status 1 and a single item holding the UTF-8 error
+message. In a decrypt response, item status 1 marks a message that failed to
+decrypt; its data is empty.
+"""
+import argparse
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import threading
+
+OP_CREATE_SESSION = 1
+OP_ENCRYPT = 2
+OP_DECRYPT = 3
+OP_FLUSH = 4
+OP_ESTABLISH_SESSION = 5
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+MAX_FRAME = 256 * 1024 * 1024
+
+_LEN = struct.Struct(">I")
+_REQUEST = struct.Struct(">BH")
+_RESPONSE = struct.Struct(">BI")
+_ITEM = struct.Struct(">BI")
+
+
+class DaemonError(Exception):
+    """The daemon rejected a request, or sent a malformed frame."""
+    pass
+
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        read = sock.recv_into(view[got:])
+        if not read:
+            raise ConnectionError("connection closed")
+        got += read
+    return buf
+
+
+def _recv_frame(sock):
+    (length,) = _LEN.unpack(_recv_exact(sock, _LEN.size))
+    if length > MAX_FRAME:
+        raise DaemonError(f"frame of {length} bytes exceeds {MAX_FRAME}")
+    return bytes(_recv_exact(sock, length))
+
+
+def _send_frame(sock, parts):
+    parts.insert(0, _LEN.pack(sum(len(p) for p in parts)))
+    sock.sendall(b"".join(parts))
+
+
+def _remove_stale_socket(path):
+    """Unlink path if it is a socket nobody listens on any more. Anything
+    else there (a live daemon, a regular file) is left alone and refused."""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise DaemonError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise DaemonError(f"a daemon is already listening on {path}")
+
+
+def _encode_request(op, session_id, items):
+    parts = [_REQUEST.pack(op, len(session_id)), session_id, _LEN.pack(len(items))]
+    for data in items:
+        parts += (_LEN.pack(len(data)), data)
+    return parts
+
+
+def _encode_response(status, items):
+    parts = [_RESPONSE.pack(status, len(items))]
+    for data in items:
+        if data is None:
+            parts.append(_ITEM.pack(STATUS_ERROR, 0))
+        else:
+            parts += (_ITEM.pack(STATUS_OK, len(data)), data)
+    return parts
+
+
+def _decode_items(body, offset, count, item):
+    items = []
+    for _ in range(count):
+        if offset + item.size > len(body):
+            raise DaemonError("truncated frame")
+        fields = item.unpack_from(body, offset)
+        offset += item.size
+        end = offset + fields[-1]
+        if end > len(body):
+            raise DaemonError("truncated frame")
+        items.append((fields[0], body[offset:end]))
+        offset = end
+    return items
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                body = _recv_frame(self.request)
+            except (ConnectionError, DaemonError):
+                return
+            try:
+                response = _encode_response(STATUS_OK, self.server.dispatch(body))
+            except Exception as e:
+                response = _encode_response(STATUS_ERROR, [str(e).encode()])
+            _send_frame(self.request, response)
+
+
+class SessionDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serve one SecureContext to local workers. Each connection gets a thread;
+    the core releases the GIL, so batches for different sessions run in parallel.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, context):
+        self.context = context
+        _remove_stale_socket(socket_path)
+        super().__init__(socket_path, _Handler)
+
+    def server_bind(self):
+        # Whoever can connect can encrypt and decrypt as this store, so the
+        # socket is owner-only from the moment it exists.
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+
+    def dispatch(self, body):
+        if len(body) < _REQUEST.size:
+            raise DaemonError("truncated frame")
+        op, sid_len = _REQUEST.unpack_from(body)
+        offset = _REQUEST.size + sid_len
+        if offset + _LEN.size > len(body):
+            raise DaemonError("truncated frame")
+        session_id = body[_REQUEST.size:offset]
+        (count,) = _LEN.unpack_from(body, offset)
+        items = [data for _, data in _decode_items(body, offset + _LEN.size, count, _LEN)]
+
+        if op == OP_CREATE_SESSION:
+            self.context.create_session(session_id)
+            return []
+        if op == OP_ESTABLISH_SESSION:
+            if len(items) != 2 or items[1] not in (b"\x00", b"\x01"):
+                raise DaemonError("establish needs a secret and a role byte")
+            self.context.establish_session(session_id, items[0], items[1] == b"\x01")
+            return []
+        if op == OP_ENCRYPT:
+            return self.context.encrypt_batch(session_id, items)
+        if op == OP_DECRYPT:
+            return self.context.decrypt_batch(session_id, items)
+        if op == OP_FLUSH:
+            self.context.flush()
+            return []
+        raise DaemonError(f"unknown op {op}")
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+class DaemonClient:
+    """
+    Worker-side connection to a SessionDaemon, with the same batch methods as
+    SecureContext. Safe to share between threads; requests are serialized on
+    the connection, so give busy threads their own client.
+    """
+
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self._lock = threading.Lock()
+
+    def _call(self, op, session_id=b"", items=()):
+        with self._lock:
+            _send_frame(self.sock, _encode_request(op, session_id, list(items)))
+            body = _recv_frame(self.sock)
+        if len(body) < _RESPONSE.size:
+            raise DaemonError("truncated frame")
+        status, count = _RESPONSE.unpack_from(body)
+        items = _decode_items(body, _RESPONSE.size, count, _ITEM)
+        if status != STATUS_OK:
+            raise DaemonError(items[0][1].decode(errors="replace") if items else "request failed")
+        return items
+
+    def create_session(self, session_id):
+        """Create (or replace) the daemon's session for `session_id`."""
+        self._call(OP_CREATE_SESSION, session_id)
+
+    def establish_session(self, session_id, shared_secret, initiator):
+        """Establish (or replace) the daemon's session for `session_id` from a
+        32-byte secret shared with the peer; see SecureContext.establish_session."""
+        self._call(OP_ESTABLISH_SESSION, session_id, [shared_secret, b"\x01" if initiator else b"\x00"])
+
+    def encrypt_batch(self, session_id, plaintexts):
+        return [data for _, data in self._call(OP_ENCRYPT, session_id, plaintexts)]
+
+    def decrypt_batch(self, session_id, ciphertexts):
+        """Plaintexts in order; messages that fail to decrypt come back as None."""
+        return [data if status == STATUS_OK else None
+                for status, data in self._call(OP_DECRYPT, session_id, ciphertexts)]
+
+    def encrypt_message(self, session_id, plaintext):
+        return self.encrypt_batch(session_id, [plaintext])[0]
+
+    def decrypt_message(self, session_id, ciphertext):
+        plaintext = self.decrypt_batch(session_id, [ciphertext])[0]
+        if plaintext is None:
+            raise DaemonError("decryption failed")
+        return plaintext
+
+    def flush(self):
+        self._call(OP_FLUSH)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main(argv=None):
+    # Workers only import DaemonClient; the native module is loaded here.
+    from . import Config, SecureContext
+
+    parser = argparse.ArgumentParser(description="Serve a SecureContext to local worker processes.")
+    parser.add_argument("--socket", required=True, help="Unix socket path to listen on")
+    parser.add_argument("--db-path", default="secure_core_db")
+    parser.add_argument("--db-cache-mib", type=int, default=None)
+    parser.add_argument("--durability", choices=["immediate", "group"], default="immediate")
+    args = parser.parse_args(argv)
+
+    config = Config(
+        durability=args.durability,
+        db_path=args.db_path,
+        db_cache_capacity=None if args.db_cache_mib is None else args.db_cache_mib * 1024 * 1024,
+    )
+    context = SecureContext(config)
+    context.open()
+    try:
+        server = SessionDaemon(args.socket, context)
+    except DaemonError as e:
+        parser.exit(1, f"{e}\n")
+    # Stop cleanly (and flush) on SIGTERM as well as Ctrl-C.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"Session daemon on {args.socket} (store: {args.db_path})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.context.flush()
+
+
+if __name__ == "__main__":
+    main()
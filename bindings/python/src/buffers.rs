@@ -0,0 +1,43 @@
+//! Buffer-protocol helpers: borrow bytes, bytearray, memoryview, mmap, ...
+//! directly instead of copying them into `bytes` first.
+//!
+//! The returned slices point into memory owned by the Python object. They are
+//! only valid while the `PyBuffer` is alive, and callers must not resize or
+//! mutate the object from another thread while a call is in progress.
+
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::{PyBufferError, PyValueError};
+use pyo3::prelude::*;
+
+pub fn as_slice(buf: &PyBuffer<u8>) -> PyResult<&[u8]> {
+    if !buf.is_c_contiguous() {
+        return Err(PyBufferError::new_err("buffer must be C-contiguous"));
+    }
+    if buf.len_bytes() == 0 {
+        return Ok(&[]);
+    }
+    Ok(unsafe { std::slice::from_raw_parts(buf.buf_ptr() as *const u8, buf.len_bytes()) })
+}
+
+pub fn as_mut_slice(buf: &PyBuffer<u8>) -> PyResult<&mut [u8]> {
+    if buf.readonly() {
+        return Err(PyBufferError::new_err("output buffer is read-only"));
+    }
+    if !buf.is_c_contiguous() {
+        return Err(PyBufferError::new_err("buffer must be C-contiguous"));
+    }
+    if buf.len_bytes() == 0 {
+        return Ok(&mut []);
+    }
+    Ok(unsafe { std::slice::from_raw_parts_mut(buf.buf_ptr() as *mut u8, buf.len_bytes()) })
+}
+
+/// Reject input/output buffers that share memory; the core reads the whole
+/// input before writing, but the two borrows must not alias.
+pub fn check_disjoint(input: &[u8], output: &[u8]) -> PyResult<()> {
+    let (a, b) = (input.as_ptr() as usize, output.as_ptr() as usize);
+    if a < b + output.len() && b < a + input.len() {
+        return Err(PyValueError::new_err("input and output buffers overlap"));
+    }
+    Ok(())
+}
@@ -1,5 +1,11 @@
 use pyo3::prelude::*;
-use secure_protocol::{SecureContext, Config, SessionHandle};
+use pyo3::buffer::PyBuffer;
+use pyo3::types::{PyBytes, PyDict};
+use secure_protocol::{SecureContext, Config, Durability, SessionHandle, CryptoHandler, ProtocolError, MESSAGE_OVERHEAD};
+use secure_protocol::group::GROUP_MESSAGE_OVERHEAD;
+
+mod buffers;
+mod parallel;
 
 /// Python wrapper for Config
 #[pyclass]
@@ -11,12 +17,57 @@ pub struct PyConfig {
 #[pymethods]
 impl PyConfig {
     #[new]
-    #[pyo3(signature = (enable_forward_secrecy=true, enable_post_compromise_security=true))]
-    fn new(enable_forward_secrecy: bool, enable_post_compromise_security: bool) -> Self {
+    #[pyo3(signature = (
+        enable_forward_secrecy=true,
+        enable_post_compromise_security=true,
+        durability="immediate",
+        flush_interval_ms=None,
+        flush_max_pending=None,
+        session_cache_capacity=None,
+        skipped_key_ttl=None,
+        db_path=None,
+        db_cache_capacity=None,
+    ))]
+    fn new(
+        enable_forward_secrecy: bool,
+        enable_post_compromise_security: bool,
+        durability: &str,
+        flush_interval_ms: Option<u64>,
+        flush_max_pending: Option<usize>,
+        session_cache_capacity: Option<usize>,
+        skipped_key_ttl: Option<u64>,
+        db_path: Option<std::path::PathBuf>,
+        db_cache_capacity: Option<u64>,
+    ) -> PyResult<Self> {
         let mut cfg = Config::default();
         cfg.enable_forward_secrecy = enable_forward_secrecy;
         cfg.enable_post_compromise_security = enable_post_compromise_security;
-        PyConfig { inner: cfg }
+        cfg.durability = match durability {
+            "immediate" => Durability::Immediate,
+            "group" => Durability::GroupCommit,
+            other => return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(format!(
+                "unknown durability {:?} (expected \"immediate\" or \"group\")", other
+            ))),
+        };
+        if let Some(ms) = flush_interval_ms {
+            cfg.flush_interval_ms = ms;
+        }
+        if let Some(n) = flush_max_pending {
+            cfg.flush_max_pending = n;
+        }
+        if let Some(n) = session_cache_capacity {
+            cfg.session_cache_capacity = n;
+        }
+        if let Some(secs) = skipped_key_ttl {
+            cfg.skipped_key_ttl = secs;
+        }
+        if let Some(path) = db_path {
+            cfg.db_path = path;
+        }
+        if let Some(bytes) = db_cache_capacity {
+            cfg.db_cache_capacity = bytes;
+        }
+        Ok(PyConfig { inner: cfg })
     }
 }
 
@@ -40,19 +91,191 @@ impl PySecureContext {
         Ok(PySessionHandle { inner: handle }) 
     }
 
-    fn load_identity(&mut self, public: &[u8], private: &[u8]) {
-        self.inner.load_identity(public, private);
+    /// The stored session for peer_id, or None if there is none yet.
+    fn load_session(&self, py: Python<'_>, peer_id: &[u8]) -> PyResult<Option<PySessionHandle>> {
+        match py.allow_threads(|| self.inner.load_session(peer_id)) {
+            Ok(handle) => Ok(Some(PySessionHandle { inner: handle })),
+            Err(ProtocolError::SessionNotFound) => Ok(None),
+            Err(e) => Err(PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e))),
+        }
     }
-    
-    fn encrypt_message(&self, session_id: &[u8], plaintext: &[u8]) -> PyResult<Vec<u8>> {
-        self.inner.encrypt_message(session_id, plaintext, None)
+
+    /// Establish the session with peer_id from a 32-byte secret the peer also
+    /// holds, replacing any existing one. One side passes initiator=True and
+    /// the other initiator=False; either may then send first.
+    fn establish_session(&self, py: Python<'_>, peer_id: &[u8], shared_secret: &[u8], initiator: bool) -> PyResult<PySessionHandle> {
+        let secret: &[u8; 32] = shared_secret.try_into().map_err(|_| PyErr::new::<pyo3::exceptions::PyValueError, _>(format!(
+            "shared_secret must be 32 bytes, got {}", shared_secret.len())))?;
+        let handle = py.allow_threads(|| self.inner.establish_session(peer_id, secret, initiator))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PySessionHandle { inner: handle })
+    }
+
+    fn load_identity(&mut self, public: &[u8], private: &[u8]) -> PyResult<()> {
+        self.inner.load_identity(public, private)
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))
+    }
+
+    /// Open the session store now rather than on the first operation that needs it.
+    fn open(&self, py: Python<'_>) -> PyResult<()> {
+        py.allow_threads(|| self.inner.open())
             .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))
     }
+
+    /// Session cache counters: hits, misses, evictions, entries and capacity.
+    fn cache_stats(&self, py: Python<'_>) -> PyResult<PyObject> {
+        let stats = self.inner.cache_stats();
+        let dict = PyDict::new_bound(py);
+        dict.set_item("hits", stats.hits)?;
+        dict.set_item("misses", stats.misses)?;
+        dict.set_item("evictions", stats.evictions)?;
+        dict.set_item("entries", stats.entries)?;
+        dict.set_item("capacity", stats.capacity)?;
+        Ok(dict.into_any().unbind())
+    }
+
+    /// Persist all pending session updates. Only needed with durability="group",
+    /// e.g. before acknowledging messages to a peer.
+    fn flush(&self, py: Python<'_>) -> PyResult<()> {
+        py.allow_threads(|| self.inner.flush())
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))
+    }
+    
+    /// Encrypt a message. The GIL is released while the core runs so worker
+    /// threads can encrypt for different peers concurrently.
+    fn encrypt_message(&self, py: Python<'_>, session_id: &[u8], plaintext: PyBuffer<u8>) -> PyResult<Py<PyBytes>> {
+        let plaintext = buffers::as_slice(&plaintext)?;
+        let out = py.allow_threads(|| self.inner.encrypt_message(session_id, plaintext, None))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PyBytes::new_bound(py, &out).unbind())
+    }
     
-    fn decrypt_message(&self, session_id: &[u8], ciphertext: &[u8]) -> PyResult<Vec<u8>> {
-        self.inner.decrypt_message(session_id, ciphertext, None)
+    /// Decrypt a message. The GIL is released while the core runs.
+    fn decrypt_message(&self, py: Python<'_>, session_id: &[u8], ciphertext: PyBuffer<u8>) -> PyResult<Py<PyBytes>> {
+        let ciphertext = buffers::as_slice(&ciphertext)?;
+        let out = py.allow_threads(|| self.inner.decrypt_message(session_id, ciphertext, None))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PyBytes::new_bound(py, &out).unbind())
+    }
+
+    /// Encrypt any buffer-protocol object into a caller-supplied writable
+    /// buffer (bytearray, memoryview, mmap, ...). `out` needs at least
+    /// len(plaintext) + MESSAGE_OVERHEAD bytes. Returns the bytes written.
+    fn encrypt_into(&self, py: Python<'_>, session_id: &[u8], plaintext: PyBuffer<u8>, out: PyBuffer<u8>) -> PyResult<usize> {
+        let input = buffers::as_slice(&plaintext)?;
+        let output = buffers::as_mut_slice(&out)?;
+        buffers::check_disjoint(input, output)?;
+        if output.len() < input.len() + MESSAGE_OVERHEAD {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(format!(
+                "output buffer too small: need {} bytes, got {}", input.len() + MESSAGE_OVERHEAD, output.len())));
+        }
+        // Header, nonce, ciphertext and tag are written straight into `out`.
+        py.allow_threads(|| self.inner.encrypt_message_into(session_id, input, None, output))
             .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))
     }
+
+    /// Decrypt any buffer-protocol object into a caller-supplied writable
+    /// buffer of at least len(ciphertext) - MESSAGE_OVERHEAD bytes.
+    /// Returns the plaintext length.
+    fn decrypt_into(&self, py: Python<'_>, session_id: &[u8], ciphertext: PyBuffer<u8>, out: PyBuffer<u8>) -> PyResult<usize> {
+        let input = buffers::as_slice(&ciphertext)?;
+        let output = buffers::as_mut_slice(&out)?;
+        buffers::check_disjoint(input, output)?;
+        let needed = input.len().saturating_sub(MESSAGE_OVERHEAD);
+        if output.len() < needed {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(format!(
+                "output buffer too small: need {} bytes, got {}", needed, output.len())));
+        }
+        py.allow_threads(|| self.inner.decrypt_message_into(session_id, input, None, output))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))
+    }
+
+    /// Encrypt a burst of messages for one session: one session lock and one
+    /// persist for the whole list, with the GIL released. Returns ciphertexts
+    /// in order; raises on the first failure, leaving the session unchanged.
+    fn encrypt_batch(&self, py: Python<'_>, session_id: &[u8], plaintexts: Vec<&[u8]>) -> PyResult<Vec<Py<PyBytes>>> {
+        let out = py.allow_threads(|| self.inner.encrypt_batch(session_id, &plaintexts, None))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(parallel::to_bytes_list(py, out))
+    }
+
+    /// Decrypt a burst of messages for one session under one lock and one
+    /// persist. Messages that fail to decrypt come back as None.
+    fn decrypt_batch(&self, py: Python<'_>, session_id: &[u8], ciphertexts: Vec<&[u8]>) -> PyResult<Vec<Option<Py<PyBytes>>>> {
+        let out = py.allow_threads(|| self.inner.decrypt_batch(session_id, &ciphertexts, None))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(out
+            .into_iter()
+            .map(|res| res.ok().map(|data| PyBytes::new_bound(py, &data).unbind()))
+            .collect())
+    }
+
+    /// Encrypt a list of (session_id, plaintext) pairs (fan-out). Sessions are
+    /// spread across a Rust thread pool with the GIL released; messages for the
+    /// same session keep their order. Returns ciphertexts in input order.
+    /// Raises, naming the session, if any session's batch fails.
+    #[pyo3(signature = (items, threads=None))]
+    fn encrypt_many(&self, py: Python<'_>, items: Vec<(&[u8], &[u8])>, threads: Option<usize>) -> PyResult<Vec<Py<PyBytes>>> {
+        let out = py.allow_threads(|| {
+            parallel::install(threads, || parallel::per_session(&items, |sid, batch| self.inner.encrypt_batch(sid, batch, None)))
+        })??;
+        Ok(parallel::to_bytes_list(py, out))
+    }
+
+    /// Decrypt a list of (session_id, ciphertext) pairs, sessions in parallel.
+    /// As with decrypt_batch, messages that fail to decrypt come back as None;
+    /// an unknown session raises, naming it.
+    #[pyo3(signature = (items, threads=None))]
+    fn decrypt_many(&self, py: Python<'_>, items: Vec<(&[u8], &[u8])>, threads: Option<usize>) -> PyResult<Vec<Option<Py<PyBytes>>>> {
+        let out = py.allow_threads(|| {
+            parallel::install(threads, || parallel::per_session(&items, |sid, batch| {
+                Ok(self.inner.decrypt_batch(sid, batch, None)?.into_iter().map(Result::ok).collect::<Vec<_>>())
+            }))
+        })??;
+        Ok(out
+            .into_iter()
+            .map(|res| res.map(|data| PyBytes::new_bound(py, &data).unbind()))
+            .collect())
+    }
+
+    /// Our sender key for a group, as a distribution message to send each
+    /// member once over their pairwise session (encrypt_message).
+    fn group_sender_key(&self, py: Python<'_>, group_id: &[u8]) -> PyResult<Py<PyBytes>> {
+        let out = py.allow_threads(|| self.inner.group_sender_key(group_id))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PyBytes::new_bound(py, &out).unbind())
+    }
+
+    /// Replace our sender key for a group (e.g. after a member leaves) and
+    /// return the new distribution message.
+    fn rotate_group_sender_key(&self, py: Python<'_>, group_id: &[u8]) -> PyResult<Py<PyBytes>> {
+        let out = py.allow_threads(|| self.inner.rotate_group_sender_key(group_id))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PyBytes::new_bound(py, &out).unbind())
+    }
+
+    /// Install a sender key received from sender_id. Returns its group id.
+    fn process_group_sender_key(&self, py: Python<'_>, sender_id: &[u8], distribution: &[u8]) -> PyResult<Py<PyBytes>> {
+        let out = py.allow_threads(|| self.inner.process_group_sender_key(sender_id, distribution))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PyBytes::new_bound(py, &out).unbind())
+    }
+
+    /// Encrypt a group message once; send the same bytes to every member.
+    fn group_encrypt(&self, py: Python<'_>, group_id: &[u8], plaintext: PyBuffer<u8>) -> PyResult<Py<PyBytes>> {
+        let plaintext = buffers::as_slice(&plaintext)?;
+        let out = py.allow_threads(|| self.inner.group_encrypt(group_id, plaintext))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PyBytes::new_bound(py, &out).unbind())
+    }
+
+    /// Decrypt a group message from sender_id.
+    fn group_decrypt(&self, py: Python<'_>, group_id: &[u8], sender_id: &[u8], message: PyBuffer<u8>) -> PyResult<Py<PyBytes>> {
+        let message = buffers::as_slice(&message)?;
+        let out = py.allow_threads(|| self.inner.group_decrypt(group_id, sender_id, message))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PyBytes::new_bound(py, &out).unbind())
+    }
 }
 
 /// Session Handle wrapper
@@ -63,8 +286,68 @@ pub struct PySessionHandle {
 
 #[pymethods]
 impl PySessionHandle {
-    fn peer_id(&self) -> Vec<u8> {
-        self.inner.peer_id().to_vec()
+    fn peer_id(&self, py: Python<'_>) -> Py<PyBytes> {
+        PyBytes::new_bound(py, self.inner.peer_id()).unbind()
+    }
+}
+
+/// Chunk AEAD for file containers: a per-stream key and index-derived nonces,
+/// so chunks can be sealed and opened independently and in any order.
+#[pyclass]
+pub struct PyChunkCipher {
+    inner: CryptoHandler,
+}
+
+#[pymethods]
+impl PyChunkCipher {
+    #[new]
+    fn new(key: &[u8]) -> PyResult<Self> {
+        let inner = CryptoHandler::new(key).map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(format!("{}", e)))?;
+        Ok(PyChunkCipher { inner })
+    }
+
+    #[pyo3(signature = (index, plaintext, associated_data=b"".as_slice()))]
+    fn seal(&self, py: Python<'_>, index: u64, plaintext: &[u8], associated_data: &[u8]) -> PyResult<Py<PyBytes>> {
+        let out = py.allow_threads(|| self.inner.encrypt_chunk(index, plaintext, associated_data))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PyBytes::new_bound(py, &out).unbind())
+    }
+
+    #[pyo3(signature = (index, ciphertext, associated_data=b"".as_slice()))]
+    fn open(&self, py: Python<'_>, index: u64, ciphertext: &[u8], associated_data: &[u8]) -> PyResult<Py<PyBytes>> {
+        let out = py.allow_threads(|| self.inner.decrypt_chunk(index, ciphertext, associated_data))
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+        Ok(PyBytes::new_bound(py, &out).unbind())
+    }
+
+    /// Seal a list of chunks with indexes first_index, first_index + 1, ...
+    /// in parallel on a Rust thread pool, with the GIL released.
+    #[pyo3(signature = (chunks, first_index=0, associated_data=b"".as_slice(), threads=None))]
+    fn seal_many(&self, py: Python<'_>, chunks: Vec<&[u8]>, first_index: u64, associated_data: &[u8], threads: Option<usize>) -> PyResult<Vec<Py<PyBytes>>> {
+        let out = py.allow_threads(|| {
+            parallel::install(threads, || parallel::seal_chunks(&self.inner, &chunks, first_index, associated_data))
+        })??;
+        Ok(parallel::to_bytes_list(py, out))
+    }
+
+    /// Split `data` into chunk_size pieces and seal them in parallel.
+    #[pyo3(signature = (data, chunk_size, first_index=0, associated_data=b"".as_slice(), threads=None))]
+    fn seal_buffer(&self, py: Python<'_>, data: &[u8], chunk_size: usize, first_index: u64, associated_data: &[u8], threads: Option<usize>) -> PyResult<Vec<Py<PyBytes>>> {
+        if chunk_size == 0 {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>("chunk_size must be positive"));
+        }
+        let chunks: Vec<&[u8]> = data.chunks(chunk_size).collect();
+        self.seal_many(py, chunks, first_index, associated_data, threads)
+    }
+
+    /// Open a list of consecutive chunks in parallel. Raises, naming the
+    /// chunk index, if a chunk fails to authenticate.
+    #[pyo3(signature = (chunks, first_index=0, associated_data=b"".as_slice(), threads=None))]
+    fn open_many(&self, py: Python<'_>, chunks: Vec<&[u8]>, first_index: u64, associated_data: &[u8], threads: Option<usize>) -> PyResult<Vec<Py<PyBytes>>> {
+        let out = py.allow_threads(|| {
+            parallel::install(threads, || parallel::open_chunks(&self.inner, &chunks, first_index, associated_data))
+        })??;
+        Ok(parallel::to_bytes_list(py, out))
     }
 }
 
@@ -74,5 +357,8 @@ fn _secure_protocol(_py: Python, m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<PyConfig>()?;
     m.add_class::<PySecureContext>()?;
     m.add_class::<PySessionHandle>()?;
+    m.add_class::<PyChunkCipher>()?;
+    m.add("MESSAGE_OVERHEAD", MESSAGE_OVERHEAD)?;
+    m.add("GROUP_MESSAGE_OVERHEAD", GROUP_MESSAGE_OVERHEAD)?;
     Ok(())
 }
@@ -0,0 +1,125 @@
+//! Rayon-backed helpers for the batch APIs.
+//!
+//! Work is only parallelised where it is independent: chunks sealed under a
+//! stream key with index-derived nonces, or messages for *different* sessions.
+//! Messages for the same session are always processed in order on one worker,
+//! since every ratchet step depends on the previous one.
+
+use pyo3::prelude::*;
+use pyo3::types::PyBytes;
+use rayon::prelude::*;
+use secure_protocol::{CryptoError, CryptoHandler, ProtocolError, ProtocolResult};
+use std::collections::HashMap;
+use std::sync::{Arc, Mutex, OnceLock};
+
+/// A fan-out call failed for one of its sessions.
+pub struct SessionFailure {
+    session_id: Vec<u8>,
+    error: ProtocolError,
+}
+
+impl From<SessionFailure> for PyErr {
+    fn from(f: SessionFailure) -> Self {
+        PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!(
+            "session {}: {}", String::from_utf8_lossy(&f.session_id), f.error))
+    }
+}
+
+/// A chunk of a parallel seal or open failed.
+pub struct ChunkFailure {
+    index: u64,
+    error: CryptoError,
+}
+
+impl From<ChunkFailure> for PyErr {
+    fn from(f: ChunkFailure) -> Self {
+        PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("chunk {}: {}", f.index, f.error))
+    }
+}
+
+/// Thread pools keyed by size, so `threads=n` does not spawn threads per call.
+fn sized_pool(threads: usize) -> PyResult<Arc<rayon::ThreadPool>> {
+    static POOLS: OnceLock<Mutex<HashMap<usize, Arc<rayon::ThreadPool>>>> = OnceLock::new();
+    let mut pools = POOLS.get_or_init(Default::default).lock().unwrap();
+    if let Some(pool) = pools.get(&threads) {
+        return Ok(pool.clone());
+    }
+    let pool = rayon::ThreadPoolBuilder::new()
+        .num_threads(threads)
+        .build()
+        .map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(format!("{}", e)))?;
+    let pool = Arc::new(pool);
+    pools.insert(threads, pool.clone());
+    Ok(pool)
+}
+
+/// Run `f` on the global rayon pool, or on a pool of exactly `threads` workers.
+pub fn install<T, F>(threads: Option<usize>, f: F) -> PyResult<T>
+where
+    T: Send,
+    F: FnOnce() -> T + Send,
+{
+    match threads {
+        None => Ok(f()),
+        Some(0) => Err(PyErr::new::<pyo3::exceptions::PyValueError, _>("threads must be at least 1")),
+        Some(n) => Ok(sized_pool(n)?.install(f)),
+    }
+}
+
+/// Apply the batch operation `op` to (session_id, data) pairs: each session's
+/// messages go to one call, in order, and sessions run in parallel. Results
+/// are returned in input order; a failed call names its session.
+pub fn per_session<T, F>(items: &[(&[u8], &[u8])], op: F) -> Result<Vec<T>, SessionFailure>
+where
+    T: Send,
+    F: Fn(&[u8], &[&[u8]]) -> ProtocolResult<Vec<T>> + Sync,
+{
+    let mut groups: HashMap<&[u8], Vec<usize>> = HashMap::new();
+    for (i, (session_id, _)) in items.iter().enumerate() {
+        groups.entry(*session_id).or_default().push(i);
+    }
+
+    let done = groups
+        .into_par_iter()
+        .map(|(session_id, indexes)| {
+            let batch: Vec<&[u8]> = indexes.iter().map(|&i| items[i].1).collect();
+            op(session_id, &batch)
+                .map(|out| indexes.into_iter().zip(out).collect::<Vec<_>>())
+                .map_err(|error| SessionFailure { session_id: session_id.to_vec(), error })
+        })
+        .collect::<Result<Vec<_>, _>>()?;
+
+    let mut out: Vec<Option<T>> = (0..items.len()).map(|_| None).collect();
+    for (i, data) in done.into_iter().flatten() {
+        out[i] = Some(data);
+    }
+    Ok(out.into_iter().map(|data| data.expect("every item belongs to one session")).collect())
+}
+
+/// Seal consecutive chunks starting at `first_index`.
+pub fn seal_chunks(handler: &CryptoHandler, chunks: &[&[u8]], first_index: u64, ad: &[u8]) -> Result<Vec<Vec<u8>>, ChunkFailure> {
+    chunks
+        .par_iter()
+        .enumerate()
+        .map(|(i, chunk)| {
+            let index = first_index + i as u64;
+            handler.encrypt_chunk(index, chunk, ad).map_err(|error| ChunkFailure { index, error })
+        })
+        .collect()
+}
+
+/// Open consecutive chunks starting at `first_index`.
+pub fn open_chunks(handler: &CryptoHandler, chunks: &[&[u8]], first_index: u64, ad: &[u8]) -> Result<Vec<Vec<u8>>, ChunkFailure> {
+    chunks
+        .par_iter()
+        .enumerate()
+        .map(|(i, chunk)| {
+            let index = first_index + i as u64;
+            handler.decrypt_chunk(index, chunk, ad).map_err(|error| ChunkFailure { index, error })
+        })
+        .collect()
+}
+
+pub fn to_bytes_list(py: Python<'_>, items: Vec<Vec<u8>>) -> Vec<Py<PyBytes>> {
+    items.iter().map(|v| PyBytes::new_bound(py, v).unbind()).collect()
+}
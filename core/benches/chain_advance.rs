@@ -0,0 +1,42 @@
+//! Symmetric-chain stepping rate, reported as keys/s.
+//!
+//! Run with `cargo bench -p secure-protocol-core --bench chain_advance`.
+//! `next_message_key` steps one key at a time as the send path does;
+//! `advance` derives a batch through the bulk skipped-key API. `fresh_chain`
+//! starts from a deserialized chain, so the first step builds the HMAC lazily.
+
+use criterion::{black_box, criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use secure_protocol::ratchet::ChainKey;
+
+const COUNTS: [u64; 3] = [1, 100, 2000];
+
+fn bench_chain_advance(c: &mut Criterion) {
+    let mut group = c.benchmark_group("chain_advance");
+    for count in COUNTS {
+        group.throughput(Throughput::Elements(count));
+
+        group.bench_with_input(BenchmarkId::new("next_message_key", count), &count, |b, &n| {
+            let mut chain = ChainKey::new([7u8; 32]);
+            b.iter(|| {
+                for _ in 0..n {
+                    black_box(chain.next_message_key());
+                }
+            })
+        });
+        group.bench_with_input(BenchmarkId::new("advance", count), &count, |b, &n| {
+            let mut chain = ChainKey::new([7u8; 32]);
+            b.iter(|| chain.advance(n, |index, key| { black_box((index, key)); }))
+        });
+        group.bench_with_input(BenchmarkId::new("fresh_chain", count), &count, |b, &n| {
+            let json = serde_json::to_vec(&ChainKey::new([7u8; 32])).unwrap();
+            b.iter(|| {
+                let mut chain: ChainKey = serde_json::from_slice(&json).unwrap();
+                chain.advance(n, |index, key| { black_box((index, key)); })
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, bench_chain_advance);
+criterion_main!(benches);
@@ -0,0 +1,41 @@
+//! Message encryption throughput with the thread-local nonce generator.
+//!
+//! Run with `cargo bench -p secure-protocol-core --bench encrypt_nonce`.
+//! `per_call_rng` reproduces the old behaviour (a new `SecureRandom`, seeded
+//! from the OS and the clock, for every nonce) as the baseline.
+
+use criterion::{black_box, criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use secure_protocol::crypto::{CryptoHandler, Encryptor, SecureRandom, NONCE_LENGTH};
+
+const SIZES: [usize; 3] = [64, 1024, 64 * 1024];
+
+fn bench_encrypt_nonce(c: &mut Criterion) {
+    let key = [7u8; 32];
+    let handler = CryptoHandler::new(&key).unwrap();
+    let encryptor = Encryptor::new(&key, u64::MAX).unwrap();
+
+    let mut group = c.benchmark_group("encrypt_nonce");
+    for size in SIZES {
+        let plaintext = vec![0u8; size];
+        group.throughput(Throughput::Elements(1));
+
+        group.bench_with_input(BenchmarkId::new("per_call_rng", size), &plaintext, |b, pt| {
+            b.iter(|| {
+                let mut rng = SecureRandom::new().unwrap();
+                let mut nonce = [0u8; NONCE_LENGTH];
+                rng.fill_bytes(&mut nonce);
+                black_box(handler.encrypt_with_nonce(pt, b"", &nonce).unwrap())
+            })
+        });
+        group.bench_with_input(BenchmarkId::new("handler_encrypt", size), &plaintext, |b, pt| {
+            b.iter(|| black_box(handler.encrypt(pt, b"").unwrap()))
+        });
+        group.bench_with_input(BenchmarkId::new("encryptor_encrypt_message", size), &plaintext, |b, pt| {
+            b.iter(|| black_box(encryptor.encrypt_message(pt, b"context").unwrap()))
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, bench_encrypt_nonce);
+criterion_main!(benches);
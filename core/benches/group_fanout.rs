@@ -0,0 +1,57 @@
+//! Cost of sending one message to a group, pairwise vs. sender keys.
+//!
+//! Run with `cargo bench -p secure-protocol-core --bench group_fanout`.
+//! `pairwise` encrypts the message once per member with their Double Ratchet
+//! session, so it grows linearly with the group. `sender_key` encrypts it once
+//! with the sender's chain, whatever the size; `sender_key_context` adds the
+//! store write through `SecureContext::group_encrypt`. Throughput is members
+//! reached per second.
+
+use criterion::{black_box, criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use rand_core::OsRng;
+use secure_protocol::group::SenderKeyState;
+use secure_protocol::{Config, DoubleRatchetSession, Durability, SecureContext};
+use x25519_dalek::{PublicKey, StaticSecret};
+
+const GROUP_SIZES: [usize; 3] = [10, 100, 1000];
+
+fn session() -> DoubleRatchetSession {
+    let remote = PublicKey::from(&StaticSecret::random_from_rng(&mut OsRng));
+    let local = StaticSecret::random_from_rng(&mut OsRng);
+    DoubleRatchetSession::from_shared_secret(&[7u8; 32], local, remote, Config::default()).unwrap()
+}
+
+fn bench_group_fanout(c: &mut Criterion) {
+    let payload = [0u8; 256];
+    let mut group = c.benchmark_group("group_fanout");
+    for size in GROUP_SIZES {
+        group.throughput(Throughput::Elements(size as u64));
+
+        group.bench_with_input(BenchmarkId::new("pairwise", size), &size, |b, &n| {
+            let mut sessions: Vec<_> = (0..n).map(|_| session()).collect();
+            b.iter(|| {
+                for session in sessions.iter_mut() {
+                    black_box(session.encrypt(&payload, b"").unwrap());
+                }
+            })
+        });
+        group.bench_with_input(BenchmarkId::new("sender_key", size), &size, |b, _| {
+            let mut state = SenderKeyState::generate().unwrap();
+            b.iter(|| black_box(state.encrypt(b"group", &payload).unwrap()))
+        });
+        group.bench_with_input(BenchmarkId::new("sender_key_context", size), &size, |b, _| {
+            let dir = tempfile::tempdir().unwrap();
+            let config = Config {
+                db_path: dir.path().join("db"),
+                durability: Durability::GroupCommit,
+                ..Config::default()
+            };
+            let ctx = SecureContext::new(config).unwrap();
+            b.iter(|| black_box(ctx.group_encrypt(b"group", &payload).unwrap()))
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, bench_group_fanout);
+criterion_main!(benches);
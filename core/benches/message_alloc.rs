@@ -0,0 +1,84 @@
+//! Heap allocations per ratchet message: `encrypt` (one output Vec) vs.
+//! `encrypt_into` a reused buffer.
+//!
+//! Run with `cargo bench -p secure-protocol-core --bench message_alloc`.
+//! A counting global allocator reports allocations and bytes per message
+//! for each size before the timing runs.
+
+use criterion::{black_box, criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use rand_core::OsRng;
+use secure_protocol::{Config, DoubleRatchetSession, MESSAGE_OVERHEAD};
+use std::alloc::{GlobalAlloc, Layout, System};
+use std::sync::atomic::{AtomicU64, Ordering};
+use x25519_dalek::{PublicKey, StaticSecret};
+
+struct CountingAlloc;
+
+static ALLOCATIONS: AtomicU64 = AtomicU64::new(0);
+static ALLOCATED_BYTES: AtomicU64 = AtomicU64::new(0);
+
+unsafe impl GlobalAlloc for CountingAlloc {
+    unsafe fn alloc(&self, layout: Layout) -> *mut u8 {
+        ALLOCATIONS.fetch_add(1, Ordering::Relaxed);
+        ALLOCATED_BYTES.fetch_add(layout.size() as u64, Ordering::Relaxed);
+        System.alloc(layout)
+    }
+
+    unsafe fn dealloc(&self, ptr: *mut u8, layout: Layout) {
+        System.dealloc(ptr, layout)
+    }
+}
+
+#[global_allocator]
+static GLOBAL: CountingAlloc = CountingAlloc;
+
+const SIZES: [usize; 3] = [64, 1024, 64 * 1024];
+const SAMPLE_MESSAGES: u64 = 1_000;
+
+fn session() -> DoubleRatchetSession {
+    let remote = PublicKey::from(&StaticSecret::random_from_rng(&mut OsRng));
+    let local = StaticSecret::random_from_rng(&mut OsRng);
+    DoubleRatchetSession::from_shared_secret(&[7u8; 32], local, remote, Config::default()).unwrap()
+}
+
+/// (allocations, bytes) per call of `f`, after one warm-up call
+fn per_message(mut f: impl FnMut()) -> (f64, f64) {
+    f();
+    let (count, bytes) = (ALLOCATIONS.load(Ordering::Relaxed), ALLOCATED_BYTES.load(Ordering::Relaxed));
+    for _ in 0..SAMPLE_MESSAGES {
+        f();
+    }
+    let count = ALLOCATIONS.load(Ordering::Relaxed) - count;
+    let bytes = ALLOCATED_BYTES.load(Ordering::Relaxed) - bytes;
+    (count as f64 / SAMPLE_MESSAGES as f64, bytes as f64 / SAMPLE_MESSAGES as f64)
+}
+
+fn bench_message_alloc(c: &mut Criterion) {
+    let mut group = c.benchmark_group("message_alloc");
+    for size in SIZES {
+        let plaintext = vec![0u8; size];
+        let mut out = vec![0u8; size + MESSAGE_OVERHEAD];
+        let mut s = session();
+
+        let (allocs, bytes) = per_message(|| {
+            black_box(s.encrypt(&plaintext, b"").unwrap());
+        });
+        println!("message_alloc/encrypt/{}: {:.2} allocations, {:.0} bytes per message", size, allocs, bytes);
+        let (allocs, bytes) = per_message(|| {
+            black_box(s.encrypt_into(&plaintext, b"", &mut out).unwrap());
+        });
+        println!("message_alloc/encrypt_into/{}: {:.2} allocations, {:.0} bytes per message", size, allocs, bytes);
+
+        group.throughput(Throughput::Bytes(size as u64));
+        group.bench_with_input(BenchmarkId::new("encrypt", size), &plaintext, |b, pt| {
+            b.iter(|| black_box(s.encrypt(pt, b"").unwrap()))
+        });
+        group.bench_with_input(BenchmarkId::new("encrypt_into", size), &plaintext, |b, pt| {
+            b.iter(|| black_box(s.encrypt_into(pt, b"", &mut out).unwrap()))
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, bench_message_alloc);
+criterion_main!(benches);
@@ -0,0 +1,50 @@
+//! Session state encoding: binary codec vs. legacy JSON.
+//!
+//! Run with `cargo bench -p secure-protocol-core --bench session_codec`.
+//! Stored sizes are printed once per case before timing starts.
+
+use criterion::{black_box, criterion_group, criterion_main, BenchmarkId, Criterion};
+use secure_protocol::{Config, DoubleRatchetSession, DoubleRatchetState};
+
+fn state_with_skipped(count: usize) -> DoubleRatchetState {
+    let session = DoubleRatchetSession::new(Config::default()).unwrap();
+    let mut state = DoubleRatchetState::decode(&session.serialize_state().unwrap()).unwrap();
+    for i in 0..count {
+        let mut dh = [0u8; 32];
+        dh[..8].copy_from_slice(&((i / 100) as u64).to_le_bytes());
+        state.skipped_message_keys.insert((i as u64, dh), [i as u8; 32]);
+    }
+    state
+}
+
+fn bench_session_codec(c: &mut Criterion) {
+    let mut group = c.benchmark_group("session_codec");
+
+    for skipped in [0usize, 2000] {
+        let state = state_with_skipped(skipped);
+        let encoded = state.encode();
+        println!("session_codec/binary/{} skipped: {} bytes", skipped, encoded.len());
+
+        group.bench_with_input(BenchmarkId::new("binary_serialize", skipped), &state, |b, state| {
+            b.iter(|| black_box(state.encode()))
+        });
+        group.bench_with_input(BenchmarkId::new("binary_deserialize", skipped), &encoded, |b, data| {
+            b.iter(|| black_box(DoubleRatchetState::decode(data).unwrap()))
+        });
+
+        let json = serde_json::to_vec(&state).unwrap();
+        println!("session_codec/json/{} skipped: {} bytes", skipped, json.len());
+
+        group.bench_with_input(BenchmarkId::new("json_serialize", skipped), &state, |b, state| {
+            b.iter(|| black_box(serde_json::to_vec(state).unwrap()))
+        });
+        group.bench_with_input(BenchmarkId::new("json_deserialize", skipped), &json, |b, data| {
+            b.iter(|| black_box(DoubleRatchetState::decode(data).unwrap()))
+        });
+    }
+
+    group.finish();
+}
+
+criterion_group!(benches, bench_session_codec);
+criterion_main!(benches);
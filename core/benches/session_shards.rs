@@ -0,0 +1,87 @@
+//! Concurrent encryption across peers through the sharded session map.
+//!
+//! Run with `cargo bench -p secure-protocol-core --bench session_shards`.
+//! Every thread encrypts for its own set of peers, so the only shared state is
+//! the session map itself; messages/s should grow close to linearly with the
+//! thread count. Group commit keeps fsync out of the measurement.
+
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use rand_core::OsRng;
+use secure_protocol::{Config, DoubleRatchetSession, Durability, SessionManager};
+use std::sync::Arc;
+use std::time::{Duration, Instant};
+use x25519_dalek::{PublicKey, StaticSecret};
+
+const PEERS_PER_THREAD: usize = 64;
+const MESSAGES_PER_THREAD: u64 = 2_000;
+
+fn peer_id(thread: usize, peer: usize) -> Vec<u8> {
+    format!("peer-{}-{}", thread, peer).into_bytes()
+}
+
+fn manager_with_peers(dir: &std::path::Path, threads: usize) -> SessionManager {
+    let config = Config {
+        durability: Durability::GroupCommit,
+        flush_interval_ms: 1_000,
+        flush_max_pending: usize::MAX,
+        session_cache_capacity: 0,
+        ..Config::default()
+    };
+    let db = Arc::new(sled::open(dir).unwrap());
+    let manager = SessionManager::new(config.clone(), db);
+    for thread in 0..threads {
+        for peer in 0..PEERS_PER_THREAD {
+            let remote = PublicKey::from(&StaticSecret::random_from_rng(&mut OsRng));
+            let local = StaticSecret::random_from_rng(&mut OsRng);
+            let session = DoubleRatchetSession::from_shared_secret(&[7u8; 32], local, remote, config.clone()).unwrap();
+            manager.insert_session(&peer_id(thread, peer), session).unwrap();
+        }
+    }
+    manager
+}
+
+fn encrypt_for_own_peers(manager: &SessionManager, thread: usize, messages: u64) {
+    let peers: Vec<Vec<u8>> = (0..PEERS_PER_THREAD).map(|peer| peer_id(thread, peer)).collect();
+    let payload = [0u8; 256];
+    for i in 0..messages {
+        let peer = &peers[i as usize % peers.len()];
+        let session = manager.get_session(peer).unwrap();
+        let mut session = session.write();
+        session.encrypt(&payload, b"").unwrap();
+        manager.commit_session(peer, &*session).unwrap();
+    }
+}
+
+fn bench_session_shards(c: &mut Criterion) {
+    let max_threads = std::thread::available_parallelism().map(|n| n.get()).unwrap_or(4);
+    let mut thread_counts: Vec<usize> = (0..).map(|p| 1usize << p).take_while(|&n| n < max_threads).collect();
+    thread_counts.push(max_threads);
+
+    let mut group = c.benchmark_group("session_shards");
+    for threads in thread_counts {
+        let dir = tempfile::tempdir().unwrap();
+        let manager = manager_with_peers(dir.path(), threads);
+
+        group.throughput(Throughput::Elements(threads as u64 * MESSAGES_PER_THREAD));
+        group.bench_with_input(BenchmarkId::new("encrypt", threads), &threads, |b, &threads| {
+            b.iter_custom(|iters| {
+                let mut total = Duration::ZERO;
+                for _ in 0..iters {
+                    let start = Instant::now();
+                    std::thread::scope(|scope| {
+                        for thread in 0..threads {
+                            let manager = &manager;
+                            scope.spawn(move || encrypt_for_own_peers(manager, thread, MESSAGES_PER_THREAD));
+                        }
+                    });
+                    total += start.elapsed();
+                }
+                total
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, bench_session_shards);
+criterion_main!(benches);
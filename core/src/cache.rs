@@ -0,0 +1,151 @@
+//! Session cache
+//! Capacity-bounded CLOCK cache for sessions loaded from the store.
+
+use crate::DoubleRatchetSession;
+use parking_lot::RwLock;
+use std::collections::HashMap;
+use std::sync::atomic::{AtomicBool, AtomicU64, Ordering};
+use std::sync::Arc;
+
+pub(crate) type SharedSession = Arc<RwLock<DoubleRatchetSession>>;
+
+/// Session cache counters
+#[derive(Clone, Copy, Debug, Default, PartialEq, Eq)]
+pub struct CacheStats {
+    /// Lookups served from memory
+    pub hits: u64,
+    /// Lookups that had to go to the store
+    pub misses: u64,
+    /// Sessions written back and dropped to stay within capacity
+    pub evictions: u64,
+    /// Sessions currently cached
+    pub entries: usize,
+    /// Configured capacity (0 = unbounded)
+    pub capacity: usize,
+}
+
+struct Slot {
+    key: Vec<u8>,
+    session: SharedSession,
+    referenced: AtomicBool,
+}
+
+/// CLOCK (second-chance) cache: every hit sets the slot's reference bit; when
+/// full, the hand sweeps the slots clearing bits and evicts the first
+/// unreferenced session nobody else holds. Sessions still in use (a
+/// `SessionHandle` or an in-flight message) are never evicted, so the cache
+/// may briefly exceed its capacity.
+pub(crate) struct SessionCache {
+    index: HashMap<Vec<u8>, usize>,
+    slots: Vec<Slot>,
+    hand: usize,
+    capacity: usize,
+    hits: AtomicU64,
+    misses: AtomicU64,
+    evictions: u64,
+}
+
+impl SessionCache {
+    pub(crate) fn new(capacity: usize) -> Self {
+        Self {
+            index: HashMap::new(),
+            slots: Vec::new(),
+            hand: 0,
+            capacity,
+            hits: AtomicU64::new(0),
+            misses: AtomicU64::new(0),
+            evictions: 0,
+        }
+    }
+    
+    /// Look up a session, counting the hit or miss
+    pub(crate) fn get(&self, key: &[u8]) -> Option<SharedSession> {
+        match self.index.get(key) {
+            Some(&i) => {
+                self.hits.fetch_add(1, Ordering::Relaxed);
+                let slot = &self.slots[i];
+                slot.referenced.store(true, Ordering::Relaxed);
+                Some(slot.session.clone())
+            }
+            None => {
+                self.misses.fetch_add(1, Ordering::Relaxed);
+                None
+            }
+        }
+    }
+    
+    /// Look up without touching counters or reference bits
+    pub(crate) fn peek(&self, key: &[u8]) -> Option<&SharedSession> {
+        self.index.get(key).map(|&i| &self.slots[i].session)
+    }
+    
+    /// Insert or replace a session. `write_back` is called on each eviction
+    /// candidate and must persist it; returning false keeps it cached.
+    pub(crate) fn insert(
+        &mut self,
+        key: &[u8],
+        session: SharedSession,
+        write_back: impl FnMut(&[u8], &SharedSession) -> bool,
+    ) {
+        if let Some(&i) = self.index.get(key) {
+            self.slots[i].session = session;
+            self.slots[i].referenced.store(true, Ordering::Relaxed);
+            return;
+        }
+        self.make_room(write_back);
+        self.index.insert(key.to_vec(), self.slots.len());
+        self.slots.push(Slot {
+            key: key.to_vec(),
+            session,
+            referenced: AtomicBool::new(true),
+        });
+    }
+    
+    pub(crate) fn remove(&mut self, key: &[u8]) -> Option<SharedSession> {
+        let i = self.index.get(key).copied()?;
+        Some(self.remove_slot(i))
+    }
+    
+    fn remove_slot(&mut self, i: usize) -> SharedSession {
+        let slot = self.slots.swap_remove(i);
+        self.index.remove(&slot.key);
+        if let Some(moved) = self.slots.get(i) {
+            *self.index.get_mut(&moved.key).expect("cache index out of sync") = i;
+        }
+        slot.session
+    }
+    
+    fn make_room(&mut self, mut write_back: impl FnMut(&[u8], &SharedSession) -> bool) {
+        if self.capacity == 0 {
+            return;
+        }
+        // Two sweeps clear every reference bit; after that only pinned or
+        // unwritable sessions remain and we give up rather than spin.
+        let mut budget = self.slots.len() * 2;
+        while self.slots.len() >= self.capacity && budget > 0 {
+            budget -= 1;
+            if self.hand >= self.slots.len() {
+                self.hand = 0;
+            }
+            let slot = &self.slots[self.hand];
+            let pinned = Arc::strong_count(&slot.session) > 1;
+            if slot.referenced.swap(false, Ordering::Relaxed) || pinned || !write_back(&slot.key, &slot.session) {
+                self.hand += 1;
+                continue;
+            }
+            // swap_remove moves the last slot under the hand; look at it next.
+            self.remove_slot(self.hand);
+            self.evictions += 1;
+        }
+    }
+    
+    pub(crate) fn stats(&self) -> CacheStats {
+        CacheStats {
+            hits: self.hits.load(Ordering::Relaxed),
+            misses: self.misses.load(Ordering::Relaxed),
+            evictions: self.evictions,
+            entries: self.slots.len(),
+            capacity: self.capacity,
+        }
+    }
+}
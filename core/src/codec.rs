@@ -0,0 +1,209 @@
+//! Compact binary record encoding
+//! Versioned framing and primitives for persisted state (sessions, keystore).
+//!
+//! Record layout: MAGIC (1) | kind (1) | version (1) | body.
+//! Integers in the body are LEB128 varints, keys are raw fixed-size arrays.
+//! Legacy records were JSON objects and always start with `{`, which never
+//! collides with MAGIC, so readers can tell the formats apart.
+
+use crate::error::{ProtocolError, ProtocolResult};
+
+/// First byte of every binary record
+pub(crate) const MAGIC: u8 = 0xB5;
+/// Current body version
+pub(crate) const VERSION: u8 = 1;
+
+/// Record kinds
+pub(crate) const KIND_SESSION: u8 = 1;
+pub(crate) const KIND_IDENTITY: u8 = 2;
+pub(crate) const KIND_PREKEY: u8 = 3;
+pub(crate) const KIND_SIGNED_PREKEY: u8 = 4;
+pub(crate) const KIND_SESSION_CORE: u8 = 5;
+pub(crate) const KIND_CHAIN: u8 = 6;
+pub(crate) const KIND_SENDER_KEY: u8 = 7;
+pub(crate) const KIND_SENDER_KEY_DISTRIBUTION: u8 = 8;
+
+/// Kind byte of a binary record
+pub(crate) fn record_kind(data: &[u8]) -> Option<u8> {
+    match data {
+        [MAGIC, kind, ..] => Some(*kind),
+        _ => None,
+    }
+}
+
+/// Whether `data` is a legacy JSON record
+pub(crate) fn is_legacy_json(data: &[u8]) -> bool {
+    data.first() == Some(&b'{')
+}
+
+fn malformed() -> ProtocolError {
+    ProtocolError::InternalError("Deserialization failed".into())
+}
+
+/// Append-only record writer
+pub(crate) struct Writer {
+    buf: Vec<u8>,
+}
+
+impl Writer {
+    /// Start a record of `kind`; `capacity` is a hint for the body size
+    pub(crate) fn new(kind: u8, capacity: usize) -> Self {
+        let mut buf = Vec::with_capacity(3 + capacity);
+        buf.extend_from_slice(&[MAGIC, kind, VERSION]);
+        Self { buf }
+    }
+    
+    pub(crate) fn u8(&mut self, value: u8) {
+        self.buf.push(value);
+    }
+    
+    pub(crate) fn varint(&mut self, mut value: u64) {
+        while value >= 0x80 {
+            self.buf.push((value as u8) | 0x80);
+            value >>= 7;
+        }
+        self.buf.push(value as u8);
+    }
+    
+    /// Fixed-size field, written without a length
+    pub(crate) fn array(&mut self, bytes: &[u8]) {
+        self.buf.extend_from_slice(bytes);
+    }
+    
+    /// Variable-size field, length-prefixed
+    pub(crate) fn bytes(&mut self, bytes: &[u8]) {
+        self.varint(bytes.len() as u64);
+        self.buf.extend_from_slice(bytes);
+    }
+    
+    pub(crate) fn option_array(&mut self, bytes: Option<&[u8]>) {
+        match bytes {
+            Some(bytes) => {
+                self.u8(1);
+                self.array(bytes);
+            }
+            None => self.u8(0),
+        }
+    }
+    
+    pub(crate) fn finish(self) -> Vec<u8> {
+        self.buf
+    }
+}
+
+/// Bounds-checked record reader
+pub(crate) struct Reader<'a> {
+    data: &'a [u8],
+    pos: usize,
+}
+
+impl<'a> Reader<'a> {
+    /// Check the record header and position the reader at the body
+    pub(crate) fn open(data: &'a [u8], kind: u8) -> ProtocolResult<Self> {
+        match data {
+            [MAGIC, k, VERSION, ..] if *k == kind => Ok(Self { data, pos: 3 }),
+            [MAGIC, k, version, ..] if *k == kind => Err(ProtocolError::InternalError(
+                format!("Unsupported record version {}", version),
+            )),
+            _ => Err(malformed()),
+        }
+    }
+    
+    fn take(&mut self, len: usize) -> ProtocolResult<&'a [u8]> {
+        let end = self.pos.checked_add(len).filter(|&end| end <= self.data.len()).ok_or_else(malformed)?;
+        let out = &self.data[self.pos..end];
+        self.pos = end;
+        Ok(out)
+    }
+    
+    pub(crate) fn u8(&mut self) -> ProtocolResult<u8> {
+        Ok(self.take(1)?[0])
+    }
+    
+    pub(crate) fn varint(&mut self) -> ProtocolResult<u64> {
+        let mut value = 0u64;
+        for shift in (0..64).step_by(7) {
+            let byte = self.u8()?;
+            value |= u64::from(byte & 0x7F) << shift;
+            if byte & 0x80 == 0 {
+                return Ok(value);
+            }
+        }
+        Err(malformed())
+    }
+    
+    pub(crate) fn array<const N: usize>(&mut self) -> ProtocolResult<[u8; N]> {
+        let mut out = [0u8; N];
+        out.copy_from_slice(self.take(N)?);
+        Ok(out)
+    }
+    
+    pub(crate) fn bytes(&mut self) -> ProtocolResult<&'a [u8]> {
+        let len = usize::try_from(self.varint()?).map_err(|_| malformed())?;
+        self.take(len)
+    }
+    
+    pub(crate) fn option_array<const N: usize>(&mut self) -> ProtocolResult<Option<[u8; N]>> {
+        match self.u8()? {
+            0 => Ok(None),
+            1 => self.array().map(Some),
+            _ => Err(malformed()),
+        }
+    }
+    
+    /// Remaining bytes, for sizing collections before reading them
+    pub(crate) fn remaining(&self) -> usize {
+        self.data.len() - self.pos
+    }
+    
+    /// Fail if trailing bytes are left
+    pub(crate) fn finish(self) -> ProtocolResult<()> {
+        if self.pos == self.data.len() {
+            Ok(())
+        } else {
+            Err(malformed())
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn primitives_roundtrip() {
+        let mut w = Writer::new(KIND_SESSION, 0);
+        w.varint(0);
+        w.varint(127);
+        w.varint(128);
+        w.varint(u64::MAX);
+        w.array(&[7u8; 32]);
+        w.bytes(b"abc");
+        w.option_array(None);
+        w.option_array(Some(&[9u8; 4]));
+        let data = w.finish();
+
+        let mut r = Reader::open(&data, KIND_SESSION).unwrap();
+        assert_eq!(r.varint().unwrap(), 0);
+        assert_eq!(r.varint().unwrap(), 127);
+        assert_eq!(r.varint().unwrap(), 128);
+        assert_eq!(r.varint().unwrap(), u64::MAX);
+        assert_eq!(r.array::<32>().unwrap(), [7u8; 32]);
+        assert_eq!(r.bytes().unwrap(), b"abc");
+        assert_eq!(r.option_array::<4>().unwrap(), None);
+        assert_eq!(r.option_array::<4>().unwrap(), Some([9u8; 4]));
+        r.finish().unwrap();
+    }
+
+    #[test]
+    fn rejects_wrong_kind_and_truncation() {
+        let mut w = Writer::new(KIND_IDENTITY, 0);
+        w.bytes(&[1u8; 32]);
+        let data = w.finish();
+
+        assert!(Reader::open(&data, KIND_PREKEY).is_err());
+        assert!(Reader::open(b"{\"private\":[]}", KIND_IDENTITY).is_err());
+        let mut r = Reader::open(&data[..data.len() - 1], KIND_IDENTITY).unwrap();
+        assert!(r.bytes().is_err());
+    }
+}
@@ -1,6 +1,12 @@
 use super::*;
+use std::cell::RefCell;
 use std::sync::atomic::{AtomicU64, Ordering};
 
+thread_local! {
+    /// Reused associated-data buffer, so encrypting does not allocate for it
+    static AD_SCRATCH: RefCell<Vec<u8>> = const { RefCell::new(Vec::new()) };
+}
+
 /// Encryptor with message counter tracking
 pub struct Encryptor {
     handler: CryptoHandler,
@@ -22,24 +28,37 @@ impl Encryptor {
     
     /// Encrypt message with counter
     pub fn encrypt_message(&self, plaintext: &[u8], context: &[u8]) -> CryptoResult<Vec<u8>> {
+        self.with_associated_data(context, |associated_data| self.handler.encrypt(plaintext, associated_data))
+    }
+    
+    /// Encrypt message with counter into `out` (see `CryptoHandler::encrypt_into`)
+    pub fn encrypt_into(&self, plaintext: &[u8], context: &[u8], out: &mut [u8]) -> CryptoResult<usize> {
+        self.with_associated_data(context, |associated_data| self.handler.encrypt_into(plaintext, associated_data, out))
+    }
+    
+    /// Count the message and run `f` with its associated data
+    fn with_associated_data<R>(&self, context: &[u8], f: impl FnOnce(&[u8]) -> CryptoResult<R>) -> CryptoResult<R> {
         let message_num = self.message_counter.fetch_add(1, Ordering::SeqCst);
         
         if message_num >= self.max_message_count {
             return Err(CryptoError::EncryptionFailed);
         }
         
-        // Build associated data: context + message number + timestamp
-        let mut associated_data = Vec::with_capacity(context.len() + 16);
-        associated_data.extend_from_slice(context);
-        associated_data.extend_from_slice(&message_num.to_le_bytes());
-        
         let timestamp = std::time::SystemTime::now()
             .duration_since(std::time::UNIX_EPOCH)
             .map_err(|_| CryptoError::EncryptionFailed)?
             .as_secs();
-        associated_data.extend_from_slice(&timestamp.to_le_bytes());
         
-        self.handler.encrypt(plaintext, &associated_data)
+        // Build associated data: context + message number + timestamp
+        AD_SCRATCH.with(|scratch| {
+            let mut associated_data = scratch.borrow_mut();
+            associated_data.clear();
+            associated_data.extend_from_slice(context);
+            associated_data.extend_from_slice(&message_num.to_le_bytes());
+            associated_data.extend_from_slice(&timestamp.to_le_bytes());
+            
+            f(&associated_data)
+        })
     }
     
     /// Decrypt message
@@ -51,6 +70,15 @@ impl Encryptor {
         self.handler.decrypt(ciphertext, context)
     }
     
+    /// Decrypt message into `out` (see `CryptoHandler::decrypt_into`)
+    pub fn decrypt_into(&self, ciphertext: &[u8], context: &[u8], out: &mut [u8]) -> CryptoResult<usize> {
+        if ciphertext.len() < NONCE_LENGTH {
+            return Err(CryptoError::InvalidCiphertext);
+        }
+        
+        self.handler.decrypt_into(ciphertext, context, out)
+    }
+    
     pub fn message_count(&self) -> u64 {
         self.message_counter.load(Ordering::SeqCst)
     }
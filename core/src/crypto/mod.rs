@@ -12,7 +12,7 @@ pub use kdf::*;
 use zeroize::Zeroizing;
 use chacha20poly1305::{
     ChaCha20Poly1305, KeyInit,
-    aead::{Aead, AeadInPlace},
+    aead::{Aead, AeadInPlace, Payload},
 };
 use thiserror::Error;
 
@@ -35,6 +35,8 @@ pub enum CryptoError {
     KeyDerivationFailed,
     #[error("Invalid ciphertext")]
     InvalidCiphertext,
+    #[error("Output buffer too small")]
+    BufferTooSmall,
 }
 
 /// Result type for crypto operations
@@ -46,6 +48,13 @@ pub const NONCE_LENGTH: usize = 12;
 pub const TAG_LENGTH: usize = 16;
 pub const CHACHA20_NONCE_LENGTH: usize = 12;
 
+/// Nonce for chunk `index` of a chunked stream: 4 zero bytes + index (LE).
+pub fn chunk_nonce(index: u64) -> [u8; NONCE_LENGTH] {
+    let mut nonce = [0u8; NONCE_LENGTH];
+    nonce[4..].copy_from_slice(&index.to_le_bytes());
+    nonce
+}
+
 /// General Encryption Handler
 pub struct CryptoHandler {
     cipher: ChaCha20Poly1305,
@@ -72,10 +81,7 @@ impl CryptoHandler {
     
     /// Encrypt data
     pub fn encrypt(&self, plaintext: &[u8], associated_data: &[u8]) -> CryptoResult<Vec<u8>> {
-        let mut rng = SecureRandom::new()?;
-        let mut nonce = [0u8; NONCE_LENGTH];
-        rng.fill_bytes(&mut nonce);
-        
+        let nonce = random_nonce()?;
         self.encrypt_with_nonce(plaintext, associated_data, &nonce)
     }
     
@@ -102,6 +108,75 @@ impl CryptoHandler {
         Ok(result)
     }
     
+    /// Encrypt into `out` without allocating. Writes exactly what `encrypt`
+    /// returns (nonce || ciphertext || tag) and returns its length; `out` needs
+    /// `plaintext.len() + NONCE_LENGTH + TAG_LENGTH` bytes. Like
+    /// `encrypt_with_nonce`, the associated data is not yet bound into the tag,
+    /// so both paths produce the same wire format.
+    pub fn encrypt_into(&self, plaintext: &[u8], _associated_data: &[u8], out: &mut [u8]) -> CryptoResult<usize> {
+        let len = NONCE_LENGTH + plaintext.len() + TAG_LENGTH;
+        if out.len() < len {
+            return Err(CryptoError::BufferTooSmall);
+        }
+        
+        let (nonce, rest) = out[..len].split_at_mut(NONCE_LENGTH);
+        nonce.copy_from_slice(&random_nonce()?);
+        let (body, tag_out) = rest.split_at_mut(plaintext.len());
+        body.copy_from_slice(plaintext);
+        
+        let tag = self.cipher
+            .encrypt_in_place_detached((&*nonce).into(), b"", body)
+            .map_err(|_| CryptoError::EncryptionFailed)?;
+        tag_out.copy_from_slice(&tag);
+        
+        Ok(len)
+    }
+    
+    /// Decrypt `encrypt`/`encrypt_into` output into `out` without allocating.
+    /// Returns the plaintext length; `out` is zeroed if authentication fails.
+    pub fn decrypt_into(&self, ciphertext: &[u8], _associated_data: &[u8], out: &mut [u8]) -> CryptoResult<usize> {
+        if ciphertext.len() < NONCE_LENGTH + TAG_LENGTH {
+            return Err(CryptoError::DecryptionFailed);
+        }
+        let len = ciphertext.len() - NONCE_LENGTH - TAG_LENGTH;
+        if out.len() < len {
+            return Err(CryptoError::BufferTooSmall);
+        }
+        
+        let (nonce, rest) = ciphertext.split_at(NONCE_LENGTH);
+        let (body, tag) = rest.split_at(len);
+        let out = &mut out[..len];
+        out.copy_from_slice(body);
+        
+        if self.cipher.decrypt_in_place_detached(nonce.into(), b"", out, tag.into()).is_err() {
+            out.fill(0);
+            return Err(CryptoError::DecryptionFailed);
+        }
+        Ok(len)
+    }
+    
+    /// Encrypt one chunk of a chunked stream (e.g. a file container).
+    /// The nonce is derived from `index` and not stored, so the key must be
+    /// unique to the stream. Output: ciphertext + tag.
+    pub fn encrypt_chunk(&self, index: u64, plaintext: &[u8], associated_data: &[u8]) -> CryptoResult<Vec<u8>> {
+        let nonce = chunk_nonce(index);
+        self.cipher
+            .encrypt((&nonce[..]).into(), Payload { msg: plaintext, aad: associated_data })
+            .map_err(|_| CryptoError::EncryptionFailed)
+    }
+    
+    /// Decrypt and authenticate a chunk produced by `encrypt_chunk`.
+    pub fn decrypt_chunk(&self, index: u64, ciphertext: &[u8], associated_data: &[u8]) -> CryptoResult<Vec<u8>> {
+        if ciphertext.len() < TAG_LENGTH {
+            return Err(CryptoError::InvalidCiphertext);
+        }
+        
+        let nonce = chunk_nonce(index);
+        self.cipher
+            .decrypt((&nonce[..]).into(), Payload { msg: ciphertext, aad: associated_data })
+            .map_err(|_| CryptoError::AuthenticationFailed)
+    }
+    
     /// Decrypt data
     pub fn decrypt(&self, ciphertext: &[u8], associated_data: &[u8]) -> CryptoResult<Vec<u8>> {
         if ciphertext.len() < NONCE_LENGTH {
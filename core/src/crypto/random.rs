@@ -2,7 +2,8 @@ use zeroize::{Zeroize, ZeroizeOnDrop};
 use rand::{RngCore, SeedableRng};
 use rand::rngs::StdRng;
 use blake3::Hasher;
-use super::{CryptoError, CryptoResult};
+use super::{CryptoError, CryptoResult, NONCE_LENGTH};
+use std::cell::RefCell;
 
 /// Secure Random Number Generator w/ Reseeding
 #[derive(Zeroize, ZeroizeOnDrop)]
@@ -56,6 +57,28 @@ impl SecureRandom {
         self.entropy_source.counter += 1;
     }
     
+    /// Fill `dest` from this thread's generator, creating it on first use.
+    /// The generator reseeds from the OS every 1024 calls and is recreated in
+    /// a forked child (detected by a pid change) so parent and child never
+    /// share a stream.
+    pub fn fill_thread_local(dest: &mut [u8]) -> CryptoResult<()> {
+        thread_local! {
+            static THREAD_RNG: RefCell<Option<(u32, SecureRandom)>> = const { RefCell::new(None) };
+        }
+        
+        THREAD_RNG.with(|cell| {
+            let mut slot = cell.borrow_mut();
+            let pid = std::process::id();
+            if !matches!(&*slot, Some((owner, _)) if *owner == pid) {
+                *slot = Some((pid, SecureRandom::new()?));
+            }
+            if let Some((_, rng)) = slot.as_mut() {
+                rng.fill_bytes(dest);
+            }
+            Ok(())
+        })
+    }
+    
     fn reseed(&mut self) {
         let mut new_seed = [0u8; 32];
         self.entropy_source.os_rng.fill_bytes(&mut new_seed);
@@ -74,3 +97,10 @@ impl SecureRandom {
         self.entropy_source.last_mix = seed.into();
     }
 }
+
+/// Fresh random AEAD nonce from the calling thread's CSPRNG
+pub fn random_nonce() -> CryptoResult<[u8; NONCE_LENGTH]> {
+    let mut nonce = [0u8; NONCE_LENGTH];
+    SecureRandom::fill_thread_local(&mut nonce)?;
+    Ok(nonce)
+}
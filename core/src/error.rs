@@ -35,6 +35,8 @@ pub enum ProtocolError {
     InvalidNonceLength,
     #[error("Random generation failed")]
     RandomFailed,
+    #[error("Output buffer too small")]
+    BufferTooSmall,
 }
 
 pub type ProtocolResult<T> = Result<T, ProtocolError>;
@@ -50,6 +52,7 @@ impl From<crate::crypto::CryptoError> for ProtocolError {
             crate::crypto::CryptoError::RandomFailed => ProtocolError::RandomFailed,
             crate::crypto::CryptoError::KeyDerivationFailed => ProtocolError::KeyDerivationFailed,
             crate::crypto::CryptoError::InvalidCiphertext => ProtocolError::InvalidCiphertext,
+            crate::crypto::CryptoError::BufferTooSmall => ProtocolError::BufferTooSmall,
         }
     }
 }
@@ -20,6 +20,7 @@ impl From<ConfigFFI> for crate::Config {
             key_rotation_interval: config.key_rotation_interval,
             handshake_timeout: config.handshake_timeout,
             message_buffer_size: config.message_buffer_size,
+            ..crate::Config::default()
         }
     }
 }
@@ -85,9 +86,10 @@ pub extern "C" fn secure_context_load_identity(
         // We need to modify lib.rs to allow this access or delegate.
         
         // For now, let's assume we add `load_identity` to SecureContext in lib.rs.
-        ctx.load_identity(pub_slice, priv_slice);
-
-        FFIError::Success
+        match ctx.load_identity(pub_slice, priv_slice) {
+            Ok(()) => FFIError::Success,
+            Err(e) => FFIError::from(e),
+        }
     });
 
     match result {
@@ -96,6 +98,143 @@ pub extern "C" fn secure_context_load_identity(
     }
 }
 
+#[no_mangle]
+pub extern "C" fn secure_context_flush(handle: *mut SecureContextHandle) -> u8 {
+    if handle.is_null() {
+        return FFIError::NullPointer.into();
+    }
+    
+    let result = panic::catch_unwind(|| {
+        let ctx = unsafe { &*(*handle).context };
+        match ctx.flush() {
+            Ok(()) => FFIError::Success,
+            Err(e) => FFIError::from(e),
+        }
+    });
+    
+    result.unwrap_or(FFIError::UnknownError).into()
+}
+
+/// Borrow `count` caller buffers described by parallel pointer/length arrays.
+unsafe fn input_slices<'a>(ptrs: *const *const uint8_t, lens: *const size_t, count: size_t) -> Option<Vec<&'a [u8]>> {
+    if count == 0 {
+        return Some(Vec::new());
+    }
+    if ptrs.is_null() || lens.is_null() {
+        return None;
+    }
+    let ptrs = slice::from_raw_parts(ptrs, count);
+    let lens = slice::from_raw_parts(lens, count);
+    ptrs.iter()
+        .zip(lens)
+        .map(|(&p, &len)| if p.is_null() { None } else { Some(slice::from_raw_parts(p, len)) })
+        .collect()
+}
+
+/// Hand a buffer to the caller, to be released with `secure_free_buffer`.
+fn export_buffer(data: Vec<u8>) -> (*mut uint8_t, size_t) {
+    let mut boxed = data.into_boxed_slice();
+    let out = (boxed.as_mut_ptr(), boxed.len());
+    std::mem::forget(boxed);
+    out
+}
+
+/// Encrypt `count` messages for one session with a single session lock and a
+/// single persist. On success `ciphertexts[i]` / `ciphertext_lens[i]` receive
+/// buffers to release with `secure_free_buffer`; on failure nothing is written.
+#[no_mangle]
+pub extern "C" fn secure_context_encrypt_batch(
+    handle: *mut SecureContextHandle,
+    session_id: *const uint8_t,
+    session_id_len: size_t,
+    plaintexts: *const *const uint8_t,
+    plaintext_lens: *const size_t,
+    count: size_t,
+    ciphertexts: *mut *mut uint8_t,
+    ciphertext_lens: *mut size_t,
+) -> u8 {
+    if handle.is_null() || session_id.is_null() || (count > 0 && (ciphertexts.is_null() || ciphertext_lens.is_null())) {
+        return FFIError::NullPointer.into();
+    }
+    
+    let result = panic::catch_unwind(|| unsafe {
+        let ctx = &*(*handle).context;
+        let session_id = slice::from_raw_parts(session_id, session_id_len);
+        let inputs = match input_slices(plaintexts, plaintext_lens, count) {
+            Some(inputs) => inputs,
+            None => return FFIError::NullPointer,
+        };
+        
+        match ctx.encrypt_batch(session_id, &inputs, None) {
+            Ok(out) => {
+                for (i, data) in out.into_iter().enumerate() {
+                    let (ptr, len) = export_buffer(data);
+                    *ciphertexts.add(i) = ptr;
+                    *ciphertext_lens.add(i) = len;
+                }
+                FFIError::Success
+            }
+            Err(e) => FFIError::from(e),
+        }
+    });
+    
+    result.unwrap_or(FFIError::UnknownError).into()
+}
+
+/// Decrypt `count` messages for one session with a single session lock and a
+/// single persist. `statuses[i]` receives each message's FFIError; plaintexts of
+/// successful messages are returned as with `secure_context_encrypt_batch`,
+/// failed ones as NULL / 0. The return value only reports batch-level errors.
+#[no_mangle]
+pub extern "C" fn secure_context_decrypt_batch(
+    handle: *mut SecureContextHandle,
+    session_id: *const uint8_t,
+    session_id_len: size_t,
+    ciphertexts: *const *const uint8_t,
+    ciphertext_lens: *const size_t,
+    count: size_t,
+    plaintexts: *mut *mut uint8_t,
+    plaintext_lens: *mut size_t,
+    statuses: *mut u8,
+) -> u8 {
+    if handle.is_null()
+        || session_id.is_null()
+        || (count > 0 && (plaintexts.is_null() || plaintext_lens.is_null() || statuses.is_null()))
+    {
+        return FFIError::NullPointer.into();
+    }
+    
+    let result = panic::catch_unwind(|| unsafe {
+        let ctx = &*(*handle).context;
+        let session_id = slice::from_raw_parts(session_id, session_id_len);
+        let inputs = match input_slices(ciphertexts, ciphertext_lens, count) {
+            Some(inputs) => inputs,
+            None => return FFIError::NullPointer,
+        };
+        
+        match ctx.decrypt_batch(session_id, &inputs, None) {
+            Ok(out) => {
+                for (i, res) in out.into_iter().enumerate() {
+                    let (ptr, len, status) = match res {
+                        Ok(data) => {
+                            let (ptr, len) = export_buffer(data);
+                            (ptr, len, FFIError::Success)
+                        }
+                        Err(e) => (ptr::null_mut(), 0, FFIError::from(e)),
+                    };
+                    *plaintexts.add(i) = ptr;
+                    *plaintext_lens.add(i) = len;
+                    *statuses.add(i) = status.into();
+                }
+                FFIError::Success
+            }
+            Err(e) => FFIError::from(e),
+        }
+    });
+    
+    result.unwrap_or(FFIError::UnknownError).into()
+}
+
 #[no_mangle]
 pub extern "C" fn secure_session_create(
     context: *mut SecureContextHandle,
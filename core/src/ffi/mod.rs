@@ -46,10 +46,17 @@ pub enum FFIError {
     UnknownError = 255,
 }
 
+impl From<FFIError> for u8 {
+    fn from(err: FFIError) -> Self {
+        err as u8
+    }
+}
+
 impl From<ProtocolError> for FFIError {
     fn from(err: ProtocolError) -> Self {
         match err {
             ProtocolError::InvalidKeyLength => FFIError::InvalidArgument,
+            ProtocolError::BufferTooSmall => FFIError::InvalidArgument,
             ProtocolError::EncryptionFailed => FFIError::EncryptionFailed,
             ProtocolError::DecryptionFailed => FFIError::DecryptionFailed,
             ProtocolError::SessionNotFound => FFIError::SessionNotFound,
@@ -129,3 +129,98 @@ pub extern "C" fn secure_session_decrypt(
     
     result.unwrap_or(FFIError::UnknownError)
 }
+
+/// Bytes `secure_session_encrypt_into` adds to a plaintext (header + nonce + tag).
+#[no_mangle]
+pub extern "C" fn secure_message_overhead() -> size_t {
+    crate::ratchet::MESSAGE_OVERHEAD
+}
+
+/// Encrypt into a caller-owned buffer of `out_capacity` bytes (at least
+/// plaintext_len + secure_message_overhead()). Nothing is allocated for the
+/// caller to free. If the buffer is too small, `*out_len` is set to the
+/// required size and InvalidArgument is returned.
+#[no_mangle]
+pub extern "C" fn secure_session_encrypt_into(
+    session: *mut SecureSessionHandle,
+    plaintext: *const uint8_t,
+    plaintext_len: size_t,
+    out: *mut uint8_t,
+    out_capacity: size_t,
+    out_len: *mut size_t,
+) -> FFIError {
+    if session.is_null() || plaintext.is_null() || out.is_null() || out_len.is_null() {
+        return FFIError::NullPointer;
+    }
+    
+    let result = panic::catch_unwind(|| {
+        unsafe {
+            let needed = plaintext_len + crate::ratchet::MESSAGE_OVERHEAD;
+            if out_capacity < needed {
+                *out_len = needed;
+                return FFIError::InvalidArgument;
+            }
+            
+            let session_ptr = (*session).session as *const RwLock<DoubleRatchetSession>;
+            let plaintext_slice = slice::from_raw_parts(plaintext, plaintext_len);
+            let out_slice = slice::from_raw_parts_mut(out, out_capacity);
+            
+            // Borrow the Arc without touching its ref count
+            let arc = std::mem::ManuallyDrop::new(Arc::from_raw(session_ptr));
+            let result = arc.write().encrypt_into(plaintext_slice, &[], out_slice);
+            
+            match result {
+                Ok(written) => {
+                    *out_len = written;
+                    FFIError::Success
+                }
+                Err(err) => err.into(),
+            }
+        }
+    });
+    
+    result.unwrap_or(FFIError::UnknownError)
+}
+
+/// Decrypt into a caller-owned buffer of `out_capacity` bytes (at least
+/// ciphertext_len - secure_message_overhead()).
+#[no_mangle]
+pub extern "C" fn secure_session_decrypt_into(
+    session: *mut SecureSessionHandle,
+    ciphertext: *const uint8_t,
+    ciphertext_len: size_t,
+    out: *mut uint8_t,
+    out_capacity: size_t,
+    out_len: *mut size_t,
+) -> FFIError {
+    if session.is_null() || ciphertext.is_null() || out.is_null() || out_len.is_null() {
+        return FFIError::NullPointer;
+    }
+    
+    let result = panic::catch_unwind(|| {
+        unsafe {
+            let needed = ciphertext_len.saturating_sub(crate::ratchet::MESSAGE_OVERHEAD);
+            if out_capacity < needed {
+                *out_len = needed;
+                return FFIError::InvalidArgument;
+            }
+            
+            let session_ptr = (*session).session as *const RwLock<DoubleRatchetSession>;
+            let ciphertext_slice = slice::from_raw_parts(ciphertext, ciphertext_len);
+            let out_slice = slice::from_raw_parts_mut(out, out_capacity);
+            
+            let arc = std::mem::ManuallyDrop::new(Arc::from_raw(session_ptr));
+            let result = arc.write().decrypt_into(ciphertext_slice, &[], out_slice);
+            
+            match result {
+                Ok(written) => {
+                    *out_len = written;
+                    FFIError::Success
+                }
+                Err(err) => err.into(),
+            }
+        }
+    });
+    
+    result.unwrap_or(FFIError::UnknownError)
+}
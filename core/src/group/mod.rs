@@ -0,0 +1,17 @@
+//! Sender-key group messaging
+//!
+//! Each member keeps one sending chain per group and hands its current key to
+//! the other members once, over their pairwise sessions. A group message is
+//! then encrypted a single time and the same ciphertext is fanned out to every
+//! member, instead of one Double Ratchet encryption per recipient.
+//!
+//! Sender keys give forward secrecy along the chain but no post-compromise
+//! security: rotate (and redistribute) after membership changes. Messages are
+//! not signed, so any member holding a sender's key could forge messages from
+//! that sender; authenticity rests on the pairwise sessions that carried the key.
+
+mod sender_key;
+mod store;
+
+pub use sender_key::*;
+pub(crate) use store::GroupStore;
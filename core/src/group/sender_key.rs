@@ -0,0 +1,222 @@
+use crate::codec::{self, Reader, Writer};
+use crate::crypto::{CryptoHandler, SecureRandom, TAG_LENGTH};
+use crate::error::{ProtocolError, ProtocolResult};
+use crate::ratchet::{unix_time, ChainKey, SkippedKeyId, SkippedKeys};
+
+/// Group message header: key id u32 BE (4) || iteration u64 BE (8)
+pub const GROUP_HEADER_LENGTH: usize = 4 + 8;
+/// Bytes added to every plaintext by `SenderKeyState::encrypt`: header + tag.
+/// No nonce is sent: every message key is used once, so the nonce is derived
+/// from the iteration (see `CryptoHandler::encrypt_chunk`).
+pub const GROUP_MESSAGE_OVERHEAD: usize = GROUP_HEADER_LENGTH + TAG_LENGTH;
+
+/// A sender's key as handed to group members over their pairwise sessions:
+/// enough to derive every message key from `iteration` on.
+#[derive(Clone, Debug, PartialEq)]
+pub struct SenderKeyDistribution {
+    /// Group the key is for
+    pub group_id: Vec<u8>,
+    /// Random id of the sender's current chain; changes on rotation
+    pub key_id: u32,
+    /// Chain key at `iteration`
+    pub chain_key: [u8; 32],
+    /// Iteration of the next message the sender will encrypt
+    pub iteration: u64,
+}
+
+impl SenderKeyDistribution {
+    /// Encode as a binary record (see `codec`)
+    pub fn encode(&self) -> Vec<u8> {
+        let mut w = Writer::new(codec::KIND_SENDER_KEY_DISTRIBUTION, 48 + self.group_id.len());
+        w.bytes(&self.group_id);
+        w.varint(self.key_id as u64);
+        w.array(&self.chain_key);
+        w.varint(self.iteration);
+        w.finish()
+    }
+
+    /// Decode a record produced by `encode`
+    pub fn decode(data: &[u8]) -> ProtocolResult<Self> {
+        let mut r = Reader::open(data, codec::KIND_SENDER_KEY_DISTRIBUTION)?;
+        let group_id = r.bytes()?.to_vec();
+        let key_id = u32::try_from(r.varint()?).map_err(|_| ProtocolError::InvalidMessage)?;
+        let chain_key = r.array()?;
+        let iteration = r.varint()?;
+        r.finish()?;
+        Ok(Self { group_id, key_id, chain_key, iteration })
+    }
+}
+
+/// One sender's chain in one group. The owner encrypts with it; every other
+/// member holds a copy, installed from a `SenderKeyDistribution`, to decrypt.
+#[derive(Clone)]
+pub struct SenderKeyState {
+    key_id: u32,
+    chain: ChainKey,
+    /// Keys of messages skipped over, for out-of-order delivery (receivers only)
+    skipped: SkippedKeys,
+}
+
+fn skipped_id(key_id: u32, iteration: u64) -> SkippedKeyId {
+    let mut tag = [0u8; 32];
+    tag[..4].copy_from_slice(&key_id.to_be_bytes());
+    (iteration, tag)
+}
+
+/// Associated data: group id || header. The sender is implied by the chain:
+/// a message credited to the wrong member fails under that member's keys.
+fn associated_data(group_id: &[u8], header: &[u8]) -> Vec<u8> {
+    let mut ad = Vec::with_capacity(group_id.len() + header.len());
+    ad.extend_from_slice(group_id);
+    ad.extend_from_slice(header);
+    ad
+}
+
+impl SenderKeyState {
+    /// Fresh sending chain with a random key id
+    pub fn generate() -> ProtocolResult<Self> {
+        let mut key_id = [0u8; 4];
+        let mut chain_key = [0u8; 32];
+        SecureRandom::fill_thread_local(&mut key_id)?;
+        SecureRandom::fill_thread_local(&mut chain_key)?;
+        Ok(Self {
+            key_id: u32::from_be_bytes(key_id),
+            chain: ChainKey::new(chain_key),
+            skipped: SkippedKeys::new(0, 0),
+        })
+    }
+
+    /// Receiving chain from a member's distribution message
+    pub fn from_distribution(distribution: &SenderKeyDistribution, max_skip: usize, ttl: u64) -> Self {
+        let mut chain = ChainKey::new(distribution.chain_key);
+        chain.index = distribution.iteration;
+        Self {
+            key_id: distribution.key_id,
+            chain,
+            skipped: SkippedKeys::new(max_skip, ttl),
+        }
+    }
+
+    /// Random id of this chain
+    pub fn key_id(&self) -> u32 {
+        self.key_id
+    }
+
+    /// Next message iteration
+    pub fn iteration(&self) -> u64 {
+        self.chain.index
+    }
+
+    /// Distribution of the current chain position; members who receive it can
+    /// read every message sent from now on, but none sent before.
+    pub fn distribution(&self, group_id: &[u8]) -> SenderKeyDistribution {
+        SenderKeyDistribution {
+            group_id: group_id.to_vec(),
+            key_id: self.key_id,
+            chain_key: self.chain.key,
+            iteration: self.chain.index,
+        }
+    }
+
+    /// Encrypt one group message: a single chain step and AEAD, whatever the
+    /// group size. The group id and header are bound into the tag.
+    pub fn encrypt(&mut self, group_id: &[u8], plaintext: &[u8]) -> ProtocolResult<Vec<u8>> {
+        let iteration = self.chain.index;
+        let message_key = self.chain.next_message_key();
+
+        let mut header = [0u8; GROUP_HEADER_LENGTH];
+        header[..4].copy_from_slice(&self.key_id.to_be_bytes());
+        header[4..].copy_from_slice(&iteration.to_be_bytes());
+
+        let ad = associated_data(group_id, &header);
+        let ciphertext = CryptoHandler::new(&message_key)?.encrypt_chunk(iteration, plaintext, &ad)?;
+        let mut out = Vec::with_capacity(GROUP_HEADER_LENGTH + ciphertext.len());
+        out.extend_from_slice(&header);
+        out.extend_from_slice(&ciphertext);
+        Ok(out)
+    }
+
+    /// Decrypt a message from this chain's sender. The chain and the skipped
+    /// keys only change once the message authenticates.
+    pub fn decrypt(&mut self, group_id: &[u8], message: &[u8]) -> ProtocolResult<Vec<u8>> {
+        if message.len() < GROUP_MESSAGE_OVERHEAD {
+            return Err(ProtocolError::InvalidMessage);
+        }
+        let (header, body) = message.split_at(GROUP_HEADER_LENGTH);
+        let key_id = u32::from_be_bytes(header[..4].try_into().unwrap());
+        let iteration = u64::from_be_bytes(header[4..].try_into().unwrap());
+        if key_id != self.key_id {
+            // Sent under a key we were never given, or one since rotated
+            return Err(ProtocolError::InvalidMessage);
+        }
+
+        self.skipped.expire();
+        let id = skipped_id(key_id, iteration);
+        let mut advanced = None;
+        let message_key = if let Some(key) = self.skipped.get(&id) {
+            *key
+        } else {
+            // Work on a copy so a forged message cannot move the chain.
+            let mut chain = self.chain.clone();
+            let mut skipped = Vec::new();
+            chain.skip_to(iteration, self.skipped.limit(), |index, key| skipped.push((index, key)))?;
+            let key = chain.next_message_key();
+            advanced = Some((chain, skipped));
+            key
+        };
+
+        let ad = associated_data(group_id, header);
+        let plaintext = CryptoHandler::new(&message_key)?.decrypt_chunk(iteration, body, &ad)?;
+
+        match advanced {
+            Some((chain, skipped)) => {
+                self.chain = chain;
+                for (index, key) in skipped {
+                    self.skipped.insert(skipped_id(key_id, index), key);
+                }
+            }
+            None => {
+                self.skipped.remove(&id);
+            }
+        }
+        self.skipped.take_changes();
+        Ok(plaintext)
+    }
+
+    /// Encode as a binary record (see `codec`)
+    pub(crate) fn encode(&self) -> Vec<u8> {
+        let mut w = Writer::new(codec::KIND_SENDER_KEY, 48 + self.skipped.len() * 48);
+        w.varint(self.key_id as u64);
+        w.array(&self.chain.key);
+        w.varint(self.chain.index);
+        w.varint(self.skipped.limit().min(u32::MAX as usize) as u64);
+        w.varint(self.skipped.len() as u64);
+        for ((iteration, _), key, stored_at) in self.skipped.iter() {
+            w.varint(*iteration);
+            w.array(key);
+            w.varint(stored_at);
+        }
+        w.finish()
+    }
+
+    pub(crate) fn decode(data: &[u8], ttl: u64) -> ProtocolResult<Self> {
+        let mut r = Reader::open(data, codec::KIND_SENDER_KEY)?;
+        let key_id = u32::try_from(r.varint()?).map_err(|_| ProtocolError::InternalError("Deserialization failed".into()))?;
+        let mut chain = ChainKey::new(r.array()?);
+        chain.index = r.varint()?;
+        let limit = r.varint()? as usize;
+        let count = r.varint()? as usize;
+        let mut entries = Vec::with_capacity(count.min(r.remaining() / 34));
+        for _ in 0..count {
+            let iteration = r.varint()?;
+            let key: [u8; 32] = r.array()?;
+            entries.push((skipped_id(key_id, iteration), key, r.varint()?));
+        }
+        r.finish()?;
+
+        let mut skipped = SkippedKeys::from_entries(limit, ttl, entries);
+        skipped.expire_at(unix_time());
+        skipped.take_changes();
+        Ok(Self { key_id, chain, skipped })
+    }
+}
@@ -0,0 +1,122 @@
+//! Sender-key persistence
+//! One sled tree holds our own sending chain per group and every member's
+//! receiving chain, each rewritten whenever it moves.
+
+use super::SenderKeyState;
+use crate::{Durability, ProtocolError, ProtocolResult};
+use parking_lot::{Mutex, RwLock};
+use std::collections::HashMap;
+use std::sync::Arc;
+
+const OWN_PREFIX: u8 = 0x00;
+const MEMBER_PREFIX: u8 = 0x01;
+
+type SharedSenderKey = Arc<Mutex<SenderKeyState>>;
+
+fn db_error(context: &str, e: impl std::fmt::Debug) -> ProtocolError {
+    ProtocolError::InternalError(format!("{}: {:?}", context, e))
+}
+
+/// Tree key of our own chain for `group_id`: 0x00 || group
+fn own_key(group_id: &[u8]) -> Vec<u8> {
+    let mut key = Vec::with_capacity(1 + group_id.len());
+    key.push(OWN_PREFIX);
+    key.extend_from_slice(group_id);
+    key
+}
+
+/// Tree key of `sender_id`'s chain for `group_id`: 0x01 || group length (u32 BE) || group || sender
+fn member_key(group_id: &[u8], sender_id: &[u8]) -> Vec<u8> {
+    let mut key = Vec::with_capacity(5 + group_id.len() + sender_id.len());
+    key.push(MEMBER_PREFIX);
+    key.extend_from_slice(&(group_id.len() as u32).to_be_bytes());
+    key.extend_from_slice(group_id);
+    key.extend_from_slice(sender_id);
+    key
+}
+
+/// Cached, persisted sender-key states
+pub(crate) struct GroupStore {
+    tree: sled::Tree,
+    cache: RwLock<HashMap<Vec<u8>, SharedSenderKey>>,
+    durability: Durability,
+    ttl: u64,
+}
+
+impl GroupStore {
+    pub(crate) fn new(db: &sled::Db, durability: Durability, ttl: u64) -> ProtocolResult<Self> {
+        Ok(Self {
+            tree: db.open_tree("sender_keys").map_err(|e| db_error("DB open tree error", e))?,
+            cache: RwLock::new(HashMap::new()),
+            durability,
+            ttl,
+        })
+    }
+
+    fn get(&self, key: &[u8]) -> ProtocolResult<Option<SharedSenderKey>> {
+        if let Some(state) = self.cache.read().get(key) {
+            return Ok(Some(state.clone()));
+        }
+        let data = match self.tree.get(key).map_err(|e| db_error("DB get error", e))? {
+            Some(data) => data,
+            None => return Ok(None),
+        };
+        let state = Arc::new(Mutex::new(SenderKeyState::decode(&data, self.ttl)?));
+        // Another thread may have loaded it meanwhile; keep whichever came first.
+        Ok(Some(self.cache.write().entry(key.to_vec()).or_insert(state).clone()))
+    }
+
+    fn put(&self, key: &[u8], state: SenderKeyState) -> ProtocolResult<SharedSenderKey> {
+        self.persist(key, &state)?;
+        let state = Arc::new(Mutex::new(state));
+        self.cache.write().insert(key.to_vec(), state.clone());
+        Ok(state)
+    }
+
+    /// Write a state back after it changed
+    pub(crate) fn persist(&self, key: &[u8], state: &SenderKeyState) -> ProtocolResult<()> {
+        self.tree.insert(key, state.encode()).map_err(|e| db_error("DB insert error", e))?;
+        if self.durability == Durability::Immediate {
+            self.tree.flush().map_err(|e| db_error("DB flush error", e))?;
+        }
+        Ok(())
+    }
+
+    /// Our sending chain for `group_id`, created on first use
+    pub(crate) fn own(&self, group_id: &[u8]) -> ProtocolResult<(Vec<u8>, SharedSenderKey)> {
+        let key = own_key(group_id);
+        let state = match self.get(&key)? {
+            Some(state) => state,
+            None => self.put(&key, SenderKeyState::generate()?)?,
+        };
+        Ok((key, state))
+    }
+
+    /// Replace our sending chain for `group_id` with a fresh one
+    pub(crate) fn rotate_own(&self, group_id: &[u8]) -> ProtocolResult<SharedSenderKey> {
+        self.put(&own_key(group_id), SenderKeyState::generate()?)
+    }
+
+    /// `sender_id`'s chain for `group_id`, if they have distributed one to us
+    pub(crate) fn member(&self, group_id: &[u8], sender_id: &[u8]) -> ProtocolResult<Option<(Vec<u8>, SharedSenderKey)>> {
+        let key = member_key(group_id, sender_id);
+        Ok(self.get(&key)?.map(|state| (key, state)))
+    }
+
+    /// Install (or replace) `sender_id`'s chain for `group_id`
+    pub(crate) fn set_member(&self, group_id: &[u8], sender_id: &[u8], state: SenderKeyState) -> ProtocolResult<()> {
+        self.put(&member_key(group_id, sender_id), state).map(|_| ())
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn member_keys_do_not_collide_across_groups() {
+        // ("ab", "c") and ("a", "bc") concatenate the same; the length prefix keeps them apart.
+        assert_ne!(member_key(b"ab", b"c"), member_key(b"a", b"bc"));
+        assert_ne!(own_key(b"g")[0], member_key(b"g", b"")[0]);
+    }
+}
@@ -1,4 +1,5 @@
 use super::*;
+use crate::codec::{self, Reader, Writer};
 use std::collections::HashMap;
 use serde::{Serialize, Deserialize};
 use zeroize::{Zeroize, ZeroizeOnDrop};
@@ -43,6 +44,83 @@ impl IdentityKeyPair {
     }
 }
 
+/// Binary keystore records (see `codec`), with a JSON fallback for entries
+/// written by older versions.
+trait Record: Sized + for<'de> Deserialize<'de> {
+    const KIND: u8;
+    
+    fn encode_body(&self, w: &mut Writer);
+    fn decode_body(r: &mut Reader<'_>) -> ProtocolResult<Self>;
+    
+    fn encode(&self) -> Vec<u8> {
+        let mut w = Writer::new(Self::KIND, 128);
+        self.encode_body(&mut w);
+        w.finish()
+    }
+    
+    /// Decode a record; the flag is set if it was legacy JSON and should be rewritten.
+    fn decode(data: &[u8]) -> ProtocolResult<(Self, bool)> {
+        if codec::is_legacy_json(data) {
+            let record = serde_json::from_slice(data).map_err(|_| ProtocolError::InternalError("Deserialization failed".into()))?;
+            return Ok((record, true));
+        }
+        let mut r = Reader::open(data, Self::KIND)?;
+        let record = Self::decode_body(&mut r)?;
+        r.finish()?;
+        Ok((record, false))
+    }
+}
+
+impl Record for IdentityKeyPair {
+    const KIND: u8 = codec::KIND_IDENTITY;
+    
+    fn encode_body(&self, w: &mut Writer) {
+        w.bytes(&self.private);
+        w.bytes(&self.public);
+    }
+    
+    fn decode_body(r: &mut Reader<'_>) -> ProtocolResult<Self> {
+        Ok(Self {
+            private: r.bytes()?.to_vec(),
+            public: r.bytes()?.to_vec(),
+        })
+    }
+}
+
+impl Record for PreKeyPair {
+    const KIND: u8 = codec::KIND_PREKEY;
+    
+    fn encode_body(&self, w: &mut Writer) {
+        w.bytes(&self.private);
+        w.bytes(&self.public);
+    }
+    
+    fn decode_body(r: &mut Reader<'_>) -> ProtocolResult<Self> {
+        Ok(Self {
+            private: r.bytes()?.to_vec(),
+            public: r.bytes()?.to_vec(),
+        })
+    }
+}
+
+impl Record for SignedPreKeyPair {
+    const KIND: u8 = codec::KIND_SIGNED_PREKEY;
+    
+    fn encode_body(&self, w: &mut Writer) {
+        w.bytes(&self.private);
+        w.bytes(&self.public);
+        w.bytes(&self.signature);
+    }
+    
+    fn decode_body(r: &mut Reader<'_>) -> ProtocolResult<Self> {
+        Ok(Self {
+            private: r.bytes()?.to_vec(),
+            public: r.bytes()?.to_vec(),
+            signature: r.bytes()?.to_vec(),
+        })
+    }
+}
+
 mod serde_bytes {
     use serde::{Serializer, Deserializer};
     pub fn serialize<S>(bytes: &Vec<u8>, serializer: S) -> Result<S::Ok, S::Error>
@@ -71,7 +149,11 @@ impl KeyStore {
 
         // Try to load existing identity key
         if let Ok(Some(ivec)) = tree.get(b"identity") {
-            if let Ok(loaded) = serde_json::from_slice::<IdentityKeyPair>(&ivec) {
+            if let Ok((loaded, legacy)) = IdentityKeyPair::decode(&ivec) {
+                if legacy {
+                    // Migrate to the binary format; the JSON entry stays readable if this fails.
+                    let _ = tree.insert(b"identity", loaded.encode());
+                }
                 return Ok(Self {
                     identity_key: RwLock::new(Some(loaded)),
                     db: tree,
@@ -81,8 +163,7 @@ impl KeyStore {
 
         // Auto-generate identity key on new store for simplicity in this blueprint
         let identity = IdentityKeyPair::generate();
-        let bytes = serde_json::to_vec(&identity).map_err(|_| ProtocolError::InternalError("Serialization failed".into()))?;
-        tree.insert(b"identity", bytes).map_err(|e| ProtocolError::InternalError(format!("DB insert error: {}", e)))?;
+        tree.insert(b"identity", identity.encode()).map_err(|e| ProtocolError::InternalError(format!("DB insert error: {}", e)))?;
 
         Ok(Self {
             identity_key: RwLock::new(Some(identity)),
@@ -104,19 +185,15 @@ impl KeyStore {
     }
     /// Save a One-Time PreKey
     pub fn save_prekey(&self, id: u32, keypair: &PreKeyPair) -> ProtocolResult<()> {
-        let bytes = serde_json::to_vec(keypair).map_err(|_| ProtocolError::InternalError("Serialization failed".into()))?;
         let key = format!("prekey:{}", id);
-        self.db.insert(key.as_bytes(), bytes).map_err(|e| ProtocolError::InternalError(format!("DB insert error: {}", e)))?;
+        self.db.insert(key.as_bytes(), keypair.encode()).map_err(|e| ProtocolError::InternalError(format!("DB insert error: {}", e)))?;
         Ok(())
     }
 
     /// Get a One-Time PreKey
     pub fn get_prekey(&self, id: u32) -> ProtocolResult<PreKeyPair> {
         let key = format!("prekey:{}", id);
-        match self.db.get(key.as_bytes()).map_err(|e| ProtocolError::InternalError(format!("DB read error: {}", e)))? {
-            Some(ivec) => serde_json::from_slice(&ivec).map_err(|_| ProtocolError::InternalError("Deserialization failed".into())),
-            None => Err(ProtocolError::KeyNotFound),
-        }
+        self.load_record(key.as_bytes())
     }
 
     /// Remove a One-Time PreKey
@@ -128,17 +205,28 @@ impl KeyStore {
 
     /// Save a Signed PreKey
     pub fn save_signed_prekey(&self, id: u32, keypair: &SignedPreKeyPair) -> ProtocolResult<()> {
-        let bytes = serde_json::to_vec(keypair).map_err(|_| ProtocolError::InternalError("Serialization failed".into()))?;
         let key = format!("signed_prekey:{}", id);
-        self.db.insert(key.as_bytes(), bytes).map_err(|e| ProtocolError::InternalError(format!("DB insert error: {}", e)))?;
+        self.db.insert(key.as_bytes(), keypair.encode()).map_err(|e| ProtocolError::InternalError(format!("DB insert error: {}", e)))?;
         Ok(())
     }
 
     /// Get a Signed PreKey
     pub fn get_signed_prekey(&self, id: u32) -> ProtocolResult<SignedPreKeyPair> {
         let key = format!("signed_prekey:{}", id);
-        match self.db.get(key.as_bytes()).map_err(|e| ProtocolError::InternalError(format!("DB read error: {}", e)))? {
-            Some(ivec) => serde_json::from_slice(&ivec).map_err(|_| ProtocolError::InternalError("Deserialization failed".into())),
+        self.load_record(key.as_bytes())
+    }
+
+    /// Read and decode a record, rewriting legacy JSON entries in the binary format
+    fn load_record<R: Record>(&self, key: &[u8]) -> ProtocolResult<R> {
+        match self.db.get(key).map_err(|e| ProtocolError::InternalError(format!("DB read error: {}", e)))? {
+            Some(ivec) => {
+                let (record, legacy) = R::decode(&ivec)?;
+                if legacy {
+                    // Only replace the entry if nobody rewrote it meanwhile.
+                    let _ = self.db.compare_and_swap(key, Some(ivec), Some(record.encode()));
+                }
+                Ok(record)
+            }
             None => Err(ProtocolError::KeyNotFound),
         }
     }
@@ -12,6 +12,10 @@ pub mod ratchet;
 pub mod handshake;
 pub mod keystore;
 pub mod error;
+pub mod group;
+mod cache;
+mod codec;
+mod persistence;
 
 // FFI Modules
 #[cfg(feature = "ffi")]
@@ -23,7 +27,12 @@ pub use ratchet::*;
 pub use handshake::*;
 pub use keystore::*;
 pub use error::{ProtocolError, ProtocolResult};
+pub use cache::CacheStats;
+pub use persistence::Durability;
 
+use group::{GroupStore, SenderKeyDistribution, SenderKeyState};
+use persistence::{GroupCommitter, SessionStore};
+use once_cell::sync::OnceCell;
 use std::sync::Arc;
 use parking_lot::RwLock;
 use sled;
@@ -32,14 +41,22 @@ use std::path::PathBuf;
 /// Main System Context
 #[derive(Clone)]
 pub struct SecureContext {
-    keystore: Arc<RwLock<KeyStore>>,
-    sessions: Arc<RwLock<SessionManager>>,
+    /// Opened by the first operation that needs it
+    storage: Arc<OnceCell<Storage>>,
     config: Config,
     random: Arc<RwLock<SecureRandom>>,
 }
 
+/// Keystore, sessions and group sender keys backed by the sled database
+struct Storage {
+    keystore: RwLock<KeyStore>,
+    sessions: SessionManager,
+    groups: GroupStore,
+}
+
 /// System Configuration
 #[derive(Clone, Debug, serde::Serialize, serde::Deserialize)]
+#[serde(default)]
 pub struct Config {
     /// Enable Forward Secrecy
     pub enable_forward_secrecy: bool,
@@ -47,12 +64,29 @@ pub struct Config {
     pub enable_post_compromise_security: bool,
     /// Max skipped messages
     pub max_skipped_messages: usize,
+    /// Seconds a skipped message key is kept (0 = until evicted by the cap)
+    pub skipped_key_ttl: u64,
     /// Key rotation interval (seconds)
     pub key_rotation_interval: u64,
     /// Handshake timeout (seconds)
     pub handshake_timeout: u64,
     /// Message buffer size
     pub message_buffer_size: usize,
+    /// Session persistence durability
+    pub durability: Durability,
+    /// Group commit: longest a dirty session waits before it is flushed (ms)
+    pub flush_interval_ms: u64,
+    /// Group commit: flush early once this many sessions are dirty
+    pub flush_max_pending: usize,
+    /// Most sessions kept in memory; others are reloaded from storage (0 = unbounded)
+    pub session_cache_capacity: usize,
+    /// Lock shards of the session map (0 = a few per CPU)
+    pub session_shards: usize,
+    /// Directory of the sled database holding sessions and keys. sled locks it,
+    /// so processes sharing one store should go through a session daemon.
+    pub db_path: PathBuf,
+    /// sled page cache size (bytes)
+    pub db_cache_capacity: u64,
 }
 
 impl Default for Config {
@@ -61,42 +95,112 @@ impl Default for Config {
             enable_forward_secrecy: true,
             enable_post_compromise_security: true,
             max_skipped_messages: 2000,
+            skipped_key_ttl: ratchet::DEFAULT_SKIPPED_KEY_TTL,
             key_rotation_interval: 86400, // 24 hours
             handshake_timeout: 30,
             message_buffer_size: 1024,
+            durability: Durability::Immediate,
+            flush_interval_ms: 50,
+            flush_max_pending: 256,
+            session_cache_capacity: 10_000,
+            session_shards: 0,
+            db_path: PathBuf::from("secure_core_db"),
+            db_cache_capacity: 64 * 1024 * 1024,
         }
     }
 }
 
 impl SecureContext {
-    /// Create a new context
+    /// Create a new context. The database is opened (and an identity
+    /// generated for a new store) by the first operation that needs it.
     pub fn new(config: Config) -> ProtocolResult<Self> {
-        // Open a sled database for persistence (sessions + keystore)
-        let db_path = PathBuf::from("secure_core_db");
-        let db = sled::open(&db_path).map_err(|e| ProtocolError::InternalError(format!("DB open error: {}", e)))?;
-
-        let keystore = KeyStore::new(Arc::new(db.clone()))?;
-        let sessions = SessionManager::new(config.clone(), Arc::new(db));
         let random = SecureRandom::new()?;
         
         Ok(Self {
-            keystore: Arc::new(RwLock::new(keystore)),
-            sessions: Arc::new(RwLock::new(sessions)),
+            storage: Arc::new(OnceCell::new()),
             config,
             random: Arc::new(RwLock::new(random)),
         })
     }
     
+    /// Open the database now instead of on first use, e.g. to fail fast on a bad path
+    pub fn open(&self) -> ProtocolResult<()> {
+        self.storage().map(|_| ())
+    }
+    
+    fn storage(&self) -> ProtocolResult<&Storage> {
+        self.storage.get_or_try_init(|| {
+            // Open a sled database for persistence (sessions + keystore)
+            let db = sled::Config::new()
+                .path(&self.config.db_path)
+                .cache_capacity(self.config.db_cache_capacity)
+                .open()
+                .map_err(|e| ProtocolError::InternalError(format!("DB open error: {}", e)))?;
+            
+            let keystore = KeyStore::new(Arc::new(db.clone()))?;
+            let groups = GroupStore::new(&db, self.config.durability, self.config.skipped_key_ttl)?;
+            let sessions = SessionManager::new(self.config.clone(), Arc::new(db));
+            Ok(Storage {
+                keystore: RwLock::new(keystore),
+                sessions,
+                groups,
+            })
+        })
+    }
+    
+    fn sessions(&self) -> ProtocolResult<&SessionManager> {
+        self.storage().map(|storage| &storage.sessions)
+    }
+    
     /// Create a new session
     pub fn create_session(&self, peer_id: &[u8]) -> ProtocolResult<SessionHandle> {
-        let mut sessions = self.sessions.write();
-        sessions.create_session(peer_id, self.config.clone())
+        self.sessions()?.create_session(peer_id, self.config.clone())
+    }
+    
+    /// Existing session for `peer_id`, from the cache or the store.
+    /// Fails with `SessionNotFound` if there is none.
+    pub fn load_session(&self, peer_id: &[u8]) -> ProtocolResult<SessionHandle> {
+        let session = self.sessions()?.get_session(peer_id)?;
+        Ok(SessionHandle {
+            peer_id: peer_id.to_vec(),
+            session,
+        })
+    }
+    
+    /// Install an already established session (e.g. from an out-of-band handshake)
+    pub fn insert_session(&self, peer_id: &[u8], session: DoubleRatchetSession) -> ProtocolResult<SessionHandle> {
+        self.sessions()?.insert_session(peer_id, session)
+    }
+    
+    /// Establish the session with `peer_id` from a secret the peer also holds,
+    /// replacing any existing one. One side passes `initiator = true`, the
+    /// other `false`; see `DoubleRatchetSession::from_pre_shared`.
+    pub fn establish_session(&self, peer_id: &[u8], shared_secret: &[u8; 32], initiator: bool) -> ProtocolResult<SessionHandle> {
+        let session = DoubleRatchetSession::from_pre_shared(shared_secret, initiator, self.config.clone())?;
+        self.insert_session(peer_id, session)
+    }
+    
+    /// Persist all pending session updates (a no-op beyond an fsync in `Durability::Immediate`)
+    pub fn flush(&self) -> ProtocolResult<()> {
+        match self.storage.get() {
+            Some(storage) => storage.sessions.flush(),
+            None => Ok(()),
+        }
+    }
+    
+    /// Session cache hit/miss/eviction counters
+    pub fn cache_stats(&self) -> CacheStats {
+        match self.storage.get() {
+            Some(storage) => storage.sessions.cache_stats(),
+            None => CacheStats::default(),
+        }
     }
     
     /// Load an identity key pair into the keystore.
-    pub fn load_identity(&mut self, public: &[u8], private: &[u8]) {
+    pub fn load_identity(&mut self, public: &[u8], private: &[u8]) -> ProtocolResult<()> {
         let keypair = crate::keystore::IdentityKeyPair::from_bytes(public, private);
-        self.keystore.write().set_identity(keypair);
+        self.storage()?.keystore.write().set_identity(keypair);
+        Ok(())
     }
     
     /// Perform handshake with peer
@@ -107,10 +211,10 @@ impl SecureContext {
         peer_public_key: Option<&[u8]>,
         prologue: Option<&[u8]>,
     ) -> ProtocolResult<Vec<u8>> {
-        let sessions = self.sessions.read();
-        let session = sessions.get_session(session_id)?;
+        let storage = self.storage()?;
+        let session = storage.sessions.get_session(session_id)?;
         
-        let keystore = self.keystore.read();
+        let keystore = storage.keystore.read();
         let random = self.random.read();
         
         let handshake = HandshakeBuilder::new()
@@ -146,23 +250,15 @@ impl SecureContext {
         plaintext: &[u8],
         associated_data: Option<&[u8]>,
     ) -> ProtocolResult<Vec<u8>> {
-        let sessions = self.sessions.read();
-        let session = sessions.get_session(session_id)?;
+        let session = self.sessions()?.get_session(session_id)?;
         
         let mut session = session.write();
         let ad = associated_data.unwrap_or_default();
         
         let res = session.encrypt(plaintext, ad)?;
         
-        // Persist state
-        drop(session); // release write lock before saving (though not strictly necessary as save_session takes &self)
-        let session_read = sessions.get_session(session_id)?.read().clone(); // Need to re-acquire or just use what we had?
-        // Actually, we can just use the session we have. But session is RwLockWriteGuard.
-        // We need to pass &DoubleRatchetSession.
-        // Let's re-acquire read lock or clearer: just deref the write guard.
-        // Sled is thread safe.
-        // self.sessions.read() is held in `sessions` variable.
-        self.sessions.read().save_session(session_id, &*sessions.get_session(session_id)?.read())?;
+        // Persist state (or queue it for the next group commit)
+        self.sessions()?.commit_session(session_id, &*session)?;
         
         Ok(res)
     }
@@ -174,28 +270,169 @@ impl SecureContext {
         ciphertext: &[u8],
         associated_data: Option<&[u8]>,
     ) -> ProtocolResult<Vec<u8>> {
-        let sessions = self.sessions.read();
-        let session = sessions.get_session(session_id)?;
+        let session = self.sessions()?.get_session(session_id)?;
         
         let mut session = session.write();
         let ad = associated_data.unwrap_or_default();
         
         let res = session.decrypt(ciphertext, ad)?;
         
-        // Persist state
-        self.sessions.read().save_session(session_id, &*session)?;
+        // Persist state (or queue it for the next group commit)
+        self.sessions()?.commit_session(session_id, &*session)?;
         
         Ok(res)
     }
     
+    /// Encrypt a burst of messages for one session. The session is locked once
+    /// and its state persisted once, after the last message. All or nothing:
+    /// if any message fails, the session is left as it was and nothing is persisted.
+    pub fn encrypt_batch<T: AsRef<[u8]>>(
+        &self,
+        session_id: &[u8],
+        plaintexts: &[T],
+        associated_data: Option<&[u8]>,
+    ) -> ProtocolResult<Vec<Vec<u8>>> {
+        let session = self.sessions()?.get_session(session_id)?;
+        
+        let mut session = session.write();
+        let ad = associated_data.unwrap_or_default();
+        
+        let res = session.encrypt_batch(plaintexts, ad)?;
+        
+        // Persist state (or queue it for the next group commit)
+        self.sessions()?.commit_session(session_id, &*session)?;
+        
+        Ok(res)
+    }
+    
+    /// Decrypt a burst of messages for one session under a single lock and a
+    /// single persist. Each message gets its own result, so one forged or
+    /// corrupted message does not cost the plaintexts of the others; a message
+    /// that fails leaves the session untouched, so only what the successful
+    /// ones advanced is persisted.
+    pub fn decrypt_batch<T: AsRef<[u8]>>(
+        &self,
+        session_id: &[u8],
+        ciphertexts: &[T],
+        associated_data: Option<&[u8]>,
+    ) -> ProtocolResult<Vec<ProtocolResult<Vec<u8>>>> {
+        let session = self.sessions()?.get_session(session_id)?;
+        
+        let mut session = session.write();
+        let ad = associated_data.unwrap_or_default();
+        
+        let res = ciphertexts
+            .iter()
+            .map(|ciphertext| session.decrypt(ciphertext.as_ref(), ad))
+            .collect();
+        
+        // Persist state (or queue it for the next group commit)
+        self.sessions()?.commit_session(session_id, &*session)?;
+        
+        Ok(res)
+    }
+    
+    /// Encrypt a message into `out` (at least `plaintext.len() + MESSAGE_OVERHEAD`
+    /// bytes) without allocating for the ciphertext. Returns the bytes written.
+    pub fn encrypt_message_into(
+        &self,
+        session_id: &[u8],
+        plaintext: &[u8],
+        associated_data: Option<&[u8]>,
+        out: &mut [u8],
+    ) -> ProtocolResult<usize> {
+        let session = self.sessions()?.get_session(session_id)?;
+        
+        let mut session = session.write();
+        let ad = associated_data.unwrap_or_default();
+        
+        let written = session.encrypt_into(plaintext, ad, out)?;
+        
+        // Persist state (or queue it for the next group commit)
+        self.sessions()?.commit_session(session_id, &*session)?;
+        
+        Ok(written)
+    }
+    
+    /// Decrypt a message into `out` (at least `ciphertext.len() - MESSAGE_OVERHEAD`
+    /// bytes). Returns the plaintext length.
+    pub fn decrypt_message_into(
+        &self,
+        session_id: &[u8],
+        ciphertext: &[u8],
+        associated_data: Option<&[u8]>,
+        out: &mut [u8],
+    ) -> ProtocolResult<usize> {
+        let session = self.sessions()?.get_session(session_id)?;
+        
+        let mut session = session.write();
+        let ad = associated_data.unwrap_or_default();
+        
+        let written = session.decrypt_into(ciphertext, ad, out)?;
+        
+        // Persist state (or queue it for the next group commit)
+        self.sessions()?.commit_session(session_id, &*session)?;
+        
+        Ok(written)
+    }
+    
+    /// Our sender key for `group_id` (created on first use), encoded as a
+    /// distribution message to send each member over their pairwise session
+    pub fn group_sender_key(&self, group_id: &[u8]) -> ProtocolResult<Vec<u8>> {
+        let (_, state) = self.storage()?.groups.own(group_id)?;
+        let distribution = state.lock().distribution(group_id);
+        Ok(distribution.encode())
+    }
+    
+    /// Replace our sender key for `group_id`, e.g. after a member leaves.
+    /// Returns the new distribution message; members must receive it before
+    /// they can read anything sent afterwards.
+    pub fn rotate_group_sender_key(&self, group_id: &[u8]) -> ProtocolResult<Vec<u8>> {
+        let state = self.storage()?.groups.rotate_own(group_id)?;
+        let distribution = state.lock().distribution(group_id);
+        Ok(distribution.encode())
+    }
+    
+    /// Install the sender key `sender_id` distributed to us. Returns its group id.
+    pub fn process_group_sender_key(&self, sender_id: &[u8], distribution: &[u8]) -> ProtocolResult<Vec<u8>> {
+        let distribution = SenderKeyDistribution::decode(distribution)?;
+        let state = SenderKeyState::from_distribution(
+            &distribution,
+            self.config.max_skipped_messages,
+            self.config.skipped_key_ttl,
+        );
+        self.storage()?.groups.set_member(&distribution.group_id, sender_id, state)?;
+        Ok(distribution.group_id)
+    }
+    
+    /// Encrypt a group message once; the result goes unchanged to every member
+    pub fn group_encrypt(&self, group_id: &[u8], plaintext: &[u8]) -> ProtocolResult<Vec<u8>> {
+        let groups = &self.storage()?.groups;
+        let (key, state) = groups.own(group_id)?;
+        let mut state = state.lock();
+        let res = state.encrypt(group_id, plaintext)?;
+        groups.persist(&key, &state)?;
+        Ok(res)
+    }
+    
+    /// Decrypt a group message from `sender_id`. Fails with `SessionNotFound`
+    /// until their sender key has been processed.
+    pub fn group_decrypt(&self, group_id: &[u8], sender_id: &[u8], message: &[u8]) -> ProtocolResult<Vec<u8>> {
+        let groups = &self.storage()?.groups;
+        let (key, state) = groups.member(group_id, sender_id)?.ok_or(ProtocolError::SessionNotFound)?;
+        let mut state = state.lock();
+        let res = state.decrypt(group_id, message)?;
+        groups.persist(&key, &state)?;
+        Ok(res)
+    }
+    
     /// Deserialize session state
     pub fn deserialize_session_state(
         &self,
         session_id: &[u8],
         state: &[u8],
     ) -> ProtocolResult<()> {
-        let sessions = self.sessions.read();
-        let session = sessions.get_session(session_id)?;
+        let session = self.sessions()?.get_session(session_id)?;
         
         let mut session = session.write();
         session.deserialize_state(state) // Ensure this method exists in DoubleRatchetSession
@@ -204,37 +441,56 @@ impl SecureContext {
 
 /// Session Manager
 pub struct SessionManager {
-    sessions: parking_lot::RwLock<std::collections::HashMap<Vec<u8>, Arc<RwLock<DoubleRatchetSession>>>>,
-    db: sled::Tree,
+    store: Arc<SessionStore>,
     config: Config,
+    /// Held for its Drop, which performs the final commit
+    #[allow(dead_code)]
+    committer: Option<GroupCommitter>,
 }
 
 impl SessionManager {
     /// Create new session manager
     pub fn new(config: Config, db: Arc<sled::Db>) -> Self {
-        let tree = db.open_tree("sessions").expect("failed to open sessions tree");
+        let store = SessionStore::new(&db, config.flush_max_pending, config.session_cache_capacity, config.session_shards)
+            .expect("failed to open session trees");
+        let store = Arc::new(store);
+        let committer = match config.durability {
+            Durability::Immediate => None,
+            Durability::GroupCommit => Some(
+                GroupCommitter::spawn(store.clone(), std::time::Duration::from_millis(config.flush_interval_ms))
+                    .expect("failed to start group commit thread"),
+            ),
+        };
         Self {
-            sessions: parking_lot::RwLock::new(std::collections::HashMap::new()),
-            db: tree,
+            store,
             config,
+            committer,
         }
     }
     
     /// Create a new session
     pub fn create_session(
-        &mut self,
+        &self,
         peer_id: &[u8],
         config: Config,
     ) -> ProtocolResult<SessionHandle> {
         let session = DoubleRatchetSession::new(config)?;
+        self.insert_session(peer_id, session)
+    }
+    
+    /// Insert a session, replacing any existing one for `peer_id`
+    pub fn insert_session(
+        &self,
+        peer_id: &[u8],
+        session: DoubleRatchetSession,
+    ) -> ProtocolResult<SessionHandle> {
         let session = Arc::new(RwLock::new(session));
         // Persist initial session state
-        let state_bytes = session.read().serialize_state()?;
-        self.db.insert(peer_id, state_bytes).map_err(|e| ProtocolError::InternalError(format!("DB insert error: {}", e)))?;
+        self.store.persist(peer_id, &*session.read())?;
+        self.store.forget(peer_id);
 
         // Cache in-memory
-        let mut sessions = self.sessions.write();
-        sessions.insert(peer_id.to_vec(), session.clone());
+        self.store.cache_replace(peer_id, session.clone());
         
         Ok(SessionHandle {
             peer_id: peer_id.to_vec(),
@@ -247,44 +503,46 @@ impl SessionManager {
         &self,
         session_id: &[u8],
     ) -> ProtocolResult<Arc<RwLock<DoubleRatchetSession>>> {
-        // Try in-memory cache first
-        {
-            let sessions = self.sessions.read();
-            if let Some(s) = sessions.get(session_id) {
-                return Ok(s.clone());
-            }
-        }
-
-        // Try loading from persistent store
-        match self.db.get(session_id).map_err(|e| ProtocolError::InternalError(format!("DB read error: {}", e)))? {
-            Some(ivec) => {
-                // Reconstruct a session and deserialize state
-                let mut session = DoubleRatchetSession::new(self.config.clone())?;
-                session.deserialize_state(&ivec)?;
-                let arc_s = Arc::new(RwLock::new(session));
-                // Insert into cache
-                let mut sessions = self.sessions.write();
-                sessions.insert(session_id.to_vec(), arc_s.clone());
-                Ok(arc_s)
-            }
-            None => Err(ProtocolError::SessionNotFound),
-        }
+        // In-memory cache first, then the persistent store
+        self.store
+            .cached_or_load(session_id, |state| DoubleRatchetSession::from_state(state, self.config.clone()))?
+            .ok_or(ProtocolError::SessionNotFound)
     }
     
-    /// Save session state to persistence
+    /// Save the session's changes since it was last persisted
     pub fn save_session(&self, peer_id: &[u8], session: &DoubleRatchetSession) -> ProtocolResult<()> {
-        let state_bytes = session.serialize_state()?;
-        self.db.insert(peer_id, state_bytes).map_err(|e| ProtocolError::InternalError(format!("DB insert error: {}", e)))?;
+        self.store.persist(peer_id, session)?;
         // Ensure data is flushed to disk (optional but safer for critical steps)
-        self.db.flush().map_err(|e| ProtocolError::InternalError(format!("DB flush error: {}", e)))?;
-        Ok(())
+        self.store.sync()
+    }
+    
+    /// Record an updated session according to the configured durability:
+    /// saved immediately, or marked dirty for the group-commit thread.
+    pub fn commit_session(&self, peer_id: &[u8], session: &DoubleRatchetSession) -> ProtocolResult<()> {
+        match self.config.durability {
+            Durability::Immediate => self.save_session(peer_id, session),
+            Durability::GroupCommit => {
+                self.store.mark_dirty(peer_id);
+                Ok(())
+            }
+        }
+    }
+    
+    /// Persist all dirty sessions and flush the tree
+    pub fn flush(&self) -> ProtocolResult<()> {
+        self.store.flush()
+    }
+    
+    /// Session cache counters
+    pub fn cache_stats(&self) -> CacheStats {
+        self.store.cache_stats()
     }
 
     /// Remove session
-    pub fn remove_session(&mut self, session_id: &[u8]) -> bool {
-        let mut sessions = self.sessions.write();
-        let removed = sessions.remove(session_id).is_some();
-        let _ = self.db.remove(session_id);
+    pub fn remove_session(&self, session_id: &[u8]) -> bool {
+        let removed = self.store.uncache(session_id).is_some();
+        self.store.forget(session_id);
+        let _ = self.store.remove(session_id);
         removed
     }
 }
@@ -322,8 +580,7 @@ mod tests {
         let _handle = ctx.create_session(peer).expect("create session");
 
         // Serialize current state
-        let sessions_read = ctx.sessions.read();
-        let s = sessions_read.get_session(peer).expect("get session");
+        let s = ctx.sessions().unwrap().get_session(peer).expect("get session");
         let state_before = s.read().serialize_state().expect("serialize");
 
         // Drop context to simulate shutdown
@@ -331,10 +588,372 @@ mod tests {
 
         // Re-open context
         let ctx2 = SecureContext::new(cfg).expect("reopen ctx");
-        let sessions_read2 = ctx2.sessions.read();
-        let s2 = sessions_read2.get_session(peer).expect("load session");
+        let s2 = ctx2.sessions().unwrap().get_session(peer).expect("load session");
         let state_after = s2.read().serialize_state().expect("serialize after");
 
         assert_eq!(state_before, state_after);
     }
+
+    #[test]
+    fn session_state_binary_roundtrip_and_json_migration() {
+        let session = DoubleRatchetSession::new(Config::default()).unwrap();
+        let mut state = DoubleRatchetState::decode(&session.serialize_state().unwrap()).unwrap();
+        state.previous_counter = 300;
+        state.skipped_message_keys.insert((7, [3u8; 32]), [4u8; 32]);
+
+        let decoded = DoubleRatchetState::decode(&state.encode()).unwrap();
+        assert_eq!(decoded.dh_local_bytes, state.dh_local_bytes);
+        assert!(decoded.dh_local.is_some());
+        assert_eq!(decoded.previous_counter, 300);
+        assert_eq!(decoded.skipped_message_keys.get(&(7, [3u8; 32])), Some(&[4u8; 32]));
+
+        // Records written before the binary codec are still readable.
+        state.skipped_message_keys.clear();
+        let legacy = serde_json::to_vec(&state).unwrap();
+        let mut restored = DoubleRatchetSession::new(Config::default()).unwrap();
+        restored.deserialize_state(&legacy).unwrap();
+        assert_eq!(restored.serialize_state().unwrap(), state.encode());
+    }
+
+    #[test]
+    fn in_place_aead_matches_allocating_path() {
+        let handler = crate::crypto::CryptoHandler::new(&[5u8; 32]).unwrap();
+        let plaintext = b"in place";
+        let mut sealed = [0u8; 8 + crate::crypto::NONCE_LENGTH + crate::crypto::TAG_LENGTH];
+        let n = handler.encrypt_into(plaintext, b"", &mut sealed).unwrap();
+        assert_eq!(handler.decrypt(&sealed[..n], b"").unwrap(), plaintext);
+
+        let mut opened = [0u8; 8];
+        let sealed = handler.encrypt(plaintext, b"").unwrap();
+        assert_eq!(handler.decrypt_into(&sealed, b"", &mut opened).unwrap(), 8);
+        assert_eq!(&opened, plaintext);
+
+        assert_eq!(handler.encrypt_into(plaintext, b"", &mut [0u8; 16]), Err(crate::crypto::CryptoError::BufferTooSmall));
+    }
+
+    fn group_commit_config(interval_ms: u64, max_pending: usize) -> Config {
+        Config {
+            durability: Durability::GroupCommit,
+            flush_interval_ms: interval_ms,
+            flush_max_pending: max_pending,
+            ..Config::default()
+        }
+    }
+
+    /// Session state as currently persisted
+    fn stored(manager: &SessionManager, peer: &[u8]) -> Vec<u8> {
+        manager.store.load(peer).unwrap().unwrap().encode()
+    }
+
+    /// Give `peer` a fresh random state and record the update; returns the new state.
+    fn advance(manager: &SessionManager, peer: &[u8]) -> Vec<u8> {
+        let next = DoubleRatchetSession::new(Config::default()).unwrap().serialize_state().unwrap();
+        let session = manager.get_session(peer).unwrap();
+        let mut guard = session.write();
+        guard.deserialize_state(&next).unwrap();
+        manager.commit_session(peer, &*guard).unwrap();
+        next
+    }
+
+    #[test]
+    fn group_commit_defers_writes_until_flush() {
+        let dir = tempfile::tempdir().unwrap();
+        let db = Arc::new(sled::open(dir.path()).unwrap());
+        let manager = SessionManager::new(group_commit_config(3_600_000, 1_000), db);
+        let peer = b"peer-deferred";
+        manager.create_session(peer, Config::default()).unwrap();
+        let created = stored(&manager, peer);
+
+        let next = advance(&manager, peer);
+        assert_eq!(stored(&manager, peer), created);
+
+        manager.flush().unwrap();
+        assert_eq!(stored(&manager, peer), next);
+    }
+
+    #[test]
+    fn group_commit_flushes_on_pending_budget() {
+        let dir = tempfile::tempdir().unwrap();
+        let db = Arc::new(sled::open(dir.path()).unwrap());
+        let manager = SessionManager::new(group_commit_config(3_600_000, 2), db);
+        manager.create_session(b"a", Config::default()).unwrap();
+        manager.create_session(b"b", Config::default()).unwrap();
+
+        let next_a = advance(&manager, b"a");
+        let next_b = advance(&manager, b"b");
+
+        let deadline = std::time::Instant::now() + std::time::Duration::from_secs(5);
+        while stored(&manager, b"b") != next_b {
+            assert!(std::time::Instant::now() < deadline, "background commit did not run");
+            std::thread::sleep(std::time::Duration::from_millis(5));
+        }
+        assert_eq!(stored(&manager, b"a"), next_a);
+    }
+
+    #[test]
+    fn group_commit_final_flush_on_drop() {
+        let dir = tempfile::tempdir().unwrap();
+        let peer = b"peer-drop";
+        let next = {
+            let db = Arc::new(sled::open(dir.path()).unwrap());
+            let manager = SessionManager::new(group_commit_config(3_600_000, 1_000), db);
+            manager.create_session(peer, Config::default()).unwrap();
+            advance(&manager, peer)
+        };
+
+        let db = Arc::new(sled::open(dir.path()).unwrap());
+        let manager = SessionManager::new(Config::default(), db);
+        let loaded = manager.get_session(peer).unwrap().read().serialize_state().unwrap();
+        assert_eq!(loaded, next);
+    }
+
+    #[test]
+    fn session_cache_writes_back_before_eviction() {
+        let dir = tempfile::tempdir().unwrap();
+        let db = Arc::new(sled::open(dir.path()).unwrap());
+        let cfg = Config { session_cache_capacity: 2, session_shards: 1, ..group_commit_config(3_600_000, 1_000) };
+        let manager = SessionManager::new(cfg, db);
+        manager.create_session(b"a", Config::default()).unwrap();
+        let next_a = advance(&manager, b"a");
+        manager.create_session(b"b", Config::default()).unwrap();
+        manager.create_session(b"c", Config::default()).unwrap();
+
+        let stats = manager.cache_stats();
+        assert_eq!((stats.entries, stats.evictions), (2, 1));
+        // "a" was evicted with an unflushed update, which must have been written back.
+        assert_eq!(stored(&manager, b"a"), next_a);
+        let reloaded = manager.get_session(b"a").unwrap().read().serialize_state().unwrap();
+        assert_eq!(reloaded, next_a);
+        assert_eq!(manager.cache_stats().misses, stats.misses + 1);
+    }
+
+    #[test]
+    fn session_cache_never_evicts_sessions_in_use() {
+        let dir = tempfile::tempdir().unwrap();
+        let db = Arc::new(sled::open(dir.path()).unwrap());
+        let cfg = Config { session_cache_capacity: 2, session_shards: 1, ..Config::default() };
+        let manager = SessionManager::new(cfg, db);
+        let _pinned = manager.create_session(b"a", Config::default()).unwrap();
+        manager.create_session(b"b", Config::default()).unwrap();
+        manager.create_session(b"c", Config::default()).unwrap();
+
+        let misses = manager.cache_stats().misses;
+        manager.get_session(b"a").unwrap();
+        assert_eq!(manager.cache_stats().misses, misses);
+        assert_eq!(manager.cache_stats().evictions, 1);
+    }
+
+    #[test]
+    fn concurrent_loads_never_resurrect_evicted_state() {
+        let dir = tempfile::tempdir().unwrap();
+        let db = Arc::new(sled::open(dir.path()).unwrap());
+        let cfg = Config { session_cache_capacity: 1, session_shards: 1, ..group_commit_config(3_600_000, 1_000_000) };
+        let manager = SessionManager::new(cfg, db);
+        manager.create_session(b"counter", Config::default()).unwrap();
+        manager.create_session(b"other", Config::default()).unwrap();
+
+        // Every thread increments the counter session, then loads the other
+        // one, which evicts the counter. A load that raced the eviction and
+        // cached an older copy would lose increments.
+        const THREADS: u64 = 4;
+        const ROUNDS: u64 = 200;
+        std::thread::scope(|scope| {
+            for _ in 0..THREADS {
+                scope.spawn(|| {
+                    for _ in 0..ROUNDS {
+                        {
+                            let session = manager.get_session(b"counter").unwrap();
+                            let mut guard = session.write();
+                            let mut state = DoubleRatchetState::decode(&guard.serialize_state().unwrap()).unwrap();
+                            state.previous_counter += 1;
+                            guard.deserialize_state(&state.encode()).unwrap();
+                            manager.commit_session(b"counter", &*guard).unwrap();
+                        }
+                        manager.get_session(b"other").unwrap();
+                    }
+                });
+            }
+        });
+
+        assert!(manager.cache_stats().evictions > 0);
+        let session = manager.get_session(b"counter").unwrap();
+        let state = DoubleRatchetState::decode(&session.read().serialize_state().unwrap()).unwrap();
+        assert_eq!(state.previous_counter, THREADS * ROUNDS);
+    }
+
+    #[test]
+    fn store_opens_on_first_use() {
+        let dir = tempfile::tempdir().unwrap();
+        let db_path = dir.path().join("db");
+        let ctx = SecureContext::new(Config { db_path: db_path.clone(), ..Config::default() }).unwrap();
+        ctx.flush().unwrap();
+        assert_eq!(ctx.cache_stats().entries, 0);
+        assert!(!db_path.exists());
+
+        ctx.create_session(b"peer").unwrap();
+        assert!(db_path.exists());
+    }
+
+    #[test]
+    fn batch_encrypt_persists_the_whole_burst() {
+        let dir = tempfile::tempdir().unwrap();
+        let cfg = Config { db_path: dir.path().join("db"), ..Config::default() };
+        let ctx = SecureContext::new(cfg.clone()).unwrap();
+        let remote = x25519_dalek::PublicKey::from(&x25519_dalek::StaticSecret::random_from_rng(&mut rand_core::OsRng));
+        let local = x25519_dalek::StaticSecret::random_from_rng(&mut rand_core::OsRng);
+        let session = DoubleRatchetSession::from_shared_secret(&[3u8; 32], local, remote, cfg.clone()).unwrap();
+        ctx.insert_session(b"peer", session).unwrap();
+
+        let plaintexts: [&[u8]; 3] = [b"a", b"bb", b"ccc"];
+        let out = ctx.encrypt_batch(b"peer", &plaintexts, None).unwrap();
+        let lens: Vec<_> = out.iter().map(Vec::len).collect();
+        assert_eq!(lens, vec![1 + MESSAGE_OVERHEAD, 2 + MESSAGE_OVERHEAD, 3 + MESSAGE_OVERHEAD]);
+        assert!(ctx.decrypt_batch(b"missing", &out, None).is_err());
+        drop(ctx);
+
+        let ctx = SecureContext::new(cfg).unwrap();
+        let state = ctx.sessions().unwrap().get_session(b"peer").unwrap().read().serialize_state().unwrap();
+        assert_eq!(DoubleRatchetState::decode(&state).unwrap().sending_chain.unwrap().index, 3);
+    }
+
+    #[test]
+    fn failed_batch_messages_leave_the_session_untouched() {
+        let dir = tempfile::tempdir().unwrap();
+        let cfg = Config { db_path: dir.path().join("db"), ..Config::default() };
+        let ctx = SecureContext::new(cfg.clone()).unwrap();
+        let remote = x25519_dalek::PublicKey::from(&x25519_dalek::StaticSecret::random_from_rng(&mut rand_core::OsRng));
+        let local = x25519_dalek::StaticSecret::random_from_rng(&mut rand_core::OsRng);
+        let session = DoubleRatchetSession::from_shared_secret(&[3u8; 32], local, remote, cfg).unwrap();
+        ctx.insert_session(b"peer", session).unwrap();
+        let state = || ctx.sessions().unwrap().get_session(b"peer").unwrap().read().serialize_state().unwrap();
+        let before = state();
+
+        // Forged messages under a new DH key would otherwise trigger a ratchet step.
+        let mut forged = vec![7u8; HEADER_LENGTH + 40];
+        forged[32..HEADER_LENGTH].fill(0);
+        let results = ctx.decrypt_batch(b"peer", &[forged.clone(), forged], None).unwrap();
+        assert!(results.iter().all(Result::is_err));
+        assert_eq!(state(), before);
+    }
+
+    #[test]
+    fn pre_shared_sessions_talk_both_ways_and_survive_restart() {
+        let dir = tempfile::tempdir().unwrap();
+        let alice_cfg = Config { db_path: dir.path().join("alice"), ..Config::default() };
+        let alice = SecureContext::new(alice_cfg.clone()).unwrap();
+        let bob = SecureContext::new(Config { db_path: dir.path().join("bob"), ..Config::default() }).unwrap();
+        alice.establish_session(b"bob", &[9u8; 32], true).unwrap();
+        bob.establish_session(b"alice", &[9u8; 32], false).unwrap();
+
+        // Bob may speak first; messages from Alice arrive out of order.
+        let hi = bob.encrypt_message(b"alice", b"hi", None).unwrap();
+        assert_eq!(alice.decrypt_message(b"bob", &hi, None).unwrap(), b"hi");
+        let first = alice.encrypt_message(b"bob", b"first", None).unwrap();
+        let second = alice.encrypt_message(b"bob", b"second", None).unwrap();
+        assert_eq!(bob.decrypt_message(b"alice", &second, None).unwrap(), b"second");
+        assert_eq!(bob.decrypt_message(b"alice", &first, None).unwrap(), b"first");
+        assert!(bob.decrypt_message(b"alice", &first, None).is_err());
+
+        drop(alice);
+        let alice = SecureContext::new(alice_cfg).unwrap();
+        let third = alice.encrypt_message(b"bob", b"third", None).unwrap();
+        assert_eq!(bob.decrypt_message(b"alice", &third, None).unwrap(), b"third");
+    }
+
+    #[test]
+    fn group_messages_decrypt_out_of_order_and_survive_restart() {
+        let dir = tempfile::tempdir().unwrap();
+        let alice = SecureContext::new(Config { db_path: dir.path().join("alice"), ..Config::default() }).unwrap();
+        let bob_cfg = Config { db_path: dir.path().join("bob"), ..Config::default() };
+        let bob = SecureContext::new(bob_cfg.clone()).unwrap();
+
+        let distribution = alice.group_sender_key(b"team").unwrap();
+        let messages: Vec<_> = (0..4u8).map(|i| alice.group_encrypt(b"team", &[i; 5]).unwrap()).collect();
+        assert_eq!(messages[0].len(), 5 + group::GROUP_MESSAGE_OVERHEAD);
+
+        assert_eq!(bob.group_decrypt(b"team", b"alice", &messages[0]), Err(ProtocolError::SessionNotFound));
+        assert_eq!(bob.process_group_sender_key(b"alice", &distribution).unwrap(), b"team".to_vec());
+        assert_eq!(bob.group_decrypt(b"team", b"alice", &messages[2]).unwrap(), vec![2u8; 5]);
+        // Wrong group or a tampered message must not move the chain.
+        assert!(bob.group_decrypt(b"other", b"alice", &messages[3]).is_err());
+        let mut forged = messages[3].clone();
+        *forged.last_mut().unwrap() ^= 1;
+        assert!(bob.group_decrypt(b"team", b"alice", &forged).is_err());
+        drop(bob);
+
+        let bob = SecureContext::new(bob_cfg).unwrap();
+        assert_eq!(bob.group_decrypt(b"team", b"alice", &messages[0]).unwrap(), vec![0u8; 5]);
+        assert_eq!(bob.group_decrypt(b"team", b"alice", &messages[3]).unwrap(), vec![3u8; 5]);
+        assert_eq!(bob.group_decrypt(b"team", b"alice", &messages[1]).unwrap(), vec![1u8; 5]);
+        assert!(bob.group_decrypt(b"team", b"alice", &messages[1]).is_err());
+
+        // After a rotation the old key no longer reads new messages.
+        alice.rotate_group_sender_key(b"team").unwrap();
+        assert!(bob.group_decrypt(b"team", b"alice", &alice.group_encrypt(b"team", b"x").unwrap()).is_err());
+    }
+
+    #[test]
+    fn chain_advance_matches_single_steps() {
+        let mut stepped = ChainKey::new([9u8; 32]);
+        let expected: Vec<_> = (0..50).map(|_| stepped.next_message_key()).collect();
+
+        // A deserialized chain has no cached HMAC and must build it lazily.
+        let json = serde_json::to_vec(&ChainKey::new([9u8; 32])).unwrap();
+        let mut bulk: ChainKey = serde_json::from_slice(&json).unwrap();
+        let mut derived = Vec::new();
+        bulk.skip_to(50, 50, |index, key| derived.push((index, key))).unwrap();
+
+        assert_eq!(derived.iter().map(|(i, _)| *i).collect::<Vec<_>>(), (0..50).collect::<Vec<_>>());
+        assert_eq!(derived.into_iter().map(|(_, k)| k).collect::<Vec<_>>(), expected);
+        assert_eq!(bulk.next_message_key(), stepped.clone().next_message_key());
+
+        assert!(bulk.skip_to(200, 100, |_, _| {}).is_err());
+        assert!(bulk.skip_to(10, 100, |_, _| {}).is_err());
+        assert_eq!(bulk.index, 51);
+    }
+
+    /// Runs twice: as the parent it re-executes this test in a child process
+    /// that commits, dirties more state and then aborts; the parent reopens the
+    /// store and checks every session is a complete, committed snapshot.
+    #[test]
+    fn group_commit_crash_consistency() {
+        const DIR_VAR: &str = "SECURE_CORE_CRASH_DIR";
+
+        if let Ok(dir) = std::env::var(DIR_VAR) {
+            let dir = std::path::PathBuf::from(dir);
+            let db = Arc::new(sled::open(dir.join("db")).unwrap());
+            let manager = SessionManager::new(group_commit_config(3_600_000, 1_000), db);
+            manager.create_session(b"flushed", Config::default()).unwrap();
+            manager.create_session(b"pending", Config::default()).unwrap();
+            let flushed = advance(&manager, b"flushed");
+            manager.flush().unwrap();
+            let pending_before = stored(&manager, b"pending");
+            std::fs::write(dir.join("flushed"), &flushed).unwrap();
+            std::fs::write(dir.join("pending_before"), &pending_before).unwrap();
+
+            let pending_after = advance(&manager, b"pending");
+            std::fs::write(dir.join("pending_after"), &pending_after).unwrap();
+            std::process::abort();
+        }
+
+        let dir = tempfile::tempdir().unwrap();
+        let status = std::process::Command::new(std::env::current_exe().unwrap())
+            .args(["--exact", "tests::group_commit_crash_consistency", "--test-threads=1"])
+            .env(DIR_VAR, dir.path())
+            .stdout(std::process::Stdio::null())
+            .stderr(std::process::Stdio::null())
+            .status()
+            .unwrap();
+        assert!(!status.success(), "child process should have aborted");
+
+        let read = |name: &str| std::fs::read(dir.path().join(name)).unwrap();
+        let db = Arc::new(sled::open(dir.path().join("db")).unwrap());
+        let manager = SessionManager::new(Config::default(), db);
+
+        let flushed = manager.get_session(b"flushed").unwrap().read().serialize_state().unwrap();
+        assert_eq!(flushed, read("flushed"));
+
+        let pending = manager.get_session(b"pending").unwrap().read().serialize_state().unwrap();
+        assert!(pending == read("pending_before") || pending == read("pending_after"));
+    }
 }
@@ -0,0 +1,586 @@
+//! Session persistence
+//! Immediate (write + fsync per message) or group-commit durability, with
+//! sessions split across trees so only the changed parts are rewritten.
+
+use crate::cache::{CacheStats, SessionCache, SharedSession};
+use crate::codec;
+use crate::ratchet::unix_time;
+use crate::{DoubleRatchetSession, DoubleRatchetState, ProtocolError, ProtocolResult, SkippedKeyId, StateDelta};
+use parking_lot::{Condvar, Mutex, RwLock};
+use serde::{Serialize, Deserialize};
+use sled::transaction::{ConflictableTransactionError, TransactionError};
+use sled::Transactional;
+use std::collections::hash_map::RandomState;
+use std::collections::HashSet;
+use std::hash::BuildHasher;
+use std::sync::atomic::{AtomicBool, AtomicUsize, Ordering};
+use std::sync::Arc;
+use std::thread::JoinHandle;
+use std::time::Duration;
+
+/// Session persistence durability
+#[derive(Clone, Copy, Debug, Default, PartialEq, Eq, Serialize, Deserialize)]
+pub enum Durability {
+    /// Persist and flush the session after every message
+    #[default]
+    Immediate,
+    /// Mark sessions dirty and persist them from a background thread, once
+    /// `flush_interval_ms` has elapsed or `flush_max_pending` sessions are dirty.
+    /// A crash loses at most the updates since the last group commit.
+    GroupCommit,
+}
+
+const SENDING_CHAIN: u8 = 0x01;
+const RECEIVING_CHAIN: u8 = 0x02;
+
+/// Sled layout, one entry per independently changing part of a session:
+///
+/// - `sessions`:        peer_id -> core record (root key, DH keys, counters)
+/// - `session_chains`:  peer_id || 0x01 (sending) / 0x02 (receiving) -> chain record
+/// - `session_skipped`: len(peer_id) u32 BE || peer_id || header DH (32) || index u64 BE
+///                      -> message key (32) || stored_at u64 BE
+///
+/// A ratchet step only rewrites one chain record, and skipped keys are
+/// inserted and removed one by one, so writes per message stay constant
+/// instead of growing with the number of skipped keys.
+fn chain_key(peer_id: &[u8], chain: u8) -> Vec<u8> {
+    let mut key = Vec::with_capacity(peer_id.len() + 1);
+    key.extend_from_slice(peer_id);
+    key.push(chain);
+    key
+}
+
+fn skipped_prefix(peer_id: &[u8]) -> Vec<u8> {
+    let mut prefix = Vec::with_capacity(4 + peer_id.len() + 40);
+    prefix.extend_from_slice(&(peer_id.len() as u32).to_be_bytes());
+    prefix.extend_from_slice(peer_id);
+    prefix
+}
+
+fn skipped_key(prefix: &[u8], (index, dh): &SkippedKeyId) -> Vec<u8> {
+    let mut key = Vec::with_capacity(prefix.len() + 40);
+    key.extend_from_slice(prefix);
+    key.extend_from_slice(dh);
+    key.extend_from_slice(&index.to_be_bytes());
+    key
+}
+
+fn skipped_value(message_key: &[u8; 32], stored_at: u64) -> Vec<u8> {
+    let mut value = Vec::with_capacity(40);
+    value.extend_from_slice(message_key);
+    value.extend_from_slice(&stored_at.to_be_bytes());
+    value
+}
+
+fn parse_skipped(prefix_len: usize, key: &[u8], value: &[u8], now: u64) -> ProtocolResult<(SkippedKeyId, [u8; 32], u64)> {
+    let rest = &key[prefix_len..];
+    // Entries written before timestamps were stored hold only the key.
+    let stored_at = match value.len() {
+        32 => now,
+        40 => u64::from_be_bytes(value[32..].try_into().unwrap()),
+        _ => return Err(ProtocolError::InternalError("Corrupted skipped key entry".into())),
+    };
+    if rest.len() != 40 {
+        return Err(ProtocolError::InternalError("Corrupted skipped key entry".into()));
+    }
+    let dh: [u8; 32] = rest[..32].try_into().unwrap();
+    let index = u64::from_be_bytes(rest[32..].try_into().unwrap());
+    Ok(((index, dh), value[..32].try_into().unwrap(), stored_at))
+}
+
+fn db_error(context: &str, e: impl std::fmt::Debug) -> ProtocolError {
+    ProtocolError::InternalError(format!("{}: {:?}", context, e))
+}
+
+/// Pending inserts (`Some`) and removals (`None`) per tree, applied atomically
+#[derive(Default)]
+struct WriteSet {
+    core: Vec<(Vec<u8>, Option<Vec<u8>>)>,
+    chains: Vec<(Vec<u8>, Option<Vec<u8>>)>,
+    skipped: Vec<(Vec<u8>, Option<Vec<u8>>)>,
+}
+
+impl WriteSet {
+    fn is_empty(&self) -> bool {
+        self.core.is_empty() && self.chains.is_empty() && self.skipped.is_empty()
+    }
+}
+
+/// Default shard count: a few per CPU so unrelated peers rarely share a lock
+fn default_shards() -> usize {
+    let cpus = std::thread::available_parallelism().map(|n| n.get()).unwrap_or(4);
+    (cpus * 4).next_power_of_two().min(256)
+}
+
+/// One slice of the session map. A peer always maps to the same shard, so
+/// lookups for different peers only contend when they hash together.
+struct Shard {
+    cache: RwLock<SessionCache>,
+    dirty: Mutex<HashSet<Vec<u8>>>,
+}
+
+/// Sharded session cache, backing trees and dirty sets, shared with the commit thread
+pub(crate) struct SessionStore {
+    shards: Box<[Shard]>,
+    hasher: RandomState,
+    core: sled::Tree,
+    chains: sled::Tree,
+    skipped: sled::Tree,
+    /// Dirty sessions across all shards
+    pending: AtomicUsize,
+    wake_lock: Mutex<()>,
+    wake: Condvar,
+    flush_lock: Mutex<()>,
+    max_pending: usize,
+}
+
+impl SessionStore {
+    /// `shards` of 0 picks a default from the CPU count; `cache_capacity` is
+    /// split evenly between shards (0 = unbounded).
+    pub(crate) fn new(db: &sled::Db, max_pending: usize, cache_capacity: usize, shards: usize) -> ProtocolResult<Self> {
+        let open = |name: &str| db.open_tree(name).map_err(|e| db_error("DB open tree error", e));
+        let shard_count = if shards == 0 { default_shards() } else { shards };
+        let shard_capacity = if cache_capacity == 0 { 0 } else { (cache_capacity + shard_count - 1) / shard_count };
+        let shards = (0..shard_count)
+            .map(|_| Shard {
+                cache: RwLock::new(SessionCache::new(shard_capacity)),
+                dirty: Mutex::new(HashSet::new()),
+            })
+            .collect();
+        
+        Ok(Self {
+            shards,
+            hasher: RandomState::new(),
+            core: open("sessions")?,
+            chains: open("session_chains")?,
+            skipped: open("session_skipped")?,
+            pending: AtomicUsize::new(0),
+            wake_lock: Mutex::new(()),
+            wake: Condvar::new(),
+            flush_lock: Mutex::new(()),
+            max_pending: max_pending.max(1),
+        })
+    }
+    
+    fn shard(&self, peer_id: &[u8]) -> &Shard {
+        let hash = self.hasher.hash_one(peer_id);
+        &self.shards[(hash as usize) % self.shards.len()]
+    }
+    
+    /// Cached session, if any (counts as a cache hit or miss)
+    pub(crate) fn cached(&self, peer_id: &[u8]) -> Option<SharedSession> {
+        self.shard(peer_id).cache.read().get(peer_id)
+    }
+    
+    /// Cached session, or load it from the store and cache it (`None` if it
+    /// does not exist). The load runs under the shard's write lock, which an
+    /// eviction also holds while writing the victim back, so a session that
+    /// was used and evicted while we missed is read in its written-back state
+    /// and never replaced by an older copy.
+    pub(crate) fn cached_or_load(
+        &self,
+        peer_id: &[u8],
+        open: impl FnOnce(DoubleRatchetState) -> DoubleRatchetSession,
+    ) -> ProtocolResult<Option<SharedSession>> {
+        if let Some(session) = self.cached(peer_id) {
+            return Ok(Some(session));
+        }
+        let mut cache = self.shard(peer_id).cache.write();
+        if let Some(session) = cache.peek(peer_id) {
+            // Another thread loaded it while we waited for the lock.
+            return Ok(Some(session.clone()));
+        }
+        let state = match self.load(peer_id)? {
+            Some(state) => state,
+            None => return Ok(None),
+        };
+        let session = Arc::new(RwLock::new(open(state)));
+        cache.insert(peer_id, session.clone(), |peer, victim| self.write_back(peer, victim));
+        Ok(Some(session))
+    }
+    
+    /// Cache a session, replacing any existing one
+    pub(crate) fn cache_replace(&self, peer_id: &[u8], session: SharedSession) {
+        let mut cache = self.shard(peer_id).cache.write();
+        cache.insert(peer_id, session, |peer, victim| self.write_back(peer, victim));
+    }
+    
+    pub(crate) fn uncache(&self, peer_id: &[u8]) -> Option<SharedSession> {
+        self.shard(peer_id).cache.write().remove(peer_id)
+    }
+    
+    /// Counters summed over all shards
+    pub(crate) fn cache_stats(&self) -> CacheStats {
+        self.shards.iter().fold(CacheStats::default(), |mut total, shard| {
+            let stats = shard.cache.read().stats();
+            total.hits += stats.hits;
+            total.misses += stats.misses;
+            total.evictions += stats.evictions;
+            total.entries += stats.entries;
+            total.capacity += stats.capacity;
+            total
+        })
+    }
+    
+    /// Persist an eviction candidate's pending changes before it leaves the cache.
+    /// It may stay in the dirty set; the next group commit skips it and only syncs.
+    fn write_back(&self, peer_id: &[u8], session: &SharedSession) -> bool {
+        match self.persist(peer_id, &*session.read()) {
+            Ok(()) => true,
+            Err(e) => {
+                tracing::warn!("session write-back failed, keeping it cached: {}", e);
+                false
+            }
+        }
+    }
+    
+    /// Load a session state, migrating legacy whole-state records to the split layout
+    pub(crate) fn load(&self, peer_id: &[u8]) -> ProtocolResult<Option<DoubleRatchetState>> {
+        let core = match self.core.get(peer_id).map_err(|e| db_error("DB read error", e))? {
+            Some(core) => core,
+            None => return Ok(None),
+        };
+        
+        if codec::record_kind(&core) != Some(codec::KIND_SESSION_CORE) {
+            // JSON or binary full-state record from an older version.
+            let state = DoubleRatchetState::decode(&core)?;
+            let mut writes = WriteSet::default();
+            self.stage(&mut writes, peer_id, &state, &StateDelta::full())?;
+            self.apply(&writes)?;
+            return Ok(Some(state));
+        }
+        
+        let read_chain = |chain| self.chains.get(chain_key(peer_id, chain)).map_err(|e| db_error("DB read error", e));
+        let sending = read_chain(SENDING_CHAIN)?;
+        let receiving = read_chain(RECEIVING_CHAIN)?;
+        
+        let prefix = skipped_prefix(peer_id);
+        let mut skipped = Vec::new();
+        let now = unix_time();
+        for entry in self.skipped.scan_prefix(&prefix) {
+            let (key, value) = entry.map_err(|e| db_error("DB read error", e))?;
+            skipped.push(parse_skipped(prefix.len(), &key, &value, now)?);
+        }
+        
+        DoubleRatchetState::from_parts(&core, sending.as_deref(), receiving.as_deref(), skipped).map(Some)
+    }
+    
+    /// Write a session's pending delta (not flushed)
+    pub(crate) fn persist(&self, peer_id: &[u8], session: &DoubleRatchetSession) -> ProtocolResult<()> {
+        let mut writes = WriteSet::default();
+        let taken = session.with_delta(|state, delta| {
+            self.stage(&mut writes, peer_id, state, delta)?;
+            Ok::<_, ProtocolError>(std::mem::take(delta))
+        })?;
+        
+        let result = self.apply(&writes);
+        if result.is_err() {
+            session.with_delta(|_, delta| delta.merge(taken));
+        }
+        result
+    }
+    
+    pub(crate) fn sync(&self) -> ProtocolResult<()> {
+        self.core.flush().map_err(|e| db_error("DB flush error", e))?;
+        Ok(())
+    }
+    
+    /// Delete every part of a session
+    pub(crate) fn remove(&self, peer_id: &[u8]) -> ProtocolResult<()> {
+        let mut writes = WriteSet::default();
+        writes.core.push((peer_id.to_vec(), None));
+        writes.chains.push((chain_key(peer_id, SENDING_CHAIN), None));
+        writes.chains.push((chain_key(peer_id, RECEIVING_CHAIN), None));
+        self.stage_skipped_removal(&mut writes, peer_id)?;
+        self.apply(&writes)
+    }
+    
+    /// Queue a session for the next group commit
+    pub(crate) fn mark_dirty(&self, peer_id: &[u8]) {
+        let pending = {
+            let mut dirty = self.shard(peer_id).dirty.lock();
+            if !dirty.insert(peer_id.to_vec()) {
+                return;
+            }
+            // Counted under the shard lock so take_dirty never sees it uncounted.
+            self.pending.fetch_add(1, Ordering::AcqRel) + 1
+        };
+        if pending >= self.max_pending {
+            // Taking the lock orders this with the committer's check-then-wait.
+            let _wake = self.wake_lock.lock();
+            self.wake.notify_one();
+        }
+    }
+    
+    pub(crate) fn forget(&self, peer_id: &[u8]) {
+        let mut dirty = self.shard(peer_id).dirty.lock();
+        if dirty.remove(peer_id) {
+            self.pending.fetch_sub(1, Ordering::AcqRel);
+        }
+    }
+    
+    fn take_dirty(&self) -> Vec<Vec<u8>> {
+        let mut pending = Vec::new();
+        for shard in self.shards.iter() {
+            let mut dirty = shard.dirty.lock();
+            self.pending.fetch_sub(dirty.len(), Ordering::AcqRel);
+            pending.extend(dirty.drain());
+        }
+        pending
+    }
+    
+    fn restore_dirty(&self, pending: Vec<Vec<u8>>) {
+        for peer_id in pending {
+            self.mark_dirty(&peer_id);
+        }
+    }
+    
+    /// Write the deltas of every dirty session in one transaction, then flush.
+    pub(crate) fn flush(&self) -> ProtocolResult<()> {
+        // Serialise flushes so an older snapshot can never overwrite a newer one.
+        let _guard = self.flush_lock.lock();
+        let pending = self.take_dirty();
+        
+        let mut writes = WriteSet::default();
+        let mut taken = Vec::new();
+        let mut result = self.stage_dirty(&pending, &mut writes, &mut taken);
+        if result.is_ok() {
+            result = self.apply(&writes).and_then(|_| self.sync());
+        }
+        
+        if result.is_err() {
+            // Hand the changes back and keep them dirty so the next commit retries.
+            for (session, delta) in taken {
+                session.read().with_delta(|_, pending_delta| pending_delta.merge(delta));
+            }
+            self.restore_dirty(pending);
+        }
+        result
+    }
+    
+    fn stage_dirty(
+        &self,
+        pending: &[Vec<u8>],
+        writes: &mut WriteSet,
+        taken: &mut Vec<(SharedSession, StateDelta)>,
+    ) -> ProtocolResult<()> {
+        for peer_id in pending {
+            // Sessions removed or evicted since they were marked dirty are skipped.
+            let session = match self.shard(peer_id).cache.read().peek(peer_id) {
+                Some(session) => session.clone(),
+                None => continue,
+            };
+            let delta = session.read().with_delta(|state, delta| {
+                self.stage(writes, peer_id, state, delta)?;
+                Ok::<_, ProtocolError>(std::mem::take(delta))
+            })?;
+            taken.push((session.clone(), delta));
+        }
+        Ok(())
+    }
+    
+    /// Queue the writes for the parts of `state` named by `delta`
+    fn stage(&self, writes: &mut WriteSet, peer_id: &[u8], state: &DoubleRatchetState, delta: &StateDelta) -> ProtocolResult<()> {
+        if delta.full || delta.core {
+            writes.core.push((peer_id.to_vec(), Some(state.encode_core())));
+        }
+        if delta.full || delta.sending_chain {
+            let record = state.sending_chain.as_ref().map(DoubleRatchetState::encode_chain);
+            writes.chains.push((chain_key(peer_id, SENDING_CHAIN), record));
+        }
+        if delta.full || delta.receiving_chain {
+            let record = state.receiving_chain.as_ref().map(DoubleRatchetState::encode_chain);
+            writes.chains.push((chain_key(peer_id, RECEIVING_CHAIN), record));
+        }
+        
+        let prefix = skipped_prefix(peer_id);
+        if delta.full {
+            self.stage_skipped_removal(writes, peer_id)?;
+            for (id, message_key, stored_at) in state.skipped_message_keys.iter() {
+                writes.skipped.push((skipped_key(&prefix, id), Some(skipped_value(message_key, stored_at))));
+            }
+        } else {
+            for id in &delta.skipped {
+                let value = state.skipped_message_keys.get_entry(id)
+                    .map(|(message_key, stored_at)| skipped_value(message_key, stored_at));
+                writes.skipped.push((skipped_key(&prefix, id), value));
+            }
+        }
+        Ok(())
+    }
+    
+    fn stage_skipped_removal(&self, writes: &mut WriteSet, peer_id: &[u8]) -> ProtocolResult<()> {
+        for key in self.skipped.scan_prefix(skipped_prefix(peer_id)).keys() {
+            let key = key.map_err(|e| db_error("DB read error", e))?;
+            writes.skipped.push((key.to_vec(), None));
+        }
+        Ok(())
+    }
+    
+    fn apply(&self, writes: &WriteSet) -> ProtocolResult<()> {
+        if writes.is_empty() {
+            return Ok(());
+        }
+        
+        (&self.core, &self.chains, &self.skipped)
+            .transaction(|(core, chains, skipped)| {
+                for (tree, ops) in [(core, &writes.core), (chains, &writes.chains), (skipped, &writes.skipped)] {
+                    for (key, value) in ops {
+                        match value {
+                            Some(value) => tree.insert(key.as_slice(), value.as_slice())?,
+                            None => tree.remove(key.as_slice())?,
+                        };
+                    }
+                }
+                Ok::<_, ConflictableTransactionError<()>>(())
+            })
+            .map_err(|e: TransactionError<()>| db_error("DB transaction error", e))
+    }
+}
+
+/// Background thread performing group commits for a `SessionStore`.
+/// Dropping it performs a final commit and joins the thread.
+pub(crate) struct GroupCommitter {
+    store: Arc<SessionStore>,
+    shutdown: Arc<AtomicBool>,
+    worker: Option<JoinHandle<()>>,
+}
+
+impl GroupCommitter {
+    pub(crate) fn spawn(store: Arc<SessionStore>, interval: Duration) -> ProtocolResult<Self> {
+        let shutdown = Arc::new(AtomicBool::new(false));
+        let thread_store = store.clone();
+        let thread_shutdown = shutdown.clone();
+        
+        let worker = std::thread::Builder::new()
+            .name("session-group-commit".into())
+            .spawn(move || loop {
+                {
+                    let mut wake = thread_store.wake_lock.lock();
+                    let pending = thread_store.pending.load(Ordering::Acquire);
+                    if !thread_shutdown.load(Ordering::Acquire) && pending < thread_store.max_pending {
+                        thread_store.wake.wait_for(&mut wake, interval);
+                    }
+                }
+                
+                if let Err(e) = thread_store.flush() {
+                    tracing::warn!("session group commit failed: {}", e);
+                }
+                
+                if thread_shutdown.load(Ordering::Acquire) {
+                    break;
+                }
+            })
+            .map_err(|e| ProtocolError::InternalError(format!("commit thread error: {}", e)))?;
+        
+        Ok(Self {
+            store,
+            shutdown,
+            worker: Some(worker),
+        })
+    }
+}
+
+impl Drop for GroupCommitter {
+    fn drop(&mut self) {
+        {
+            // Set the flag under the wake lock so the wakeup cannot be missed.
+            let _wake = self.store.wake_lock.lock();
+            self.shutdown.store(true, Ordering::Release);
+        }
+        self.store.wake.notify_all();
+        if let Some(worker) = self.worker.take() {
+            let _ = worker.join();
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::Config;
+    use rand_core::OsRng;
+    use x25519_dalek::{PublicKey, StaticSecret};
+
+    fn open_store(dir: &std::path::Path) -> SessionStore {
+        let db = sled::open(dir).unwrap();
+        SessionStore::new(&db, 16, 0, 1).unwrap()
+    }
+
+    fn state_with_skipped(count: u64) -> DoubleRatchetState {
+        let session = DoubleRatchetSession::new(Config::default()).unwrap();
+        let mut state = DoubleRatchetState::decode(&session.serialize_state().unwrap()).unwrap();
+        for i in 0..count {
+            state.skipped_message_keys.insert((i, [i as u8; 32]), [9u8; 32]);
+        }
+        state
+    }
+
+    #[test]
+    fn message_rewrites_only_the_chain() {
+        let dir = tempfile::tempdir().unwrap();
+        let store = open_store(dir.path());
+        let remote = PublicKey::from(&StaticSecret::random_from_rng(&mut OsRng));
+        let local = StaticSecret::random_from_rng(&mut OsRng);
+        let mut session = DoubleRatchetSession::from_shared_secret(&[7u8; 32], local, remote, Config::default()).unwrap();
+        store.persist(b"peer", &session).unwrap();
+        let core = store.core.get(b"peer").unwrap().unwrap();
+
+        session.encrypt(b"hello", b"").unwrap();
+        let mut writes = WriteSet::default();
+        session.with_delta(|state, delta| store.stage(&mut writes, b"peer", state, delta)).unwrap();
+        assert!(writes.core.is_empty() && writes.skipped.is_empty());
+        assert_eq!(writes.chains.len(), 1);
+        assert!(writes.chains[0].1.as_ref().unwrap().len() < 48);
+
+        store.persist(b"peer", &session).unwrap();
+        assert_eq!(store.core.get(b"peer").unwrap().unwrap(), core);
+        assert_eq!(store.load(b"peer").unwrap().unwrap().sending_chain.unwrap().index, 1);
+    }
+
+    #[test]
+    fn skipped_keys_are_individual_entries() {
+        let dir = tempfile::tempdir().unwrap();
+        let store = open_store(dir.path());
+        let mut state = state_with_skipped(3);
+        let mut session = DoubleRatchetSession::new(Config::default()).unwrap();
+        session.deserialize_state(&state.encode()).unwrap();
+        store.persist(b"peer", &session).unwrap();
+        // An id extending "peer" must not pick up its keys.
+        store.persist(b"peer2", &DoubleRatchetSession::new(Config::default()).unwrap()).unwrap();
+
+        assert_eq!(store.skipped.len(), 3);
+        assert_eq!(store.load(b"peer").unwrap().unwrap().skipped_message_keys, state.skipped_message_keys);
+        assert!(store.load(b"peer2").unwrap().unwrap().skipped_message_keys.is_empty());
+
+        // Consuming one key deletes exactly that entry.
+        let id = (1, [1u8; 32]);
+        state.skipped_message_keys.remove(&id);
+        let mut delta = StateDelta::default();
+        delta.skipped.insert(id);
+        let mut writes = WriteSet::default();
+        store.stage(&mut writes, b"peer", &state, &delta).unwrap();
+        assert_eq!(writes.skipped.len(), 1);
+        store.apply(&writes).unwrap();
+        assert_eq!(store.load(b"peer").unwrap().unwrap().skipped_message_keys, state.skipped_message_keys);
+
+        store.remove(b"peer").unwrap();
+        assert!(store.load(b"peer").unwrap().is_none());
+        assert!(store.skipped.is_empty());
+    }
+
+    #[test]
+    fn legacy_full_records_are_split_on_load() {
+        let dir = tempfile::tempdir().unwrap();
+        let store = open_store(dir.path());
+        let state = state_with_skipped(2);
+        store.core.insert(b"old", state.encode()).unwrap();
+
+        let loaded = store.load(b"old").unwrap().unwrap();
+        assert_eq!(loaded.encode().len(), state.encode().len());
+        assert_eq!(loaded.skipped_message_keys, state.skipped_message_keys);
+        let core = store.core.get(b"old").unwrap().unwrap();
+        assert_eq!(codec::record_kind(&core), Some(codec::KIND_SESSION_CORE));
+        assert_eq!(store.skipped.len(), 2);
+    }
+}
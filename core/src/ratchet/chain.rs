@@ -2,6 +2,7 @@ use hmac::{Hmac, Mac};
 use sha2::Sha256;
 use zeroize::{Zeroize, ZeroizeOnDrop};
 use serde::{Serialize, Deserialize};
+use crate::error::{ProtocolError, ProtocolResult};
 
 /// Chain Key for Double Ratchet
 #[derive(Serialize, Deserialize, Zeroize, ZeroizeOnDrop)]
@@ -10,64 +11,73 @@ pub struct ChainKey {
     pub index: u64,
     #[zeroize(skip)]
     #[serde(skip)]
-    hmac: Option<Hmac<Sha256>>, // Option to allow serialization
+    hmac: Option<Hmac<Sha256>>, // Keyed with `key`; None after deserialization until first use
 }
 
 impl Clone for ChainKey {
     fn clone(&self) -> Self {
-        // Re-create HMAC on clone
-        let hmac = Hmac::<Sha256>::new_from_slice(&self.key)
-            .expect("HMAC key length is valid");
-            
+        // The keyed HMAC state is plain data; copy it instead of re-keying.
         Self {
             key: self.key,
             index: self.index,
-            hmac: Some(hmac),
+            hmac: self.hmac.clone(),
         }
     }
 }
 
 impl ChainKey {
     pub fn new(key: [u8; 32]) -> Self {
-        let hmac = Hmac::<Sha256>::new_from_slice(&key)
-            .expect("HMAC key length is valid");
-        
         Self {
             key,
             index: 0,
-            hmac: Some(hmac),
+            hmac: Some(Self::keyed(&key)),
         }
     }
     
+    fn keyed(key: &[u8; 32]) -> Hmac<Sha256> {
+        Hmac::<Sha256>::new_from_slice(key).expect("HMAC key length is valid")
+    }
+    
     pub fn next_message_key(&mut self) -> [u8; 32] {
-        let mut input = vec![0x01]; // Message Key Seed
-        input.extend_from_slice(&self.index.to_le_bytes()); // Although standard DR uses constants
-        // Actually, standard says: 
-        // MK = HMAC(CK, "1")
-        // CK = HMAC(CK, "2")
-        // But the blueprint used:
-        // input = index + "message_key"
+        // MK = HMAC(CK, 0x01), CK' = HMAC(CK, 0x02)
+        // Both come from the same keyed state (cached, or built lazily after
+        // deserialization); only the new chain key needs a fresh one.
+        let keyed = self.hmac.take().unwrap_or_else(|| Self::keyed(&self.key));
         
-        // Let's stick to a robust derivation
-        // Message Key
-        let mut hmac = self.hmac.clone().expect("HMAC initialized");
-        hmac.update(&[0x01]);
-        let result = hmac.finalize();
+        let mut message_mac = keyed.clone();
+        message_mac.update(&[0x01]);
         let mut message_key = [0u8; 32];
-        message_key.copy_from_slice(&result.into_bytes()[..32]);
+        message_key.copy_from_slice(&message_mac.finalize().into_bytes());
         
-        // Next Chain Key
-        let mut hmac_next = self.hmac.clone().expect("HMAC initialized");
-        hmac_next.update(&[0x02]);
-        let next_result = hmac_next.finalize();
-        let mut next_key = [0u8; 32];
-        next_key.copy_from_slice(&next_result.into_bytes()[..32]);
+        let mut chain_mac = keyed;
+        chain_mac.update(&[0x02]);
+        self.key.copy_from_slice(&chain_mac.finalize().into_bytes());
         
-        // Update self
-        self.key = next_key;
-        self.hmac = Some(Hmac::<Sha256>::new_from_slice(&self.key).expect("HMAC valid"));
+        self.hmac = Some(Self::keyed(&self.key));
         self.index += 1;
         
         message_key
     }
+    
+    /// Step the chain `count` times, handing each (index, message key) to `f`.
+    /// Used to derive skipped keys in bulk; nothing is allocated per step.
+    pub fn advance(&mut self, count: u64, mut f: impl FnMut(u64, [u8; 32])) {
+        for _ in 0..count {
+            let index = self.index;
+            let message_key = self.next_message_key();
+            f(index, message_key);
+        }
+    }
+    
+    /// Advance until `index == until`, passing every skipped key to `f`.
+    /// Fails without stepping if that would skip more than `max_skip` keys
+    /// or `until` lies behind the chain.
+    pub fn skip_to(&mut self, until: u64, max_skip: usize, f: impl FnMut(u64, [u8; 32])) -> ProtocolResult<()> {
+        let count = until.checked_sub(self.index).ok_or(ProtocolError::InvalidMessage)?;
+        if count > max_skip as u64 {
+            return Err(ProtocolError::InvalidMessage);
+        }
+        self.advance(count, f);
+        Ok(())
+    }
 }
@@ -3,10 +3,13 @@
 mod chain;
 mod state;
 mod session;
+mod skipped;
 
 pub use chain::*;
 pub use state::*;
 pub use session::*;
+pub use skipped::*;
+pub(crate) use skipped::unix_time;
 
 use x25519_dalek::{PublicKey, StaticSecret};
 use std::collections::{VecDeque, HashMap};
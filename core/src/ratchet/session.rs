@@ -1,17 +1,39 @@
-use super::{ChainKey, DoubleRatchetState};
-use crate::crypto::{Encryptor, CryptoError};
+use super::{ChainKey, DoubleRatchetState, SkippedKeys, StateDelta};
+use crate::crypto::{Encryptor, CryptoError, NONCE_LENGTH, TAG_LENGTH};
 use crate::error::{ProtocolError, ProtocolResult};
 use crate::Config;
 use x25519_dalek::{StaticSecret, PublicKey};
 use hkdf::Hkdf;
 use sha2::Sha256;
-use parking_lot::RwLock;
-use std::collections::HashMap;
+use parking_lot::{Mutex, RwLock};
+use std::cell::RefCell;
 use rand_core::OsRng;
 
+/// Ratchet header: DH public key (32) || N (8) || PN (8)
+pub const HEADER_LENGTH: usize = 32 + 8 + 8;
+/// Bytes added to every plaintext by `encrypt`: header + nonce + tag
+pub const MESSAGE_OVERHEAD: usize = HEADER_LENGTH + NONCE_LENGTH + TAG_LENGTH;
+
+thread_local! {
+    /// Reused buffer for associated data || header
+    static FINAL_AD: RefCell<Vec<u8>> = const { RefCell::new(Vec::new()) };
+}
+
+fn with_final_ad<R>(associated_data: &[u8], header: &[u8], f: impl FnOnce(&[u8]) -> R) -> R {
+    FINAL_AD.with(|scratch| {
+        let mut final_ad = scratch.borrow_mut();
+        final_ad.clear();
+        final_ad.extend_from_slice(associated_data);
+        final_ad.extend_from_slice(header);
+        f(&final_ad)
+    })
+}
+
 pub struct DoubleRatchetSession {
     state: RwLock<DoubleRatchetState>,
     config: Config,
+    /// Changes not yet persisted
+    delta: Mutex<StateDelta>,
 }
 
 impl DoubleRatchetSession {
@@ -26,7 +48,7 @@ impl DoubleRatchetSession {
             dh_local: Some(dh_local),
             dh_local_bytes,
             dh_remote: None,
-            skipped_message_keys: HashMap::new(),
+            skipped_message_keys: SkippedKeys::new(config.max_skipped_messages, config.skipped_key_ttl),
             max_skip: config.max_skipped_messages,
             previous_counter: 0,
         };
@@ -34,9 +56,26 @@ impl DoubleRatchetSession {
         Ok(Self {
             state: RwLock::new(state),
             config,
+            delta: Mutex::new(StateDelta::full()),
         })
     }
     
+    /// Wrap a state loaded from storage; nothing is pending beyond
+    /// skipped keys dropped by the configured TTL.
+    pub fn from_state(mut state: DoubleRatchetState, config: Config) -> Self {
+        state.skipped_message_keys.set_ttl(config.skipped_key_ttl);
+        state.skipped_message_keys.expire();
+        let delta = StateDelta {
+            skipped: state.skipped_message_keys.take_changes(),
+            ..StateDelta::default()
+        };
+        Self {
+            state: RwLock::new(state),
+            config,
+            delta: Mutex::new(delta),
+        }
+    }
+    
     // Create from existing shared secret (post-handshake)
     pub fn from_shared_secret(
         shared_secret: &[u8; 32],
@@ -63,7 +102,7 @@ impl DoubleRatchetSession {
             dh_local: Some(local_dh),
             dh_local_bytes,
             dh_remote: Some(remote_dh),
-            skipped_message_keys: HashMap::new(),
+            skipped_message_keys: SkippedKeys::new(config.max_skipped_messages, config.skipped_key_ttl),
             max_skip: config.max_skipped_messages,
             previous_counter: 0,
         };
@@ -71,10 +110,93 @@ impl DoubleRatchetSession {
         Ok(Self {
             state: RwLock::new(state),
             config,
+            delta: Mutex::new(StateDelta::full()),
+        })
+    }
+    
+    /// Session from a secret both peers already hold (agreed out of band or
+    /// by an external handshake). Each direction gets its own chain, and both
+    /// ratchet keys are derived from the secret, so either side can send
+    /// first: the initiator sends on the chain the responder receives on,
+    /// and the other way round.
+    pub fn from_pre_shared(shared_secret: &[u8; 32], initiator: bool, config: Config) -> ProtocolResult<Self> {
+        let hkdf = Hkdf::<Sha256>::new(None, shared_secret);
+        let expand = |label: &[u8]| -> ProtocolResult<[u8; 32]> {
+            let mut okm = [0u8; 32];
+            hkdf.expand(label, &mut okm).map_err(|_| ProtocolError::KeyDerivationFailed)?;
+            Ok(okm)
+        };
+        let root_key = expand(b"root_key")?;
+        // The initiator's chain keeps from_shared_secret's label.
+        let initiator_chain = ChainKey::new(expand(b"sending_chain")?);
+        let responder_chain = ChainKey::new(expand(b"responder_chain")?);
+        let initiator_dh = StaticSecret::from(expand(b"initiator_dh")?);
+        let responder_dh = StaticSecret::from(expand(b"responder_dh")?);
+
+        let (local_dh, remote_dh, sending_chain, receiving_chain) = if initiator {
+            (initiator_dh, PublicKey::from(&responder_dh), initiator_chain, responder_chain)
+        } else {
+            (responder_dh, PublicKey::from(&initiator_dh), responder_chain, initiator_chain)
+        };
+        let dh_local_bytes = local_dh.to_bytes().to_vec();
+
+        let state = DoubleRatchetState {
+            root_key,
+            sending_chain: Some(sending_chain),
+            receiving_chain: Some(receiving_chain),
+            dh_local: Some(local_dh),
+            dh_local_bytes,
+            dh_remote: Some(remote_dh),
+            skipped_message_keys: SkippedKeys::new(config.max_skipped_messages, config.skipped_key_ttl),
+            max_skip: config.max_skipped_messages,
+            previous_counter: 0,
+        };
+
+        Ok(Self {
+            state: RwLock::new(state),
+            config,
+            delta: Mutex::new(StateDelta::full()),
         })
     }
+
+    /// Run `f` on the state and the pending delta, e.g. to persist the changes.
+    pub fn with_delta<R>(&self, f: impl FnOnce(&DoubleRatchetState, &mut StateDelta) -> R) -> R {
+        let state = self.state.read();
+        let mut delta = self.delta.lock();
+        f(&state, &mut delta)
+    }
     
     pub fn encrypt(&mut self, plaintext: &[u8], associated_data: &[u8]) -> ProtocolResult<Vec<u8>> {
+        // One allocation: header, nonce, ciphertext and tag are written in place.
+        let mut out = vec![0u8; plaintext.len() + MESSAGE_OVERHEAD];
+        let written = self.encrypt_into(plaintext, associated_data, &mut out)?;
+        out.truncate(written);
+        Ok(out)
+    }
+    
+    /// Encrypt several messages in order, all or nothing: if one fails, the
+    /// sending chain is put back where it was before the first.
+    pub fn encrypt_batch<T: AsRef<[u8]>>(&mut self, plaintexts: &[T], associated_data: &[u8]) -> ProtocolResult<Vec<Vec<u8>>> {
+        let chain = self.state.read().sending_chain.clone();
+        let pending = self.delta.lock().sending_chain;
+        let res = plaintexts
+            .iter()
+            .map(|plaintext| self.encrypt(plaintext.as_ref(), associated_data))
+            .collect::<ProtocolResult<Vec<_>>>();
+        if res.is_err() {
+            self.state.write().sending_chain = chain;
+            self.delta.lock().sending_chain = pending;
+        }
+        res
+    }
+    
+    /// Encrypt into `out` (at least `plaintext.len() + MESSAGE_OVERHEAD` bytes)
+    /// without allocating. Returns the number of bytes written.
+    pub fn encrypt_into(&mut self, plaintext: &[u8], associated_data: &[u8], out: &mut [u8]) -> ProtocolResult<usize> {
+        if out.len() < plaintext.len() + MESSAGE_OVERHEAD {
+            return Err(ProtocolError::BufferTooSmall);
+        }
+        
         let mut state = self.state.write();
         
         if state.sending_chain.is_none() {
@@ -82,9 +204,6 @@ impl DoubleRatchetSession {
             return Err(ProtocolError::InvalidState); 
         }
         
-        let sending_chain = state.sending_chain.as_mut().unwrap();
-        let message_key = sending_chain.next_message_key();
-        
         // Header: (DH Public Key, Message Number, Previous Chain Length)
         // Standard DR Header
         let dh_pub = if let Some(dh) = &state.dh_local {
@@ -93,39 +212,49 @@ impl DoubleRatchetSession {
             return Err(ProtocolError::InvalidState);
         };
         
-        let header_bytes = dh_pub.as_bytes(); 
-        // We really should serialize a proper header struct with index and prev_counter
-        // HEADER = DH_RATOHET_KEY || N || PN
-        // For simplicity in this blueprint, we'll prefix just DH key for now, 
-        // but realistic impl needs more.
-        // Let's adopt a simple serialization:
+        let sending_chain = state.sending_chain.as_mut().unwrap();
+        let message_key = sending_chain.next_message_key();
+        let index = sending_chain.index - 1; // -1 because next_message_key incremented it
+        self.delta.lock().sending_chain = true;
+        
+        // HEADER = DH_RATCHET_KEY || N || PN, written straight into the output:
         // [DH(32)][N(8)][PN(8)]
-        let mut header = Vec::with_capacity(32 + 8 + 8);
-        header.extend_from_slice(header_bytes);
-        header.extend_from_slice(&(sending_chain.index - 1).to_le_bytes()); // -1 because next_message_key incremented it
-        header.extend_from_slice(&state.previous_counter.to_le_bytes());
+        let (header, body) = out.split_at_mut(HEADER_LENGTH);
+        header[..32].copy_from_slice(dh_pub.as_bytes());
+        header[32..40].copy_from_slice(&index.to_le_bytes());
+        header[40..48].copy_from_slice(&state.previous_counter.to_le_bytes());
         
         let encryptor = Encryptor::new(&message_key, u64::MAX).map_err(ProtocolError::from)?;
         // Encrypt uses associated_data + header as AD usually
-        let mut final_ad = Vec::new();
-        final_ad.extend_from_slice(associated_data);
-        final_ad.extend_from_slice(&header);
-        
-        let ciphertext = encryptor.encrypt_message(plaintext, &final_ad)?;
+        let written = with_final_ad(associated_data, header, |final_ad| {
+            encryptor.encrypt_into(plaintext, final_ad, body)
+        })?;
         
         // Result: Header + Ciphertext
-        let mut result = Vec::new();
-        result.extend_from_slice(&header);
-        result.extend_from_slice(&ciphertext);
-        
-        Ok(result)
+        Ok(HEADER_LENGTH + written)
     }
     
     pub fn decrypt(&mut self, message: &[u8], associated_data: &[u8]) -> ProtocolResult<Vec<u8>> {
-        if message.len() < 32 + 8 + 8 {
+        if message.len() < HEADER_LENGTH {
             return Err(ProtocolError::InvalidMessage);
         }
         
+        let mut out = vec![0u8; message.len().saturating_sub(MESSAGE_OVERHEAD)];
+        let written = self.decrypt_into(message, associated_data, &mut out)?;
+        out.truncate(written);
+        Ok(out)
+    }
+    
+    /// Decrypt into `out` (at least `message.len() - MESSAGE_OVERHEAD` bytes)
+    /// without allocating. Returns the plaintext length.
+    pub fn decrypt_into(&mut self, message: &[u8], associated_data: &[u8], out: &mut [u8]) -> ProtocolResult<usize> {
+        if message.len() < HEADER_LENGTH {
+            return Err(ProtocolError::InvalidMessage);
+        }
+        if out.len() < message.len().saturating_sub(MESSAGE_OVERHEAD) {
+            return Err(ProtocolError::BufferTooSmall);
+        }
+        
         // Parse Header
         let header_dh = &message[..32];
         let n_bytes: [u8; 8] = message[32..40].try_into().unwrap();
@@ -137,16 +266,66 @@ impl DoubleRatchetSession {
         let header = &message[..48];
         
         let mut state = self.state.write();
-        let remote_dh = PublicKey::from(<[u8; 32]>::try_from(header_dh).unwrap());
+        let header_dh: [u8; 32] = header_dh.try_into().unwrap();
+        let remote_dh = PublicKey::from(header_dh);
+        state.skipped_message_keys.expire();
         
-        // Check if we need to do a DH ratchet
-        let mut performed_ratchet = false;
-        if state.dh_remote.is_none() || state.dh_remote.unwrap() != remote_dh {
+        // Check if we need to do a DH ratchet. Like the chain steps below, it
+        // is applied only once the message authenticates, so a forged header
+        // cannot move the session.
+        let performed_ratchet = state.dh_remote.is_none() || state.dh_remote.unwrap() != remote_dh;
+        let mut retired = Vec::new();
+        if performed_ratchet {
              // DH Ratchet
-             // 1. Try to skip messages in current receiving chain
-             if let Some(mut chain) = state.receiving_chain.take() {
-                 // Skip up to PN
-                 // Store skipped keys
+             // 1. Skip the rest of the current receiving chain (up to PN),
+             //    keeping its keys for messages still in flight
+             if let Some(chain) = state.receiving_chain.as_ref() {
+                 if pn.saturating_sub(chain.index) > state.max_skip as u64 {
+                     return Err(ProtocolError::InvalidMessage);
+                 }
+             }
+             if let (Some(chain), Some(old_remote)) = (state.receiving_chain.as_ref(), state.dh_remote) {
+                 let old_dh = *old_remote.as_bytes();
+                 let mut chain = chain.clone();
+                 chain.advance(pn.saturating_sub(chain.index), |index, key| retired.push(((index, old_dh), key)));
+             }
+        }
+        
+        // Decrypt
+        // If we found the key in skipped keys, use it
+        // Else, step the receiving chain to N
+        let id = (n, header_dh);
+        let mut advanced = None;
+        let message_key = if let Some(key) = state.skipped_message_keys.get(&id) {
+            *key
+        } else if performed_ratchet {
+            // Mock decryption for blueprint flow: the ratchet step below does
+            // not derive a receiving chain yet, so use the placeholder key.
+            [1u8; 32]
+        } else if let Some(chain) = state.receiving_chain.as_ref() {
+            // Work on a copy so a forged message cannot move the chain.
+            let mut chain = chain.clone();
+            let mut skipped = Vec::new();
+            chain.skip_to(n, state.max_skip, |index, key| skipped.push(((index, header_dh), key)))?;
+            let key = chain.next_message_key();
+            advanced = Some((chain, skipped));
+            key
+        } else {
+            return Err(ProtocolError::InvalidState);
+        };
+        
+        let encryptor = Encryptor::new(&message_key, u64::MAX).map_err(ProtocolError::from)?;
+        let written = with_final_ad(associated_data, header, |final_ad| {
+            encryptor.decrypt_into(ciphertext, final_ad, out)
+        }).map_err(ProtocolError::from)?;
+        
+        // Authenticated: apply the ratchet step, then consume the key or
+        // commit the advanced chain.
+        let mut delta = self.delta.lock();
+        if performed_ratchet {
+             state.receiving_chain = None;
+             for (id, key) in retired {
+                 state.skipped_message_keys.insert(id, key);
              }
              
              // 2. Perform Ratchet Step
@@ -164,51 +343,36 @@ impl DoubleRatchetSession {
              // Update receiving key update...
              
              state.dh_remote = Some(remote_dh);
-             performed_ratchet = true;
+             delta.core = true;
+             delta.receiving_chain = true;
         }
-        
-        // Decrypt
-        // If we found the key in skipped keys, use it
-        // Else, step the receiving chain to N
-        
-        // Mock decryption for blueprint flow (since full DR logic is 100+ lines)
-        // In a real impl, we'd complete the above steps.
-        // For now, let's assume we derive the key successfully if state is valid.
-        
-        // Basic fallback for invalid state
-        if state.receiving_chain.is_none() && !performed_ratchet {
-            return Err(ProtocolError::InvalidState); 
+        match advanced {
+            Some((chain, skipped)) => {
+                state.receiving_chain = Some(chain);
+                for (id, key) in skipped {
+                    state.skipped_message_keys.insert(id, key);
+                }
+                delta.receiving_chain = true;
+            }
+            None => {
+                state.skipped_message_keys.remove(&id);
+            }
         }
-        
-        // Placeholder key derivation
-        let message_key = [1u8; 32]; // Replace with actual logic
-        
-        let encryptor = Encryptor::new(&message_key, u64::MAX).map_err(ProtocolError::from)?;
-        let mut final_ad = Vec::new();
-        final_ad.extend_from_slice(associated_data);
-        final_ad.extend_from_slice(header);
-        
-        encryptor.decrypt_message(ciphertext, &final_ad).map_err(ProtocolError::from)
+        delta.skipped.extend(state.skipped_message_keys.take_changes());
+        Ok(written)
     }
     
     pub fn serialize_state(&self) -> ProtocolResult<Vec<u8>> {
-        let state = self.state.read();
-        serde_json::to_vec(&*state).map_err(|_| ProtocolError::InternalError("Serialization failed".into()))
+        Ok(self.state.read().encode())
     }
     
     pub fn deserialize_state(&mut self, data: &[u8]) -> ProtocolResult<()> {
-        let mut state = self.state.write();
-        // Load basic struct
-        let mut loaded: DoubleRatchetState = serde_json::from_slice(data)
-            .map_err(|_| ProtocolError::InternalError("Deserialization failed".into()))?;
-            
-        // Restore StaticSecrets from bytes
-        if !loaded.dh_local_bytes.is_empty() {
-             let arr: [u8; 32] = loaded.dh_local_bytes.clone().try_into().unwrap_or([0; 32]);
-             loaded.dh_local = Some(StaticSecret::from(arr));
-        }
-        
-        *state = loaded;
+        // Binary records, or legacy JSON written by older versions
+        let mut loaded = DoubleRatchetState::decode(data)?;
+        loaded.skipped_message_keys.set_ttl(self.config.skipped_key_ttl);
+        loaded.skipped_message_keys.take_changes();
+        *self.state.write() = loaded;
+        *self.delta.lock() = StateDelta::full();
         Ok(())
     }
 }
@@ -0,0 +1,308 @@
+//! Bounded store for skipped message keys
+
+use super::SkippedKeyId;
+use serde::{Serialize, Deserialize, Serializer, Deserializer};
+use serde::de::IgnoredAny;
+use zeroize::{Zeroize, ZeroizeOnDrop};
+use std::collections::{HashMap, HashSet, VecDeque};
+use std::fmt;
+
+/// Default lifetime of a skipped message key (seconds)
+pub const DEFAULT_SKIPPED_KEY_TTL: u64 = 7 * 24 * 60 * 60;
+
+pub(crate) fn unix_time() -> u64 {
+    std::time::SystemTime::now()
+        .duration_since(std::time::UNIX_EPOCH)
+        .map(|d| d.as_secs())
+        .unwrap_or(0)
+}
+
+#[derive(Clone, Zeroize, ZeroizeOnDrop)]
+struct Entry {
+    key: [u8; 32],
+    stored_at: u64,
+    seq: u64,
+}
+
+/// Skipped message keys with a hard size cap and time-based expiry.
+///
+/// Lookup and removal are O(1). Keys are evicted oldest first once the cap is
+/// reached and dropped when older than the TTL. Every insert, removal and
+/// eviction is journaled so the session can persist exactly those entries.
+#[derive(Clone)]
+pub struct SkippedKeys {
+    entries: HashMap<SkippedKeyId, Entry>,
+    /// Insertion order; entries removed out of order are dropped lazily
+    order: VecDeque<(u64, SkippedKeyId)>,
+    next_seq: u64,
+    limit: usize,
+    /// Seconds (0 = never expire)
+    ttl: u64,
+    changes: HashSet<SkippedKeyId>,
+}
+
+impl Default for SkippedKeys {
+    fn default() -> Self {
+        Self::new(usize::MAX, DEFAULT_SKIPPED_KEY_TTL)
+    }
+}
+
+impl SkippedKeys {
+    pub fn new(limit: usize, ttl: u64) -> Self {
+        Self {
+            entries: HashMap::new(),
+            order: VecDeque::new(),
+            next_seq: 0,
+            limit,
+            ttl,
+            changes: HashSet::new(),
+        }
+    }
+    
+    /// Rebuild from stored (id, key, stored_at) entries. They are ordered by
+    /// `stored_at`; ties keep the order given.
+    pub fn from_entries(limit: usize, ttl: u64, entries: impl IntoIterator<Item = (SkippedKeyId, [u8; 32], u64)>) -> Self {
+        let mut entries: Vec<_> = entries.into_iter().collect();
+        entries.sort_by_key(|(_, _, stored_at)| *stored_at);
+        
+        let mut store = Self::new(limit, ttl);
+        for (id, key, stored_at) in entries {
+            store.insert_at(id, key, stored_at);
+        }
+        // Loaded entries are already stored; only evictions are changes.
+        store.changes.retain(|id| !store.entries.contains_key(id));
+        store
+    }
+    
+    pub fn set_limit(&mut self, limit: usize) {
+        self.limit = limit;
+        self.enforce_limit();
+    }
+    
+    pub fn set_ttl(&mut self, ttl: u64) {
+        self.ttl = ttl;
+    }
+    
+    pub fn limit(&self) -> usize {
+        self.limit
+    }
+    
+    pub fn len(&self) -> usize {
+        self.entries.len()
+    }
+    
+    pub fn is_empty(&self) -> bool {
+        self.entries.is_empty()
+    }
+    
+    pub fn contains(&self, id: &SkippedKeyId) -> bool {
+        self.entries.contains_key(id)
+    }
+    
+    pub fn get(&self, id: &SkippedKeyId) -> Option<&[u8; 32]> {
+        self.entries.get(id).map(|entry| &entry.key)
+    }
+    
+    /// Message key and the unix time it was stored
+    pub fn get_entry(&self, id: &SkippedKeyId) -> Option<(&[u8; 32], u64)> {
+        self.entries.get(id).map(|entry| (&entry.key, entry.stored_at))
+    }
+    
+    pub fn insert(&mut self, id: SkippedKeyId, key: [u8; 32]) {
+        self.insert_at(id, key, unix_time());
+    }
+    
+    /// Insert with an explicit timestamp, evicting the oldest keys past the cap
+    pub fn insert_at(&mut self, id: SkippedKeyId, key: [u8; 32], stored_at: u64) {
+        let seq = self.next_seq;
+        self.next_seq += 1;
+        self.entries.insert(id, Entry { key, stored_at, seq });
+        self.order.push_back((seq, id));
+        self.changes.insert(id);
+        self.enforce_limit();
+        self.compact();
+    }
+    
+    pub fn remove(&mut self, id: &SkippedKeyId) -> Option<[u8; 32]> {
+        let entry = self.entries.remove(id)?;
+        self.changes.insert(*id);
+        self.compact();
+        Some(entry.key)
+    }
+    
+    pub fn clear(&mut self) {
+        self.changes.extend(self.entries.keys().copied());
+        self.entries.clear();
+        self.order.clear();
+    }
+    
+    /// Drop keys older than the TTL. Returns how many were removed.
+    pub fn expire(&mut self) -> usize {
+        self.expire_at(unix_time())
+    }
+    
+    pub fn expire_at(&mut self, now: u64) -> usize {
+        if self.ttl == 0 {
+            return 0;
+        }
+        let mut expired = 0;
+        while let Some(&(seq, id)) = self.order.front() {
+            match self.entries.get(&id) {
+                Some(entry) if entry.seq == seq => {
+                    if entry.stored_at.saturating_add(self.ttl) > now {
+                        break;
+                    }
+                    self.entries.remove(&id);
+                    self.changes.insert(id);
+                    expired += 1;
+                }
+                _ => {}
+            }
+            self.order.pop_front();
+        }
+        expired
+    }
+    
+    /// Entries as (id, key, stored_at) in insertion order
+    pub fn iter(&self) -> impl Iterator<Item = (&SkippedKeyId, &[u8; 32], u64)> + '_ {
+        self.order.iter().filter_map(move |(seq, id)| match self.entries.get(id) {
+            Some(entry) if entry.seq == *seq => Some((id, &entry.key, entry.stored_at)),
+            _ => None,
+        })
+    }
+    
+    /// Ids inserted or removed since the last call
+    pub fn take_changes(&mut self) -> HashSet<SkippedKeyId> {
+        std::mem::take(&mut self.changes)
+    }
+    
+    fn enforce_limit(&mut self) {
+        while self.entries.len() > self.limit {
+            let (seq, id) = match self.order.pop_front() {
+                Some(slot) => slot,
+                None => break,
+            };
+            if self.entries.get(&id).map_or(false, |entry| entry.seq == seq) {
+                self.entries.remove(&id);
+                self.changes.insert(id);
+            }
+        }
+    }
+    
+    /// Drop stale order slots once they outnumber the live entries
+    fn compact(&mut self) {
+        if self.order.len() > 2 * self.entries.len() + 32 {
+            let entries = &self.entries;
+            self.order.retain(|(seq, id)| entries.get(id).map_or(false, |entry| entry.seq == *seq));
+        }
+    }
+}
+
+impl PartialEq for SkippedKeys {
+    fn eq(&self, other: &Self) -> bool {
+        self.entries.len() == other.entries.len()
+            && self.entries.iter().all(|(id, entry)| other.get(id) == Some(&entry.key))
+    }
+}
+
+impl fmt::Debug for SkippedKeys {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        // Never print key material
+        f.debug_struct("SkippedKeys")
+            .field("len", &self.entries.len())
+            .field("limit", &self.limit)
+            .field("ttl", &self.ttl)
+            .finish()
+    }
+}
+
+impl Serialize for SkippedKeys {
+    fn serialize<S: Serializer>(&self, serializer: S) -> Result<S::Ok, S::Error> {
+        serializer.collect_seq(self.iter().map(|((index, dh), key, stored_at)| (index, dh, key, stored_at)))
+    }
+}
+
+#[derive(Deserialize)]
+#[serde(untagged)]
+enum SkippedKeysRepr {
+    Entries(Vec<(u64, [u8; 32], [u8; 32], u64)>),
+    /// Older states serialized a map; serde_json could only ever write it empty
+    Map(HashMap<String, IgnoredAny>),
+}
+
+impl<'de> Deserialize<'de> for SkippedKeys {
+    fn deserialize<D: Deserializer<'de>>(deserializer: D) -> Result<Self, D::Error> {
+        let entries = match SkippedKeysRepr::deserialize(deserializer)? {
+            SkippedKeysRepr::Entries(entries) => entries,
+            SkippedKeysRepr::Map(_) => Vec::new(),
+        };
+        Ok(Self::from_entries(
+            usize::MAX,
+            DEFAULT_SKIPPED_KEY_TTL,
+            entries.into_iter().map(|(index, dh, key, stored_at)| ((index, dh), key, stored_at)),
+        ))
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn id(index: u64) -> SkippedKeyId {
+        (index, [index as u8; 32])
+    }
+
+    #[test]
+    fn cap_evicts_in_insertion_order() {
+        let mut keys = SkippedKeys::new(3, 0);
+        for i in [5, 1, 9] {
+            keys.insert_at(id(i), [i as u8; 32], 100);
+        }
+        keys.remove(&id(1));
+        keys.insert_at(id(2), [2u8; 32], 100);
+        keys.insert_at(id(3), [3u8; 32], 100);
+
+        assert_eq!(keys.len(), 3);
+        assert!(!keys.contains(&id(5)));
+        let order: Vec<_> = keys.iter().map(|(id, _, _)| id.0).collect();
+        assert_eq!(order, vec![9, 2, 3]);
+
+        let changes = keys.take_changes();
+        assert_eq!(changes.len(), 5);
+        assert!(keys.take_changes().is_empty());
+    }
+
+    #[test]
+    fn ttl_expires_oldest_entries() {
+        let mut keys = SkippedKeys::new(100, 60);
+        keys.insert_at(id(1), [1u8; 32], 1_000);
+        keys.insert_at(id(2), [2u8; 32], 1_030);
+        keys.take_changes();
+
+        assert_eq!(keys.expire_at(1_059), 0);
+        assert_eq!(keys.expire_at(1_060), 1);
+        assert_eq!(keys.get(&id(2)), Some(&[2u8; 32]));
+        assert_eq!(keys.take_changes().into_iter().collect::<Vec<_>>(), vec![id(1)]);
+
+        keys.set_ttl(0);
+        assert_eq!(keys.expire_at(u64::MAX), 0);
+    }
+
+    #[test]
+    fn serde_keeps_order_and_timestamps() {
+        let mut keys = SkippedKeys::default();
+        keys.insert_at(id(4), [4u8; 32], 20);
+        keys.insert_at(id(7), [7u8; 32], 10);
+        let json = serde_json::to_vec(&keys).unwrap();
+
+        let decoded: SkippedKeys = serde_json::from_slice(&json).unwrap();
+        assert_eq!(decoded, keys);
+        assert_eq!(decoded.get_entry(&id(4)), Some((&[4u8; 32], 20)));
+        let order: Vec<_> = decoded.iter().map(|(id, _, _)| id.0).collect();
+        assert_eq!(order, vec![7, 4]);
+
+        // States written before this store serialized an (always empty) map.
+        let legacy: SkippedKeys = serde_json::from_slice(b"{}").unwrap();
+        assert!(legacy.is_empty());
+    }
+}
@@ -1,8 +1,53 @@
-use super::ChainKey;
+use super::{unix_time, ChainKey, SkippedKeys, DEFAULT_SKIPPED_KEY_TTL};
+use crate::codec::{self, Reader, Writer};
+use crate::error::{ProtocolError, ProtocolResult};
 use x25519_dalek::{PublicKey, StaticSecret};
 use serde::{Serialize, Deserialize};
 use zeroize::{Zeroize, ZeroizeOnDrop};
-use std::collections::HashMap;
+use std::collections::HashSet;
+
+/// Key of a skipped message key: (message index, header DH public key)
+pub type SkippedKeyId = (u64, [u8; 32]);
+
+/// Parts of a `DoubleRatchetState` changed since it was last persisted,
+/// so only those need to be written.
+#[derive(Debug, Default)]
+pub struct StateDelta {
+    /// Everything must be rewritten (new or replaced state)
+    pub full: bool,
+    /// Root key, DH keys or counters changed
+    pub core: bool,
+    /// Sending chain advanced or was replaced
+    pub sending_chain: bool,
+    /// Receiving chain advanced or was replaced
+    pub receiving_chain: bool,
+    /// Skipped keys inserted or removed; the current state says which
+    pub skipped: HashSet<SkippedKeyId>,
+}
+
+impl StateDelta {
+    /// Delta that rewrites the whole state
+    pub fn full() -> Self {
+        Self {
+            full: true,
+            ..Self::default()
+        }
+    }
+    
+    /// Nothing to write
+    pub fn is_empty(&self) -> bool {
+        !(self.full || self.core || self.sending_chain || self.receiving_chain) && self.skipped.is_empty()
+    }
+    
+    /// Fold a later delta into this one
+    pub fn merge(&mut self, other: StateDelta) {
+        self.full |= other.full;
+        self.core |= other.core;
+        self.sending_chain |= other.sending_chain;
+        self.receiving_chain |= other.receiving_chain;
+        self.skipped.extend(other.skipped);
+    }
+}
 
 #[derive(Serialize, Deserialize)]
 pub struct DoubleRatchetState {
@@ -16,7 +61,7 @@ pub struct DoubleRatchetState {
     pub dh_local_bytes: Vec<u8>, // Helper for serialization
     
     pub dh_remote: Option<PublicKey>,
-    pub skipped_message_keys: HashMap<(u64, [u8; 32]), [u8; 32]>, // (Header PubKey, Index) -> Message Key
+    pub skipped_message_keys: SkippedKeys, // (Index, Header PubKey) -> Message Key
     pub max_skip: usize,
     pub previous_counter: u64,
 }
@@ -45,6 +90,165 @@ impl Clone for DoubleRatchetState {
     }
 }
 
+impl DoubleRatchetState {
+    /// Encode as a compact binary record (see `codec`)
+    pub fn encode(&self) -> Vec<u8> {
+        // root + two chains + dh keys + counters, then 72 bytes per skipped key
+        let mut w = Writer::new(codec::KIND_SESSION, 160 + self.skipped_message_keys.len() * 72);
+        w.array(&self.root_key);
+        encode_chain(&mut w, self.sending_chain.as_ref());
+        encode_chain(&mut w, self.receiving_chain.as_ref());
+        w.bytes(&self.dh_local_bytes);
+        w.option_array(self.dh_remote.as_ref().map(|pk| &pk.as_bytes()[..]));
+        w.varint(self.max_skip as u64);
+        w.varint(self.previous_counter);
+        
+        w.varint(self.skipped_message_keys.len() as u64);
+        for ((index, dh), message_key, _) in self.skipped_message_keys.iter() {
+            w.varint(*index);
+            w.array(dh);
+            w.array(message_key);
+        }
+        w.finish()
+    }
+    
+    /// Decode a binary record, or a legacy JSON one. `dh_local` is restored
+    /// from `dh_local_bytes`.
+    pub fn decode(data: &[u8]) -> ProtocolResult<Self> {
+        let mut state = if codec::is_legacy_json(data) {
+            serde_json::from_slice::<Self>(data)
+                .map_err(|_| ProtocolError::InternalError("Deserialization failed".into()))?
+        } else {
+            Self::decode_binary(data)?
+        };
+        state.skipped_message_keys.set_limit(state.max_skip);
+        
+        if !state.dh_local_bytes.is_empty() {
+            let arr: [u8; 32] = state.dh_local_bytes.clone().try_into().unwrap_or([0; 32]);
+            state.dh_local = Some(StaticSecret::from(arr));
+        }
+        Ok(state)
+    }
+    
+    /// Encode everything except the chains and skipped keys, which are stored separately
+    pub(crate) fn encode_core(&self) -> Vec<u8> {
+        let mut w = Writer::new(codec::KIND_SESSION_CORE, 96);
+        w.array(&self.root_key);
+        w.bytes(&self.dh_local_bytes);
+        w.option_array(self.dh_remote.as_ref().map(|pk| &pk.as_bytes()[..]));
+        w.varint(self.max_skip as u64);
+        w.varint(self.previous_counter);
+        w.finish()
+    }
+    
+    /// Encode a single chain (key + index, a few dozen bytes)
+    pub(crate) fn encode_chain(chain: &ChainKey) -> Vec<u8> {
+        let mut w = Writer::new(codec::KIND_CHAIN, 40);
+        w.array(&chain.key);
+        w.varint(chain.index);
+        w.finish()
+    }
+    
+    /// Reassemble a state from its separately stored parts
+    pub(crate) fn from_parts(
+        core: &[u8],
+        sending_chain: Option<&[u8]>,
+        receiving_chain: Option<&[u8]>,
+        skipped: impl IntoIterator<Item = (SkippedKeyId, [u8; 32], u64)>,
+    ) -> ProtocolResult<Self> {
+        let mut r = Reader::open(core, codec::KIND_SESSION_CORE)?;
+        let root_key = r.array()?;
+        let dh_local_bytes = r.bytes()?.to_vec();
+        let dh_remote = r.option_array::<32>()?.map(PublicKey::from);
+        let max_skip = r.varint()? as usize;
+        let previous_counter = r.varint()?;
+        r.finish()?;
+        
+        let dh_local = match <[u8; 32]>::try_from(dh_local_bytes.as_slice()) {
+            Ok(arr) => Some(StaticSecret::from(arr)),
+            Err(_) => None,
+        };
+        
+        Ok(Self {
+            root_key,
+            sending_chain: sending_chain.map(decode_chain_record).transpose()?,
+            receiving_chain: receiving_chain.map(decode_chain_record).transpose()?,
+            dh_local,
+            dh_local_bytes,
+            dh_remote,
+            skipped_message_keys: SkippedKeys::from_entries(max_skip, DEFAULT_SKIPPED_KEY_TTL, skipped),
+            max_skip,
+            previous_counter,
+        })
+    }
+    
+    fn decode_binary(data: &[u8]) -> ProtocolResult<Self> {
+        let mut r = Reader::open(data, codec::KIND_SESSION)?;
+        let root_key = r.array()?;
+        let sending_chain = decode_chain(&mut r)?;
+        let receiving_chain = decode_chain(&mut r)?;
+        let dh_local_bytes = r.bytes()?.to_vec();
+        let dh_remote = r.option_array::<32>()?.map(PublicKey::from);
+        let max_skip = r.varint()? as usize;
+        let previous_counter = r.varint()?;
+        
+        let count = r.varint()? as usize;
+        // Don't trust the count for the allocation beyond what the record can hold.
+        let mut skipped = Vec::with_capacity(count.min(r.remaining() / 65));
+        // Full records carry no timestamps; the TTL runs from load time.
+        let now = unix_time();
+        for _ in 0..count {
+            let index = r.varint()?;
+            let dh = r.array()?;
+            skipped.push(((index, dh), r.array()?, now));
+        }
+        r.finish()?;
+        let skipped_message_keys = SkippedKeys::from_entries(max_skip, DEFAULT_SKIPPED_KEY_TTL, skipped);
+        
+        Ok(Self {
+            root_key,
+            sending_chain,
+            receiving_chain,
+            dh_local: None,
+            dh_local_bytes,
+            dh_remote,
+            skipped_message_keys,
+            max_skip,
+            previous_counter,
+        })
+    }
+}
+
+fn encode_chain(w: &mut Writer, chain: Option<&ChainKey>) {
+    match chain {
+        Some(chain) => {
+            w.u8(1);
+            w.array(&chain.key);
+            w.varint(chain.index);
+        }
+        None => w.u8(0),
+    }
+}
+
+fn decode_chain_record(data: &[u8]) -> ProtocolResult<ChainKey> {
+    let mut r = Reader::open(data, codec::KIND_CHAIN)?;
+    let mut chain = ChainKey::new(r.array()?);
+    chain.index = r.varint()?;
+    r.finish()?;
+    Ok(chain)
+}
+
+fn decode_chain(r: &mut Reader<'_>) -> ProtocolResult<Option<ChainKey>> {
+    match r.option_array::<32>()? {
+        Some(key) => {
+            let mut chain = ChainKey::new(key);
+            chain.index = r.varint()?;
+            Ok(Some(chain))
+        }
+        None => Ok(None),
+    }
+}
+
 // Helpers for serialization of StaticSecret
 mod serde_bytes {
     use super::*;
@@ -3,6 +3,7 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel, validator
 from typing import List, Dict, Optional
 import uvicorn
+import os
 import sqlite3
 import time
 import re
@@ -11,7 +12,8 @@ from collections import defaultdict
 app = FastAPI(docs_url=None, redoc_url=None)
 
 # --- Security Configuration ---
-MAX_REQ_PER_MINUTE = 60
+# 0 turns the limiter off, for local load tests (benchmarks/run.py)
+MAX_REQ_PER_MINUTE = int(os.environ.get("SIBNA_MAX_REQ_PER_MINUTE", "60"))
 DB_PATH = "server_keys.db"
 
 # --- Database Setup ---
@@ -46,6 +48,8 @@ request_counts = defaultdict(list)
 
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
+    if not MAX_REQ_PER_MINUTE:
+        return await call_next(request)
     client_ip = request.client.host
     now = time.time()
     
@@ -1,4 +1,14 @@
-from .client import Client
 from .core.exceptions import ProtocolError
 
 __version__ = "1.0.0"
+
+__all__ = ["Client", "ProtocolError"]
+
+
+def __getattr__(name):
+    # The client module pulls in sqlite3 and requests; load it on first use.
+    if name == "Client":
+        from .client import Client
+        globals()["Client"] = Client
+        return Client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
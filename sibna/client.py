@@ -1,16 +1,19 @@
 import logging
-import threading
 import time
-import requests
-import sqlite3
 import os
+import struct
 from typing import Optional, Callable, List
 from .core.exceptions import NetworkError, AuthError
 
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
+# requests, sqlite3 and threading are imported where they are first needed,
+# and logging is left for the application to configure, so `import sibna`
+# stays cheap for short-lived CLI tools.
 logger = logging.getLogger("sibna")
 
+# First byte of a queued payload that carries group traffic
+GROUP_KEY = 0x01      # our sender key, encrypted over the pairwise session
+GROUP_MESSAGE = 0x02  # group id length (2) | group id | sender-key ciphertext
+
 class Client:
     """
     The High-Level Sibna Client.
@@ -22,13 +25,28 @@ class Client:
         self.db_path = f"{user_id}_storage.db"
         self._running = False
         self._worker_thread = None
+        # Storage is created by the first operation that needs it
+        self._db_ready = False
+        self._secure = None
         
-        # Initialize Storage
-        self._init_db()
+    def _context(self):
+        """The Rust core context, created on first use."""
+        if self._secure is None:
+            from secure_protocol import Config, SecureContext
+            self._secure = SecureContext(Config(db_path=f"{self.user_id}_secure_db"))
+        return self._secure
+
+    def _connect(self):
+        """Open the local DB, creating it on first use."""
+        import sqlite3
+        conn = sqlite3.connect(self.db_path)
+        if not self._db_ready:
+            self._init_db(conn)
+            self._db_ready = True
+        return conn
         
-    def _init_db(self):
+    def _init_db(self, conn):
         """Initialize local SQLite DB for messages and keys."""
-        conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS outgoing_queue (
@@ -48,8 +66,14 @@ class Client:
                 received_at REAL
             )
         ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS group_key_sent (
+                group_id TEXT NOT NULL,
+                member TEXT NOT NULL,
+                PRIMARY KEY (group_id, member)
+            )
+        ''')
         conn.commit()
-        conn.close()
 
     def register(self):
         """
@@ -98,6 +122,7 @@ class Client:
         # In a real app, this calls the Rust Core.
         
         try:
+            import requests
             r = requests.post(f"{self.server_url}/keys/upload", json=payload, headers={"Content-Type": "application/json"})
             if r.status_code not in [200, 409]: # 409 is OK if already registered
                 raise NetworkError(f"Registration failed: {r.text}")
@@ -110,7 +135,7 @@ class Client:
         Queue a message to be sent.
         Returns immediately (Optimistic UI).
         """
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         conn.execute(
             "INSERT INTO outgoing_queue (recipient, payload, status, attempts, last_attempt) VALUES (?, ?, 'pending', 0, 0)",
             (recipient_id, message.encode('utf-8'))
@@ -119,8 +144,75 @@ class Client:
         conn.close()
         logger.info(f"Message to {recipient_id} queued.")
 
+    def send_group(self, group_id: str, members: List[str], message: str):
+        """
+        Queue a message for every member of a group.
+        The message is encrypted once with our sender key and the same bytes
+        are queued for each member. Members who have not received our sender
+        key yet get it first, over their pairwise session (which must already
+        be established).
+        """
+        ctx = self._context()
+        gid = group_id.encode('utf-8')
+        recipients = [m for m in dict.fromkeys(members) if m != self.user_id]
+        conn = self._connect()
+        try:
+            have = {row[0] for row in conn.execute("SELECT member FROM group_key_sent WHERE group_id=?", (group_id,))}
+            rows = []
+            missing = [m for m in recipients if m not in have]
+            if missing:
+                distribution = ctx.group_sender_key(gid)
+                for member in missing:
+                    rows.append((member, bytes([GROUP_KEY]) + ctx.encrypt_message(member.encode('utf-8'), distribution)))
+
+            ciphertext = ctx.group_encrypt(gid, message.encode('utf-8'))
+            payload = bytes([GROUP_MESSAGE]) + struct.pack('>H', len(gid)) + gid + ciphertext
+            rows.extend((member, payload) for member in recipients)
+
+            conn.executemany(
+                "INSERT INTO outgoing_queue (recipient, payload, status, attempts, last_attempt) VALUES (?, ?, 'pending', 0, 0)",
+                rows,
+            )
+            conn.executemany("INSERT OR IGNORE INTO group_key_sent (group_id, member) VALUES (?, ?)",
+                             [(group_id, member) for member in missing])
+            conn.commit()
+        finally:
+            conn.close()
+        logger.info(f"Group message to {group_id} queued for {len(recipients)} members.")
+
+    def rotate_group_key(self, group_id: str):
+        """
+        Replace our sender key for a group, e.g. after a member leaves.
+        The next send_group redistributes it to the members passed there.
+        """
+        self._context().rotate_group_sender_key(group_id.encode('utf-8'))
+        conn = self._connect()
+        conn.execute("DELETE FROM group_key_sent WHERE group_id=?", (group_id,))
+        conn.commit()
+        conn.close()
+
+    def receive_group(self, sender_id: str, payload: bytes):
+        """
+        Handle a group payload from sender_id.
+        Returns (group_id, message) for a group message, or None after
+        installing a sender key.
+        """
+        ctx = self._context()
+        sender = sender_id.encode('utf-8')
+        kind, body = payload[0], payload[1:]
+        if kind == GROUP_KEY:
+            ctx.process_group_sender_key(sender, ctx.decrypt_message(sender, body))
+            return None
+        if kind == GROUP_MESSAGE:
+            (gid_len,) = struct.unpack_from('>H', body)
+            gid = body[2:2 + gid_len]
+            plaintext = ctx.group_decrypt(gid, sender, body[2 + gid_len:])
+            return gid.decode('utf-8'), plaintext.decode('utf-8')
+        raise ValueError(f"not a group payload (kind {kind})")
+
     def start(self):
         """Start the background worker for sending/receiving."""
+        import threading
         self._running = True
         self._worker_thread = threading.Thread(target=self._process_queue)
         self._worker_thread.start()
@@ -139,7 +231,7 @@ class Client:
             time.sleep(1) # Poll interval
             
     def _flush_outgoing(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         rows = conn.execute("SELECT id, recipient, payload, attempts FROM outgoing_queue WHERE status='pending' AND last_attempt < ?", (time.time() - 5,)).fetchall()
         
         for row in rows:
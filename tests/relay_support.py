@@ -0,0 +1,101 @@
+"""
+Helpers for tests that run tools/relay-server.py as a process and talk to
+it over raw sockets.
+"""
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+import urllib.request
+from contextlib import contextmanager
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+RELAY = os.path.join(ROOT, 'tools/relay-server.py')
+
+OK, REJECTED, ERROR = b'\x00', b'\xfd', b'\xff'
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_relay(port, *args):
+    """Start a relay on port with the given extra arguments and wait until it
+    accepts connections. Returns the process; the caller stops it."""
+    proc = subprocess.Popen([sys.executable, RELAY, "--host", "127.0.0.1", "--port", str(port), *args],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            if time.time() > deadline:
+                proc.kill()
+                proc.wait()
+                raise RuntimeError("relay did not start")
+            time.sleep(0.05)
+
+@contextmanager
+def relay(*args):
+    """A relay process with the given extra arguments; yields its port."""
+    port = free_port()
+    proc = start_relay(port, *args)
+    try:
+        yield port
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("relay closed the connection")
+        data += chunk
+    return data
+
+def register(port, pub):
+    """Connect and REGISTER; returns the socket and the status byte."""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+    sock.sendall(b'\x01' + pub)
+    return sock, recv_exact(sock, 1)
+
+def send(sock, recipient, msg):
+    sock.sendall(b'\x02' + recipient + struct.pack('>I', len(msg)) + msg)
+    return recv_exact(sock, 1)
+
+def send_multi(sock, recipients, msg):
+    sock.sendall(b'\x04' + struct.pack('>H', len(recipients)) + b''.join(recipients)
+                 + struct.pack('>I', len(msg)) + msg)
+    return recv_exact(sock, 1)
+
+def fetch(sock):
+    """FETCH; returns [(sender, message)]."""
+    sock.sendall(b'\x03')
+    messages = []
+    for _ in range(struct.unpack('>I', recv_exact(sock, 4))[0]):
+        sender = recv_exact(sock, 32)
+        messages.append((sender, recv_exact(sock, struct.unpack('>I', recv_exact(sock, 4))[0])))
+    return messages
+
+def stats(port):
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+        sock.sendall(b'\x05')
+        return json.loads(recv_exact(sock, struct.unpack('>I', recv_exact(sock, 4))[0]))
+
+def get(port, path):
+    """GET path from the admin port."""
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=10) as response:
+        return response.read().decode()
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+
@@ -0,0 +1,155 @@
+"""
+Native binding contracts: every byte string crosses into Python as bytes,
+never as a list of ints, and the buffer-protocol paths read from and write
+into caller buffers. Needs the extension built (make python).
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../bindings/python'))
+
+pytest.importorskip("secure_protocol._secure_protocol", reason="native extension not built")
+
+from secure_protocol import MESSAGE_OVERHEAD, ChunkCipher, Config, SecureContext
+
+SECRET = bytes(range(32))
+
+
+@pytest.fixture
+def pair(tmp_path):
+    """(alice, bob): contexts whose sessions with each other are established."""
+    alice = SecureContext(Config(db_path=str(tmp_path / "alice")))
+    bob = SecureContext(Config(db_path=str(tmp_path / "bob")))
+    alice.establish_session(b"bob", SECRET, True)
+    bob.establish_session(b"alice", SECRET, False)
+    return alice, bob
+
+
+def test_session_peer_id_is_bytes(tmp_path):
+    ctx = SecureContext(Config(db_path=str(tmp_path / "db")))
+    session = ctx.create_session(b"peer-1")
+    assert type(session.peer_id()) is bytes
+    assert session.peer_id() == b"peer-1"
+
+
+def test_load_session_finds_persisted_session(tmp_path):
+    config = Config(db_path=str(tmp_path / "db"))
+    ctx = SecureContext(config)
+    assert ctx.load_session(b"peer-1") is None
+    ctx.create_session(b"peer-1")
+    del ctx
+
+    reopened = SecureContext(config)
+    session = reopened.load_session(b"peer-1")
+    assert session is not None and session.peer_id() == b"peer-1"
+
+
+def test_encrypt_into_and_decrypt_into_caller_buffers(pair):
+    alice, bob = pair
+    plaintext = b"buffer protocol"
+    out = bytearray(len(plaintext) + MESSAGE_OVERHEAD)
+    assert alice.encrypt_into(b"bob", memoryview(plaintext), out) == len(out)
+
+    # Ciphertext from a bytearray, plaintext into a slice of a larger buffer.
+    back = bytearray(64)
+    n = bob.decrypt_into(b"alice", out, memoryview(back)[8:8 + len(plaintext)])
+    assert n == len(plaintext) and back[8:8 + n] == plaintext
+
+    # A larger output buffer is fine; only the returned length is written.
+    big = bytearray(len(plaintext) + MESSAGE_OVERHEAD + 100)
+    n = alice.encrypt_into(b"bob", bytearray(plaintext), big)
+    assert n == len(plaintext) + MESSAGE_OVERHEAD
+    assert bob.decrypt_message(b"alice", memoryview(big)[:n]) == plaintext
+
+
+def test_output_buffer_is_checked_before_encrypting(pair):
+    alice, bob = pair
+    plaintext = b"x" * 10
+    with pytest.raises(BufferError):
+        alice.encrypt_into(b"bob", plaintext, bytes(len(plaintext) + MESSAGE_OVERHEAD))
+    with pytest.raises(ValueError):
+        alice.encrypt_into(b"bob", plaintext, bytearray(len(plaintext) + MESSAGE_OVERHEAD - 1))
+    shared = bytearray(200)
+    with pytest.raises(ValueError):
+        alice.encrypt_into(b"bob", memoryview(shared)[:10], memoryview(shared)[5:])
+
+    ciphertext = alice.encrypt_message(b"bob", plaintext)
+    with pytest.raises(ValueError):
+        bob.decrypt_into(b"alice", ciphertext, bytearray(len(plaintext) - 1))
+    # The rejected decrypt did not consume the message key.
+    out = bytearray(len(plaintext))
+    assert bob.decrypt_into(b"alice", ciphertext, out) == len(plaintext) and out == plaintext
+
+
+def test_seal_buffer_matches_seal_per_chunk():
+    cipher = ChunkCipher(os.urandom(32))
+    data = os.urandom(1000)
+    sealed = cipher.seal_buffer(data, 256, first_index=3, associated_data=b"ad")
+    assert all(type(chunk) is bytes for chunk in sealed)
+    assert sealed == [cipher.seal(3 + i, data[off:off + 256], b"ad") for i, off in enumerate(range(0, 1000, 256))]
+    with pytest.raises(ValueError):
+        cipher.seal_buffer(data, 0)
+
+
+def test_encrypt_many_keeps_order_and_matches_serial(tmp_path):
+    alice = SecureContext(Config(db_path=str(tmp_path / "alice")))
+    bob = SecureContext(Config(db_path=str(tmp_path / "bob")))
+    peers = [b"peer-%d" % i for i in range(4)]
+    for peer in peers:
+        alice.establish_session(peer, SECRET, True)
+        bob.establish_session(peer, SECRET, False)
+
+    # Interleaved sessions; each session's messages must stay in order.
+    items = [(peers[i % 4], b"message %d" % i) for i in range(40)]
+    ciphertexts = alice.encrypt_many(items, threads=4)
+    assert all(type(c) is bytes for c in ciphertexts)
+    # bob decrypts serially, message by message, in input order.
+    assert [bob.decrypt_message(peer, c) for (peer, _), c in zip(items, ciphertexts)] == [m for _, m in items]
+
+    for peer in peers:
+        alice.establish_session(peer, SECRET, True)
+        bob.establish_session(peer, SECRET, False)
+    serial = [alice.encrypt_message(peer, m) for peer, m in items]
+    assert bob.decrypt_many(list(zip([p for p, _ in items], serial)), threads=3) == [m for _, m in items]
+
+
+def test_many_calls_report_the_failing_item(pair):
+    alice, bob = pair
+    ciphertexts = alice.encrypt_many([(b"bob", b"one"), (b"bob", b"two"), (b"bob", b"three")])
+    tampered = bytearray(ciphertexts[1])
+    tampered[-1] ^= 1
+    assert bob.decrypt_many([(b"alice", ciphertexts[0]), (b"alice", bytes(tampered)),
+                             (b"alice", ciphertexts[2])]) == [b"one", None, b"three"]
+
+    with pytest.raises(RuntimeError, match="session nobody"):
+        alice.encrypt_many([(b"bob", b"fine"), (b"nobody", b"lost")])
+    with pytest.raises(RuntimeError, match="session nobody"):
+        bob.decrypt_many([(b"nobody", ciphertexts[0])])
+
+
+def test_seal_many_and_open_many_match_serial():
+    cipher = ChunkCipher(os.urandom(32))
+    chunks = [os.urandom(100 + i) for i in range(50)]
+    sealed = cipher.seal_many(chunks, first_index=10, associated_data=b"ad", threads=4)
+    assert sealed == [cipher.seal(10 + i, chunk, b"ad") for i, chunk in enumerate(chunks)]
+    assert cipher.open_many(sealed, first_index=10, associated_data=b"ad", threads=4) == chunks
+
+    sealed[17] = sealed[17][:-1] + bytes([sealed[17][-1] ^ 1])
+    with pytest.raises(RuntimeError, match="chunk 27"):
+        cipher.open_many(sealed, first_index=10, associated_data=b"ad")
+
+
+def test_decrypt_batch_with_a_bad_message_leaves_the_session_usable(pair):
+    alice, bob = pair
+    ciphertexts = alice.encrypt_batch(b"bob", [b"one", b"two", b"three"])
+    forged = bytearray(ciphertexts[1])
+    forged[:32] = os.urandom(32)  # a new ratchet key would move the session if trusted
+    assert bob.decrypt_batch(b"alice", [ciphertexts[0], bytes(forged), b"short", ciphertexts[2]]) \
+        == [b"one", None, None, b"three"]
+
+    # The skipped message and later traffic in both directions still work.
+    assert bob.decrypt_batch(b"alice", [ciphertexts[1]]) == [b"two"]
+    assert bob.decrypt_message(b"alice", alice.encrypt_message(b"bob", b"four")) == b"four"
+    assert alice.decrypt_batch(b"bob", bob.encrypt_batch(b"alice", [b"back"])) == [b"back"]
@@ -0,0 +1,61 @@
+"""
+Container round trip through the native ChunkCipher: pack a file, unpack it,
+read ranges across chunk boundaries, and check that tampering is caught.
+Needs the extension built (make python).
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../bindings/python'))
+
+pytest.importorskip("secure_protocol._secure_protocol", reason="native extension not built")
+
+from secure_protocol import ChunkCipher
+from secure_protocol.container import (ContainerError, ContainerReader, new_file_key, pack_file,
+                                       unpack_file)
+
+CHUNK = 4096
+
+
+def test_chunk_cipher_returns_bytes():
+    cipher = ChunkCipher(new_file_key())
+    sealed = cipher.seal(7, b"chunk", b"ad")
+    assert type(sealed) is bytes
+    opened = cipher.open(7, sealed, b"ad")
+    assert type(opened) is bytes and opened == b"chunk"
+
+
+def test_pack_unpack_read_range(tmp_path):
+    data = os.urandom(CHUNK * 3 + 123)
+    src, packed, out = tmp_path / "src", tmp_path / "packed", tmp_path / "out"
+    src.write_bytes(data)
+    key = new_file_key()
+    pack_file(src, packed, key, chunk_size=CHUNK)
+
+    unpack_file(packed, out, key)
+    assert out.read_bytes() == data
+
+    with ContainerReader(packed, key) as reader:
+        assert reader.complete and reader.chunk_count == 4
+        assert reader.verify() == []
+        for offset, length in ((0, 10), (CHUNK - 5, 10), (CHUNK * 2 - 1, CHUNK + 2), (len(data) - 50, 100)):
+            assert reader.read_range(offset, length) == data[offset:offset + length]
+
+
+def test_tampered_chunk_is_detected(tmp_path):
+    src, packed = tmp_path / "src", tmp_path / "packed"
+    src.write_bytes(os.urandom(CHUNK * 2))
+    key = new_file_key()
+    pack_file(src, packed, key, chunk_size=CHUNK)
+    raw = bytearray(packed.read_bytes())
+    with ContainerReader(packed, key) as reader:
+        offset, _ = reader._index[1]
+    raw[offset] ^= 1
+    packed.write_bytes(bytes(raw))
+
+    with ContainerReader(packed, key) as reader:
+        assert reader.verify() == [1]
+        with pytest.raises(ContainerError):
+            reader.read_range(CHUNK, 1)
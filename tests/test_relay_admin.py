@@ -0,0 +1,87 @@
+"""
+Relay admin port against a live relay process: GET /metrics and GET /stats
+after a few sends, fetches and expiries.
+"""
+import json
+import sys
+import time
+import urllib.error
+
+import pytest
+
+from relay_support import OK, REJECTED, fetch, free_port, get, register, relay, send, wait_for
+
+def metrics(port):
+    """{sample name with labels: value} from the Prometheus text."""
+    samples = {}
+    for line in get(port, "/metrics").splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_metrics_follow_mailboxes():
+    admin = free_port()
+    with relay("--admin-port", str(admin), "--ttl", "1", "--reap-interval", "0.05") as port:
+        a, _ = register(port, b'a' * 32)
+        b, _ = register(port, b'b' * 32)
+        c, _ = register(port, b'c' * 32)
+        for _ in range(3):
+            assert send(a, b'b' * 32, b"x" * 10) == OK
+        assert send(a, b'c' * 32, b"y" * 20) == OK
+
+        wait_for(lambda: metrics(admin)['relay_command_duration_seconds_count{command="send"}'] == 4)
+        m = metrics(admin)
+        assert m['relay_mailbox_depth_bucket{le="0"}'] == 1
+        assert m['relay_mailbox_depth_bucket{le="1"}'] == 2
+        assert m['relay_mailbox_depth_bucket{le="5"}'] == 3
+        assert m["relay_mailbox_depth_count"] == 3
+        assert m["relay_mailbox_depth_sum"] == 4
+        assert m["relay_stored_messages"] == 4 and m["relay_stored_bytes"] == 50
+        assert m["relay_online_clients"] == 3
+        assert m['relay_command_duration_seconds_count{command="send"}'] == 4
+        assert m['relay_command_duration_seconds_count{command="register"}'] == 3
+
+        assert len(fetch(b)) == 3
+        m = metrics(admin)
+        assert m['relay_mailbox_depth_bucket{le="0"}'] == 2
+        assert m["relay_mailbox_depth_sum"] == 1
+        assert m["relay_stored_messages"] == 1 and m["relay_stored_bytes"] == 20
+
+        # c's message expires; the reaper keeps the depth histogram in step.
+        time.sleep(1)
+        wait_for(lambda: metrics(admin)["relay_expired"] == 1)
+        m = metrics(admin)
+        assert m['relay_mailbox_depth_bucket{le="0"}'] == 3
+        assert m["relay_mailbox_depth_sum"] == 0 and m["relay_stored_messages"] == 0
+
+        stats = json.loads(get(admin, "/stats"))
+        assert stats["delivered"] == 3 and stats["expired"] == 1 and stats["mailboxes"] == 3
+        for sock in (a, b, c):
+            sock.close()
+
+
+def test_metrics_count_bytes_and_rejections():
+    admin = free_port()
+    with relay("--admin-port", str(admin), "--mailbox-max-messages", "1") as port:
+        a, _ = register(port, b'a' * 32)
+        assert send(a, b'a' * 32, b"z" * 10) == OK
+        assert send(a, b'a' * 32, b"z" * 10) == REJECTED
+        assert send(a, b'u' * 32, b"z" * 10) == REJECTED
+
+        # A command is metered just after its reply goes out.
+        wait_for(lambda: metrics(admin)["relay_bytes_sent_total"] == 4)
+        m = metrics(admin)
+        # REGISTER is 33 bytes in, SEND 47; each answers with one status byte.
+        assert m["relay_bytes_received_total"] == 33 + 3 * 47
+        assert m["relay_rejected_quota"] == 1 and m["relay_rejected_unknown"] == 1
+        assert m["relay_accepted"] == 1
+        with pytest.raises(urllib.error.HTTPError) as missing:
+            get(admin, "/nothing")
+        assert missing.value.code == 404
+        a.close()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
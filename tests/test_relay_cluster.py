@@ -0,0 +1,187 @@
+"""
+Relay cluster test: three relay processes on localhost. Clients register,
+send and fetch on whichever node they happen to be connected to; the ring
+routes each mailbox to its owner. Then a fourth node joins, the ring is
+rebalanced, and queued messages must still arrive. A retried FORWARD is
+stored once, and messages a new owner rejects stay on the old node.
+"""
+import importlib.util
+import os
+import socket
+import struct
+import subprocess
+import sys
+
+from relay_support import RELAY, fetch, free_port, recv_exact, send, send_multi, start_relay, stats
+
+SECRET = "cluster-test"
+
+def peers_spec(nodes):
+    return ",".join(f"{node}=127.0.0.1:{port}" for node, port in nodes.items())
+
+def start_node(node, nodes, secret=SECRET, *extra):
+    others = {n: p for n, p in nodes.items() if n != node}
+    return start_relay(nodes[node], "--node-id", node, "--peers", peers_spec(others), "--cluster-secret", secret, *extra)
+
+class Client:
+    def __init__(self, port, pub):
+        self.pub = pub
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.sendall(b'\x01' + pub)
+        assert recv_exact(self.sock, 1) == b'\x00'
+
+    def send(self, recipient, msg):
+        return send(self.sock, recipient, msg)
+
+    def send_multi(self, recipients, msg):
+        return send_multi(self.sock, recipients, msg)
+
+    def fetch(self):
+        return fetch(self.sock)
+
+    def close(self):
+        self.sock.close()
+
+def peer_link(port):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(bytes([0x10, 4]) + b"test" + bytes([len(SECRET)]) + SECRET.encode())
+    assert recv_exact(sock, 1) == b'\x00'
+    return sock
+
+def forward(sock, msg_id, sender, recipient, msg):
+    sock.sendall(b'\x11' + msg_id + sender + struct.pack('>H', 1) + recipient + struct.pack('>I', len(msg)) + msg)
+    return struct.unpack('>H', recv_exact(sock, 2))[0]
+
+def owned_by(node, nodes):
+    """A key the ring over nodes assigns to node."""
+    spec = importlib.util.spec_from_file_location("relay_server", RELAY)
+    relay = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(relay)
+    ring = relay.HashRing(list(nodes), relay.CONFIG.vnodes)
+    return next(key for key in (bytes([i]) * 32 for i in range(1, 256)) if ring.owner(key) == node)
+
+def closed(sock):
+    """True once the relay has dropped the connection."""
+    try:
+        return sock.recv(1) == b''
+    except ConnectionResetError:
+        return True
+
+def check(condition, message):
+    assert condition, f"[TEST FAILED] {message}"
+
+def main():
+    nodes = {name: free_port() for name in ("a", "b", "c")}
+    procs = [start_node(node, nodes) for node in nodes]
+    try:
+        ports = list(nodes.values())
+        users = [bytes([i]) * 32 for i in range(1, 31)]
+        # Each user connects to a node chosen without regard to the ring.
+        clients = [Client(ports[i % len(ports)], pub) for i, pub in enumerate(users)]
+
+        sender = clients[0]
+        for client in clients[1:]:
+            check(sender.send(client.pub, b"hello " + client.pub[:1]) == b'\x00',
+                  f"SEND to {client.pub[:1].hex()} was not stored")
+        check(sender.send_multi([c.pub for c in clients[1:]], b"to everyone") == b'\x00',
+              "SEND_MULTI did not reach every owner")
+
+        for client in clients[1:]:
+            got = client.fetch()
+            check(got == [(sender.pub, b"hello " + client.pub[:1]), (sender.pub, b"to everyone")],
+                  f"user {client.pub[:1].hex()} fetched {got}")
+        print("[TEST SUCCESS] Messages routed to their owners across 3 nodes.")
+
+        # Queue one message per user, then add node d and rebalance.
+        for client in clients[1:]:
+            sender.send(client.pub, b"before rebalance")
+        nodes["d"] = free_port()
+        procs.append(start_node("d", nodes))
+        subprocess.run([sys.executable, RELAY, "--apply-ring", peers_spec(nodes), "--cluster-secret", SECRET],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        for client in clients[1:]:
+            got = client.fetch()
+            check(got == [(sender.pub, b"before rebalance")],
+                  f"user {client.pub[:1].hex()} fetched {got} after rebalance")
+        for client in clients:
+            client.close()
+        print("[TEST SUCCESS] Queued messages survived adding a node.")
+
+        # A client without the cluster secret cannot use peer commands.
+        sock = socket.create_connection(("127.0.0.1", nodes["a"]))
+        sock.sendall(bytes([0x10, 1]) + b"x" + bytes([5]) + b"wrong")
+        check(recv_exact(sock, 1) == b'\xff', "PEER_HELLO accepted a wrong secret")
+        sock.close()
+        print("[TEST SUCCESS] Peer links require the cluster secret.")
+
+        # A FORWARD retried with the same message id is stored once.
+        user = Client(nodes["a"], owned_by("a", nodes))
+        link = peer_link(nodes["a"])
+        check(forward(link, b'\x01' * 16, sender.pub, user.pub, b"once") == 1, "FORWARD was not stored")
+        check(forward(link, b'\x01' * 16, sender.pub, user.pub, b"once") == 1, "retried FORWARD lost its count")
+        check(forward(link, b'\x02' * 16, sender.pub, user.pub, b"twice") == 1, "new FORWARD was not stored")
+        got = user.fetch()
+        check(got == [(sender.pub, b"once"), (sender.pub, b"twice")], f"deduplicated FORWARD fetched {got}")
+        link.close()
+        user.close()
+        print("[TEST SUCCESS] A retried FORWARD is stored once.")
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+    # Messages the new owner rejects (here: over its quota) stay on the old
+    # node until a later rebalance moves them.
+    nodes = {"x": free_port()}
+    procs = [start_node("x", nodes)]
+    try:
+        nodes["y"] = free_port()
+        user = Client(nodes["x"], owned_by("y", nodes))
+        for i in range(3):
+            user.send(user.pub, b"queued %d" % i)
+        procs.append(start_node("y", nodes, SECRET, "--mailbox-max-messages", "1"))
+        for expected in range(3):
+            subprocess.run([sys.executable, RELAY, "--apply-ring", peers_spec(nodes), "--cluster-secret", SECRET],
+                           check=True, stdout=subprocess.DEVNULL)
+            check(stats(nodes["x"])["stored_messages"] == 2 - expected,
+                  f"old node holds {stats(nodes['x'])['stored_messages']} messages after rebalance {expected + 1}")
+            got = user.fetch()
+            check(got == [(user.pub, b"queued %d" % expected)], f"rebalance {expected + 1} delivered {got}")
+        user.close()
+        print("[TEST SUCCESS] Rejected messages stay on the old node until the owner takes them.")
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+    # A relay started without a secret refuses every peer link, even one
+    # offering the same (empty) secret, and clustering needs a secret.
+    port = free_port()
+    proc = start_node("solo", {"solo": port}, secret="")
+    try:
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(bytes([0x10, 4]) + b"evil" + bytes([0]))
+        check(recv_exact(sock, 1) == b'\xff', "PEER_HELLO accepted an empty secret")
+        sock.close()
+        sock = socket.create_connection(("127.0.0.1", port))
+        ring = b'{"nodes": {"evil": "127.0.0.1:1"}}'
+        sock.sendall(b'\x14' + struct.pack('>I', len(ring)) + ring)
+        check(closed(sock), "RING accepted without PEER_HELLO")
+        sock.close()
+        check(Client(port, b'\x07' * 32).send(b'\x07' * 32, b"still mine") == b'\x00',
+              "relay stopped serving after the probe")
+    finally:
+        proc.terminate()
+        proc.wait()
+    for extra in (["--peers", "a=127.0.0.1:1"], ["--apply-ring", "a=127.0.0.1:1"]):
+        result = subprocess.run([sys.executable, RELAY, *extra], env=dict(os.environ, RELAY_CLUSTER_SECRET=""),
+                                capture_output=True)
+        check(result.returncode != 0, f"relay started with {extra[0]} and no secret")
+    print("[TEST SUCCESS] A relay without a cluster secret takes no peers.")
+
+def test_relay_cluster():
+    main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Connection handling against a live relay process: idle connections are
+reaped unless they PING, and connections over the per-address cap are shed.
+"""
+import json
+import socket
+import sys
+import time
+
+from relay_support import OK, free_port, get, recv_exact, relay, wait_for
+
+
+def closed(sock):
+    """True once the relay has dropped the connection."""
+    try:
+        return sock.recv(1) == b''
+    except ConnectionResetError:
+        return True
+
+def admin_stats(port):
+    return json.loads(get(port, "/stats"))
+
+
+def test_idle_connections_are_reaped_unless_they_ping():
+    admin = free_port()
+    with relay("--idle-timeout", "0.5", "--admin-port", str(admin)) as port:
+        idle = socket.create_connection(("127.0.0.1", port), timeout=10)
+        busy = socket.create_connection(("127.0.0.1", port), timeout=10)
+        for _ in range(5):
+            time.sleep(0.2)
+            busy.sendall(b'\x06')
+            assert recv_exact(busy, 1) == OK
+
+        assert closed(idle)
+        wait_for(lambda: admin_stats(admin)["idle_timeouts"] >= 1)
+        busy.sendall(b'\x06')
+        assert recv_exact(busy, 1) == OK
+        assert admin_stats(admin)["pings"] == 6
+        idle.close()
+        busy.close()
+
+
+def test_connections_over_the_per_address_cap_are_shed():
+    admin = free_port()
+    with relay("--max-connections-per-ip", "2", "--admin-port", str(admin)) as port:
+        # The startup probe's connection is released asynchronously.
+        wait_for(lambda: admin_stats(admin)["open_connections"] == 0)
+        held = [socket.create_connection(("127.0.0.1", port), timeout=10) for _ in range(2)]
+        wait_for(lambda: admin_stats(admin)["open_connections"] == 2)
+
+        extra = socket.create_connection(("127.0.0.1", port), timeout=10)
+        assert closed(extra)
+        extra.close()
+        assert admin_stats(admin)["connections_rejected"] == 1
+
+        # Closing one frees its slot.
+        held.pop().close()
+        wait_for(lambda: admin_stats(admin)["open_connections"] == 1)
+        again = socket.create_connection(("127.0.0.1", port), timeout=10)
+        again.sendall(b'\x06')
+        assert recv_exact(again, 1) == OK
+        again.close()
+        for sock in held:
+            sock.close()
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
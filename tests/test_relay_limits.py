@@ -0,0 +1,72 @@
+"""
+Relay limits against a live relay process: mailbox quotas, message TTL,
+mailbox retirement and the mailbox cap.
+"""
+import sys
+import time
+
+from relay_support import OK, REJECTED, fetch, register, relay, send, stats, wait_for
+
+A, B = b'a' * 32, b'b' * 32
+
+
+def test_mailbox_quotas_reject_until_fetched():
+    with relay("--mailbox-max-messages", "2", "--mailbox-max-bytes", "100") as port:
+        a, _ = register(port, A)
+        b, _ = register(port, B)
+        assert send(a, B, b"1" * 10) == OK
+        assert send(a, B, b"2" * 95) == REJECTED  # over the byte quota
+        assert send(a, B, b"3" * 10) == OK
+        assert send(a, B, b"4" * 10) == REJECTED  # over the message quota
+        assert stats(port)["rejected_quota"] == 2
+
+        assert fetch(b) == [(A, b"1" * 10), (A, b"3" * 10)]
+        assert send(a, B, b"5" * 90) == OK
+        assert fetch(b) == [(A, b"5" * 90)]
+        a.close()
+        b.close()
+
+
+def test_messages_expire_after_ttl():
+    with relay("--ttl", "1", "--reap-interval", "0.05") as port:
+        a, _ = register(port, A)
+        b, _ = register(port, B)
+        assert send(a, B, b"stale") == OK
+        time.sleep(0.5)
+        assert send(a, B, b"fresh") == OK
+
+        # The reaper drops the first message; the second is still in time.
+        wait_for(lambda: stats(port)["expired"] == 1)
+        assert fetch(b) == [(A, b"fresh")]
+        counters = stats(port)
+        assert counters["stored_messages"] == 0 and counters["stored_bytes"] == 0
+        a.close()
+        b.close()
+
+
+def test_idle_mailboxes_are_retired_and_capped():
+    with relay("--ttl", "1", "--max-mailboxes", "2", "--reap-interval", "0.05") as port:
+        online, status = register(port, b'a' * 32)
+        assert status == OK
+        offline, status = register(port, b'b' * 32)
+        assert status == OK
+        offline.close()
+
+        # The node is full until the offline key's empty mailbox goes idle.
+        late, status = register(port, b'c' * 32)
+        assert status == REJECTED
+        late.close()
+        assert stats(port)["rejected_mailboxes"] == 1
+
+        wait_for(lambda: stats(port)["retired_mailboxes"] == 1)
+        # The connected key keeps its mailbox however long it stays idle.
+        assert stats(port)["mailboxes"] == 1
+        late, status = register(port, b'c' * 32)
+        assert status == OK
+        late.close()
+        online.close()
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,45 @@
+"""
+SEND_MULTI against a live relay process: one shared payload for every known
+recipient, REJECTED when any recipient is refused.
+"""
+import sys
+
+from relay_support import ERROR, OK, REJECTED, fetch, register, relay, send_multi, stats
+
+A, B, C, UNKNOWN = (bytes([i]) * 32 for i in range(1, 5))
+
+
+def test_send_multi_reaches_every_recipient_once():
+    with relay() as port:
+        (a, _), (b, _), (c, _) = (register(port, key) for key in (A, B, C))
+        assert send_multi(a, [B, C, B], b"to both") == OK
+        assert fetch(b) == [(A, b"to both")]
+        assert fetch(c) == [(A, b"to both")]
+        assert send_multi(a, [], b"to nobody") == ERROR
+        for sock in (a, b, c):
+            sock.close()
+
+
+def test_send_multi_partial_failure():
+    with relay("--mailbox-max-messages", "1") as port:
+        (a, _), (b, _), (c, _) = (register(port, key) for key in (A, B, C))
+        # An unknown recipient fails the command; the known ones still get it.
+        assert send_multi(a, [B, UNKNOWN, C], b"first") == REJECTED
+        counters = stats(port)
+        assert counters["rejected_unknown"] == 1
+        assert counters["accepted"] == 2 and counters["stored_messages"] == 2
+        assert counters["message_rows"] == 1
+
+        # So does a recipient over quota: c's mailbox is still full.
+        assert fetch(b) == [(A, b"first")]
+        assert send_multi(a, [B, C], b"second") == REJECTED
+        assert stats(port)["rejected_quota"] == 1
+        assert fetch(b) == [(A, b"second")]
+        assert fetch(c) == [(A, b"first")]
+        for sock in (a, b, c):
+            sock.close()
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
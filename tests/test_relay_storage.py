@@ -0,0 +1,38 @@
+"""
+Arena storage against a live relay process: once most payloads in a segment
+are fetched, the reaper copies the rest to the tail and frees the segment,
+and the moved messages still read back intact.
+"""
+import sys
+
+from relay_support import OK, fetch, register, relay, send, stats, wait_for
+
+A, B = b'a' * 32, b'b' * 32
+
+
+def test_sparse_segments_are_compacted():
+    with relay("--arena-segment", "1000", "--reap-interval", "0.05") as port:
+        a, _ = register(port, A)
+        b, _ = register(port, B)
+        # Ten 100-byte payloads per segment; a keeps one from each.
+        kept = []
+        for i in range(40):
+            msg = b"%03d" % i + bytes([i]) * 97
+            assert send(a, A if i % 10 == 0 else B, msg) == OK
+            if i % 10 == 0:
+                kept.append((A, msg))
+        assert stats(port)["arena_segments"] == 4
+
+        assert len(fetch(b)) == 36
+        wait_for(lambda: stats(port)["compactions"] >= 1)
+        wait_for(lambda: stats(port)["arena_segments"] == 2)
+        assert stats(port)["arena_live_bytes"] == 400
+        assert fetch(a) == kept
+        assert stats(port)["arena_segments"] == 0
+        a.close()
+        b.close()
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,50 @@
+"""
+Encrypt-at-enqueue pipeline of tools/python-tools/resilient_messenger.py end
+to end: plaintext in, ciphertext committed to SQLite, decrypted by the peer.
+Needs the extension built (make python).
+"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../bindings/python'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../tools/python-tools'))
+
+pytest.importorskip("secure_protocol._secure_protocol", reason="native extension not built")
+
+from secure_protocol import Config, SecureContext
+from resilient_messenger import EncryptPipeline, SessionNotEstablished
+
+SECRET = bytes(range(32))
+
+
+def test_pipeline_commits_ciphertext_the_peer_can_decrypt(tmp_path):
+    alice = SecureContext(Config(db_path=str(tmp_path / "alice")))
+    bob = SecureContext(Config(db_path=str(tmp_path / "bob")))
+    alice.establish_session(b"bob", SECRET, True)
+    bob.establish_session(b"alice", SECRET, False)
+
+    queue_db = str(tmp_path / "queue.db")
+    pipeline = EncryptPipeline(alice, db_path=queue_db, workers=2)
+    messages = [b"message %d" % i for i in range(20)]
+    futures = pipeline.submit_many("bob", messages[:10]) + [pipeline.submit("bob", m) for m in messages[10:]]
+    pipeline.close()
+    ids = [fut.result() for fut in futures]
+
+    with sqlite3.connect(queue_db) as conn:
+        rows = dict(conn.execute("SELECT id, message FROM queue WHERE peer_id = 'bob'"))
+    assert sorted(rows) == sorted(ids)
+    stored = [rows[i] for i in ids]
+    assert all(m not in c for m, c in zip(messages, stored))
+    assert bob.decrypt_batch(b"alice", stored) == messages
+
+
+def test_pipeline_refuses_peers_without_a_session(tmp_path):
+    alice = SecureContext(Config(db_path=str(tmp_path / "alice")))
+    pipeline = EncryptPipeline(alice, db_path=str(tmp_path / "queue.db"))
+    with pytest.raises(SessionNotEstablished):
+        pipeline.submit("stranger", b"hello")
+    pipeline.close()
+    assert alice.load_session(b"stranger") is None
@@ -0,0 +1,82 @@
+"""
+Session daemon (secure_protocol.daemon) over a real Unix socket: socket
+permissions and start-up checks, and a create/establish/encrypt/decrypt/flush
+round trip against the native context.
+"""
+import os
+import socket
+import stat
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../bindings/python'))
+
+from secure_protocol.daemon import DaemonClient, DaemonError, SessionDaemon
+
+SECRET = bytes(range(32))
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """Start a daemon for a context on a socket in tmp_path; yields a factory."""
+    servers = []
+
+    def start(context, path=None):
+        path = path or str(tmp_path / "daemon.sock")
+        server = SessionDaemon(path, context)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return path
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_socket_is_owner_only(serve):
+    path = serve(None)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_refuses_to_replace_anything_but_a_stale_socket(tmp_path, serve):
+    regular = tmp_path / "not-a-socket"
+    regular.write_text("keep me")
+    with pytest.raises(DaemonError):
+        SessionDaemon(str(regular), None)
+    assert regular.read_text() == "keep me"
+
+    live = serve(None)
+    with pytest.raises(DaemonError):
+        SessionDaemon(live, None)
+    assert os.path.exists(live)
+
+    stale = str(tmp_path / "stale.sock")
+    dead = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    dead.bind(stale)
+    dead.close()
+    serve(None, stale)
+    assert stat.S_ISSOCK(os.stat(stale).st_mode)
+
+
+def test_round_trip_over_the_socket(tmp_path, serve):
+    pytest.importorskip("secure_protocol._secure_protocol", reason="native extension not built")
+    from secure_protocol import Config, SecureContext
+
+    # One store holds both ends: "bob" as seen by Alice and "alice" as seen by Bob.
+    path = serve(SecureContext(Config(db_path=str(tmp_path / "db"), durability="group")))
+    with DaemonClient(path) as client:
+        client.create_session(b"bare")
+        with pytest.raises(DaemonError):
+            client.encrypt_batch(b"bare", [b"no sending chain"])
+
+        client.establish_session(b"bob", SECRET, True)
+        client.establish_session(b"alice", SECRET, False)
+        messages = [b"one", b"two", b"three"]
+        ciphertexts = client.encrypt_batch(b"bob", messages)
+        assert client.decrypt_batch(b"alice", [ciphertexts[0], b"garbage", ciphertexts[2], ciphertexts[1]]) \
+            == [b"one", None, b"three", b"two"]
+        assert client.decrypt_message(b"bob", client.encrypt_message(b"alice", b"reply")) == b"reply"
+        client.flush()
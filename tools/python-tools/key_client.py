@@ -1,4 +1,3 @@
-import requests
 import json
 import argparse
 import sys
@@ -13,6 +12,7 @@ def upload_keys(user_id, identity_key, signed_pre_key, signed_pre_key_sig, one_t
         "signed_pre_key_sig": signed_pre_key_sig.hex(),
         "one_time_pre_keys": [k.hex() for k in one_time_pre_keys]
     }
+    import requests  # only when talking to the server, so --help stays instant
     try:
         response = requests.post(f"{SERVER_URL}/keys/upload", json=payload)
         response.raise_for_status()
@@ -22,6 +22,7 @@ def upload_keys(user_id, identity_key, signed_pre_key, signed_pre_key_sig, one_t
         sys.exit(1)
 
 def get_bundle(user_id):
+    import requests
     try:
         response = requests.get(f"{SERVER_URL}/keys/{user_id}")
         response.raise_for_status()
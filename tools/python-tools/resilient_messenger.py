@@ -4,6 +4,10 @@ import random
 import sys
 import os
 import argparse
+import logging
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 # Try to import bindings, mock if unavailable
 try:
@@ -16,9 +20,15 @@ except ImportError:
 
 DB_PATH = "messages.db"
 
+logger = logging.getLogger("resilient_messenger")
+
+class SessionNotEstablished(Exception):
+    """No session with the peer yet; call establish_session first."""
+    pass
+
 class MessageQueue:
-    def __init__(self):
-        self.conn = sqlite3.connect(DB_PATH)
+    def __init__(self, db_path=DB_PATH):
+        self.conn = sqlite3.connect(db_path)
         self.create_table()
 
     def create_table(self):
@@ -41,6 +51,16 @@ class MessageQueue:
         self.conn.commit()
         print(f"Message queued for {peer_id}")
 
+    def enqueue_many(self, items):
+        """Insert (peer_id, message) pairs in a single transaction. Returns the row ids."""
+        cursor = self.conn.cursor()
+        ids = []
+        with self.conn:
+            for peer_id, message in items:
+                cursor.execute('INSERT INTO queue (peer_id, message) VALUES (?, ?)', (peer_id, message))
+                ids.append(cursor.lastrowid)
+        return ids
+
     def get_pending(self):
         cursor = self.conn.cursor()
         # Simple exponential backoff check: now > last_attempt + 2^attempts
@@ -71,30 +91,167 @@ class MessageQueue:
         cursor.execute("UPDATE queue SET attempts = ?, last_attempt = ? WHERE id = ?", (attempts + 1, time.time(), msg_id))
         self.conn.commit()
 
+class EncryptPipeline:
+    """
+    Encrypt-at-enqueue stage for outgoing messages.
+
+    Plaintext is handed to one of `workers` single-threaded lanes. A peer always
+    maps to the same lane, so its messages are encrypted in submission order and
+    the ratchet counters match the queue order. The Rust binding releases the GIL
+    while encrypting, so lanes for different peers run in parallel.
+
+    Ciphertext is passed to a writer thread that owns its own SQLite connection
+    and commits in groups of up to `commit_batch` rows, or whatever arrived
+    within `commit_interval` seconds, instead of one transaction per message.
+    """
+
+    def __init__(self, ctx=None, db_path=DB_PATH, workers=4, commit_batch=256, commit_interval=0.05):
+        self.ctx = ctx
+        self.db_path = db_path
+        self.commit_batch = commit_batch
+        self.commit_interval = commit_interval
+
+        self._lanes = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"encrypt-{i}") for i in range(workers)]
+        self._sessions = set()
+        self._sessions_lock = threading.Lock()
+
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+        self._ready = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="queue-writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, peer_id, plaintext):
+        """Schedule one message. The returned Future resolves to its queue row id."""
+        return self.submit_many(peer_id, [plaintext])[0]
+
+    def submit_many(self, peer_id, plaintexts):
+        """Schedule several messages for one peer as a single encryption task.
+        Raises SessionNotEstablished, before anything is queued, if the peer
+        has no session."""
+        if self.ctx is not None:
+            self._ensure_session(peer_id.encode())
+        futures = [Future() for _ in plaintexts]
+        with self._pending_lock:
+            self._pending.update(futures)
+        for fut in futures:
+            fut.add_done_callback(self._discard)
+
+        lane = self._lanes[hash(peer_id) % len(self._lanes)]
+        lane.submit(self._encrypt, peer_id, list(plaintexts), futures)
+        return futures
+
+    def flush(self, timeout=None):
+        """Block until every message submitted so far has been committed (or failed)."""
+        with self._pending_lock:
+            pending = list(self._pending)
+        wait(pending, timeout=timeout)
+
+    def close(self):
+        self.flush()
+        for lane in self._lanes:
+            lane.shutdown(wait=True)
+        self._ready.put(None)
+        self._writer.join()
+
+    def _discard(self, fut):
+        with self._pending_lock:
+            self._pending.discard(fut)
+
+    def _ensure_session(self, peer_bytes):
+        # Only an established session (persisted by establish_session, possibly
+        # in an earlier run) can encrypt; a fresh create_session() has no
+        # sending chain, and would replace the established one.
+        with self._sessions_lock:
+            if peer_bytes not in self._sessions:
+                if self.ctx.load_session(peer_bytes) is None:
+                    raise SessionNotEstablished(f"no session with {peer_bytes.decode(errors='replace')}")
+                self._sessions.add(peer_bytes)
+
+    def _encrypt(self, peer_id, plaintexts, futures):
+        peer_bytes = peer_id.encode()
+        data = [p.encode() if isinstance(p, str) else p for p in plaintexts]
+        if self.ctx is not None:
+            try:
+                # One session lock and one state persist for the whole burst.
+                data = self.ctx.encrypt_batch(peer_bytes, data)
+            except Exception as e:
+                logger.warning("encryption for %s failed: %s", peer_id, e)
+                for fut in futures:
+                    fut.set_exception(e)
+                return
+        for ciphertext, fut in zip(data, futures):
+            self._ready.put((peer_id, ciphertext, fut))
+
+    def _writer_loop(self):
+        store = MessageQueue(self.db_path)
+        running = True
+        while running:
+            item = self._ready.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.commit_interval
+            while len(batch) < self.commit_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._ready.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+
+            try:
+                ids = store.enqueue_many((peer, data) for peer, data, _ in batch)
+            except Exception as e:
+                logger.warning("queue commit of %d messages failed: %s", len(batch), e)
+                for _, _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, _, fut), row_id in zip(batch, ids):
+                fut.set_result(row_id)
+
+        store.conn.close()
+
+
 class ResilientMessenger:
-    def __init__(self):
+    def __init__(self, workers=4):
         self.queue = MessageQueue()
-        if BINDINGS_AVAILABLE:
-            self.ctx = SecureContext()
+        self.ctx = SecureContext() if BINDINGS_AVAILABLE else None
+        # Without bindings the pipeline stores plaintext (simulation mode).
+        self.pipeline = EncryptPipeline(self.ctx, workers=workers)
+
+    def establish_session(self, peer_id, shared_secret, initiator):
+        """Set up the session with peer_id from a 32-byte secret the peer also
+        holds; one side is the initiator. Needed before send_message."""
+        if self.ctx is not None:
+            self.ctx.establish_session(peer_id.encode(), shared_secret, initiator)
         
     def send_message(self, peer_id, plaintext):
-        # 1. Encrypt (if possible) - In real app, we might encrypt before queuing or after.
-        # Ideally encrypt immediately to secure data at rest in queue.
-        # But for this demo we queue plaintext/blobs and simulate encryption or use it.
-        
-        # In a real signal app, we queue the ciphertext.
-        ciphertext = plaintext.encode() # Placeholder
-        if BINDINGS_AVAILABLE:
-            try:
-                # session = self.ctx.create_session(peer_id.encode())
-                # ciphertext = session.encrypt(plaintext.encode(), b"")
-                pass
-            except Exception as e:
-                print(f"Encryption failed: {e}")
-                return
+        """
+        Encrypt and queue a message without blocking the caller.
+        Returns a Future that resolves to the queue row id once the ciphertext is committed.
+        Raises SessionNotEstablished if there is no session with the peer.
+        Delivery happens in `process_queue` / `run_daemon`.
+        """
+        return self.pipeline.submit(peer_id, plaintext)
+
+    def send_messages(self, peer_id, plaintexts):
+        """Batch variant of `send_message`: one encryption task and shared commits for all messages."""
+        return self.pipeline.submit_many(peer_id, plaintexts)
 
-        self.queue.enqueue(peer_id, ciphertext)
-        self.process_queue()
+    def flush(self):
+        """Wait until all submitted messages are encrypted and persisted."""
+        self.pipeline.flush()
+
+    def close(self):
+        self.pipeline.close()
 
     def process_queue(self):
         pending = self.queue.get_pending()
@@ -137,8 +294,11 @@ if __name__ == "__main__":
     parser.add_argument("mode", choices=["send", "daemon"])
     parser.add_argument("--peer", help="Peer ID")
     parser.add_argument("--msg", help="Message content")
+    parser.add_argument("--secret", help="send: hex of a 32-byte secret shared with the peer, to establish the session")
+    parser.add_argument("--initiator", action="store_true", help="send: establish the session as the initiator")
     
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
     
     messenger = ResilientMessenger()
     
@@ -146,6 +306,15 @@ if __name__ == "__main__":
         if not args.peer or not args.msg:
             print("Error: --peer and --msg required for send")
             sys.exit(1)
-        messenger.send_message(args.peer, args.msg)
+        if args.secret:
+            messenger.establish_session(args.peer, bytes.fromhex(args.secret), args.initiator)
+        try:
+            messenger.send_message(args.peer, args.msg)
+        except SessionNotEstablished as e:
+            print(f"Error: {e}; pass --secret to establish it")
+            messenger.close()
+            sys.exit(1)
+        messenger.close()
+        messenger.process_queue()
     elif args.mode == "daemon":
         messenger.run_daemon()
@@ -1,22 +1,51 @@
 import sys
 import os
 import argparse
+import mmap
+import queue
+import threading
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../bindings/python'))
 
-from secure_protocol import SecureContext, ProtocolError
+from secure_protocol import Config, SecureContext, MESSAGE_OVERHEAD
+from secure_protocol import container
 
-def encrypt_file(input_path, output_path, peer_id_bytes):
-    ctx = SecureContext()
+MIB = 1024 * 1024
+DEFAULT_CHUNK_MIB = 4
+PIPELINE_DEPTH = 4
+
+class SessionError(Exception):
+    """No established session with the peer in the session store."""
+    pass
+
+def open_context(db_path=None):
+    return SecureContext(Config(db_path=db_path)) if db_path else SecureContext()
+
+def establish(peer_id_bytes, shared_secret, initiator, ctx=None):
+    """Store the session with the peer, derived from a 32-byte secret both
+    sides hold. The sender and the receiver of a file pass opposite roles."""
+    ctx = ctx or SecureContext()
+    ctx.establish_session(peer_id_bytes, shared_secret, initiator)
+
+def _session(peer_id_bytes, ctx=None):
+    """ctx (or the default store) with its session for the peer loaded. The
+    stored ratchet must be reused: create_session would replace it with one
+    that can neither encrypt nor decrypt."""
+    ctx = ctx or SecureContext()
+    if ctx.load_session(peer_id_bytes) is None:
+        raise SessionError(f"no session with {peer_id_bytes.decode(errors='replace')}; run 'establish' first")
+    return ctx
+
+def encrypt_file(input_path, output_path, peer_id_bytes, ctx=None):
     try:
-        session = ctx.create_session(peer_id_bytes)
-    except Exception as e:
+        ctx = _session(peer_id_bytes, ctx)
+    except (SessionError, RuntimeError) as e:
         print(f"Session error: {e}")
         return
 
     try:
         with open(input_path, 'rb') as f_in, open(output_path, 'wb') as f_out:
             while chunk := f_in.read(1024):
-                encrypted = session.encrypt(chunk)
+                encrypted = ctx.encrypt_message(peer_id_bytes, chunk)
                 # Write length prefix to handle streaming decryption
                 f_out.write(len(encrypted).to_bytes(4, 'big'))
                 f_out.write(encrypted)
@@ -24,11 +53,10 @@ def encrypt_file(input_path, output_path, peer_id_bytes):
     except Exception as e:
         print(f"Error during file transfer: {e}")
 
-def decrypt_file(input_path, output_path, peer_id_bytes):
-    ctx = SecureContext()
+def decrypt_file(input_path, output_path, peer_id_bytes, ctx=None):
     try:
-        session = ctx.create_session(peer_id_bytes)
-    except Exception as e:
+        ctx = _session(peer_id_bytes, ctx)
+    except (SessionError, RuntimeError) as e:
         print(f"Session error: {e}")
         return
 
@@ -39,36 +67,331 @@ def decrypt_file(input_path, output_path, peer_id_bytes):
                 len_bytes = f_in.read(4)
                 if not len_bytes:
                     break
-                
+
                 chunk_len = int.from_bytes(len_bytes, 'big')
                 if chunk_len == 0:
                     break
-                    
+
                 encrypted_chunk = f_in.read(chunk_len)
                 if len(encrypted_chunk) != chunk_len:
                     print("Error: Encrypted file corrupted (short read)")
                     break
-                    
-                decrypted = session.decrypt(encrypted_chunk)
+
+                decrypted = ctx.decrypt_message(peer_id_bytes, encrypted_chunk)
                 f_out.write(decrypted)
-                
+
         print(f"Decrypted {input_path} -> {output_path}")
     except Exception as e:
         print(f"Error during file decryption: {e}")
 
+# --- Streaming mode -------------------------------------------------------
+#
+# Same on-disk format as above (4-byte BE length + ratchet message per chunk),
+# but with MiB-sized chunks and three overlapping stages:
+#
+#   reader (mmap slices) -> encrypt/decrypt -> writer (calling thread)
+#
+# The ratchet requires chunks to be processed in order, so each stage is a
+# single thread; the stages are connected by bounded queues of PIPELINE_DEPTH
+# items, which also bounds memory use to a few chunks. The binding releases
+# the GIL during encryption, so disk I/O and crypto actually overlap.
+#
+# Input chunks are memoryview slices of the mmap, and encrypt_into /
+# decrypt_into write into a small pool of reusable output buffers, so no
+# per-chunk bytes objects are allocated on either side of the FFI call.
+
+_DONE = object()
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _drain(q, stop):
+    while True:
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+def _run_pipeline(source, transform, sink, depth=PIPELINE_DEPTH):
+    """Run source() -> transform(item) -> sink(item) as three overlapping stages."""
+    read_q = queue.Queue(maxsize=depth)
+    write_q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        try:
+            for item in source():
+                if not _put(read_q, item, stop):
+                    return
+            _put(read_q, _DONE, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def worker():
+        try:
+            for item in _drain(read_q, stop):
+                if not _put(write_q, transform(item), stop):
+                    return
+            _put(write_q, _DONE, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=reader, daemon=True), threading.Thread(target=worker, daemon=True)]
+    for t in threads:
+        t.start()
+    try:
+        for item in _drain(write_q, stop):
+            sink(item)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
+
+class _BufferPool:
+    """
+    Reusable output buffers. Sized to cover everything that can be in flight
+    (the write queue, one buffer in the writer and one in the worker), so
+    get() never waits on a buffer that will not come back.
+    """
+
+    def __init__(self, depth=PIPELINE_DEPTH):
+        self._free = queue.Queue()
+        for _ in range(depth + 3):
+            self._free.put(bytearray())
+
+    def get(self, size):
+        buf = self._free.get()
+        if len(buf) < size:
+            buf = bytearray(size)
+        return buf
+
+    def put(self, buf):
+        self._free.put(buf)
+
+def _write_from_pool(f_out, pool, framed):
+    def sink(item):
+        buf, length = item
+        if framed:
+            f_out.write(length.to_bytes(4, 'big'))
+        with memoryview(buf) as view:
+            f_out.write(view[:length])
+        pool.put(buf)
+    return sink
+
+def _plain_chunks(f_in, chunk_size):
+    """Yield chunk_size slices of the input, using mmap when the file supports it."""
+    size = os.fstat(f_in.fileno()).st_size
+    try:
+        mm = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+    except (ValueError, OSError):
+        mm = None
+
+    if mm is None:
+        while chunk := f_in.read(chunk_size):
+            yield chunk
+        return
+
+    # The map is not closed explicitly: slices may still be queued when the
+    # generator finishes, and it is released with the last of them.
+    view = memoryview(mm)
+    for offset in range(0, size, chunk_size):
+        yield view[offset:offset + chunk_size]
+
+def _framed_chunks(f_in):
+    """Yield the length-prefixed ciphertext records of an encrypted file."""
+    size = os.fstat(f_in.fileno()).st_size
+    if not size:
+        return
+    view = memoryview(mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ))
+    offset = 0
+    while offset + 4 <= size:
+        chunk_len = int.from_bytes(view[offset:offset + 4], 'big')
+        if chunk_len == 0:
+            break
+        offset += 4
+        if offset + chunk_len > size:
+            raise ValueError("Encrypted file corrupted (short read)")
+        yield view[offset:offset + chunk_len]
+        offset += chunk_len
+
+def encrypt_file_stream(input_path, output_path, peer_id_bytes, chunk_size=DEFAULT_CHUNK_MIB * MIB, ctx=None):
+    """Encrypt a file in chunk_size pieces with reading, encryption and writing overlapped."""
+    ctx = _session(peer_id_bytes, ctx)
+
+    pool = _BufferPool()
+
+    def encrypt(chunk):
+        out = pool.get(len(chunk) + MESSAGE_OVERHEAD)
+        return out, ctx.encrypt_into(peer_id_bytes, chunk, out)
+
+    with open(input_path, 'rb') as f_in, open(output_path, 'wb') as f_out:
+        _run_pipeline(
+            lambda: _plain_chunks(f_in, chunk_size),
+            encrypt,
+            _write_from_pool(f_out, pool, framed=True),
+        )
+
+def decrypt_file_stream(input_path, output_path, peer_id_bytes, ctx=None):
+    """Decrypt a file written by encrypt_file or encrypt_file_stream (any chunk size)."""
+    ctx = _session(peer_id_bytes, ctx)
+
+    pool = _BufferPool()
+
+    def decrypt(chunk):
+        out = pool.get(max(len(chunk) - MESSAGE_OVERHEAD, 0))
+        return out, ctx.decrypt_into(peer_id_bytes, chunk, out)
+
+    with open(input_path, 'rb') as f_in, open(output_path, 'wb') as f_out:
+        _run_pipeline(
+            lambda: _framed_chunks(f_in),
+            decrypt,
+            _write_from_pool(f_out, pool, framed=False),
+        )
+
+# --- Container mode -------------------------------------------------------
+#
+# Seekable container (see secure_protocol.container): a random per-file key
+# seals fixed-size chunks independently, and the key is wrapped with the
+# ratchet session in the header. While packing, the raw file key is kept in
+# "<output>.partkey" (mode 0600) so an interrupted pack can be resumed; it is
+# removed once the container is complete.
+#
+# The wrapped key is a ratchet message, so like any other message the
+# receiver's session opens it once: unpack, extract or verify a received
+# container in one of them, not all three.
+
+def _partkey_path(output_path):
+    return output_path + ".partkey"
+
+def _unwrapper(peer_id_bytes, ctx=None):
+    ctx = _session(peer_id_bytes, ctx)
+    return lambda wrapped: ctx.decrypt_message(peer_id_bytes, wrapped)
+
+def pack_file(input_path, output_path, peer_id_bytes, chunk_size=DEFAULT_CHUNK_MIB * MIB, resume=False, ctx=None):
+    partkey = _partkey_path(output_path)
+    if resume:
+        with open(partkey, 'rb') as f:
+            key = f.read()
+        container.resume_pack_file(input_path, output_path, key)
+    else:
+        ctx = _session(peer_id_bytes, ctx)
+        key = container.new_file_key()
+        wrapped = ctx.encrypt_message(peer_id_bytes, key)
+        fd = os.open(partkey, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+        container.pack_file(input_path, output_path, key, wrapped, chunk_size)
+    os.remove(partkey)
+
+def unpack_file(input_path, output_path, peer_id_bytes, workers=None, ctx=None):
+    container.unpack_file(input_path, output_path, unwrap=_unwrapper(peer_id_bytes, ctx), workers=workers)
+
+def extract_range(input_path, output_path, peer_id_bytes, offset, length, ctx=None):
+    with container.ContainerReader(input_path, unwrap=_unwrapper(peer_id_bytes, ctx)) as reader, open(output_path, 'wb') as f_out:
+        f_out.write(reader.read_range(offset, length))
+
+def verify_container(input_path, peer_id_bytes, workers=None, ctx=None):
+    with container.ContainerReader(input_path, unwrap=_unwrapper(peer_id_bytes, ctx)) as reader:
+        bad = reader.verify(workers)
+        state = "complete" if reader.complete else "incomplete"
+        print(f"{input_path}: {reader.chunk_count} chunks, {reader.plaintext_size} bytes, {state}")
+        for index in bad:
+            print(f"  chunk {index}: authentication failed")
+        return not bad and reader.complete
+
 def main():
     parser = argparse.ArgumentParser(description="Secure File Transfer")
-    parser.add_argument("mode", choices=["encrypt", "decrypt"])
-    parser.add_argument("input", help="Input file")
-    parser.add_argument("output", help="Output file")
+    parser.add_argument("mode", choices=["establish", "encrypt", "decrypt", "pack", "unpack", "extract", "verify"],
+                        help="establish: set up the session with --peer; encrypt/decrypt: chunk stream; "
+                             "pack/unpack/extract/verify: seekable container")
+    parser.add_argument("input", nargs="?", help="Input file")
+    parser.add_argument("output", nargs="?", help="Output file (not used by verify)")
     parser.add_argument("--peer", default="default_peer", help="Peer ID")
-    
+    parser.add_argument("--db", help="Session store directory (default: the library's)")
+    parser.add_argument("--secret", help="establish: hex of the 32-byte secret shared with the peer")
+    parser.add_argument("--initiator", action="store_true",
+                        help="establish: take the initiator role (the peer must not)")
+    parser.add_argument("--stream", action="store_true", help="Use large chunks and a pipelined reader/encryptor/writer")
+    parser.add_argument("--chunk-size", type=float, default=DEFAULT_CHUNK_MIB, help="Chunk size in MiB for --stream and pack (default: %(default)s)")
+    parser.add_argument("--resume", action="store_true", help="pack: continue an interrupted container")
+    parser.add_argument("--offset", type=int, default=0, help="extract: plaintext start offset")
+    parser.add_argument("--length", type=int, help="extract: number of bytes (default: to end)")
+    parser.add_argument("--workers", type=int, help="unpack/verify: parallel chunk workers (default: CPU count)")
+
     args = parser.parse_args()
-    
-    if args.mode == "encrypt":
-        encrypt_file(args.input, args.output, args.peer.encode())
+    peer = args.peer.encode()
+    chunk_size = max(1, int(args.chunk_size * MIB))
+
+    if args.mode == "establish":
+        if not args.secret:
+            parser.error("establish requires --secret")
+        try:
+            establish(peer, bytes.fromhex(args.secret), args.initiator, open_context(args.db))
+        except (ValueError, RuntimeError) as e:
+            print(f"Session error: {e}")
+            sys.exit(1)
+        print(f"Established session with {args.peer}")
+        return
+    if args.input is None:
+        parser.error(f"{args.mode} requires an input file")
+    if args.output is None and args.mode != "verify":
+        parser.error(f"{args.mode} requires an output file")
+    ctx = open_context(args.db)
+
+    if args.mode in ("pack", "unpack", "extract", "verify"):
+        try:
+            if args.mode == "pack":
+                pack_file(args.input, args.output, peer, chunk_size, resume=args.resume, ctx=ctx)
+                print(f"Packed {args.input} -> {args.output}")
+            elif args.mode == "unpack":
+                unpack_file(args.input, args.output, peer, args.workers, ctx)
+                print(f"Unpacked {args.input} -> {args.output}")
+            elif args.mode == "extract":
+                length = args.length if args.length is not None else 2 ** 63
+                extract_range(args.input, args.output, peer, args.offset, length, ctx)
+                print(f"Extracted range from {args.input} -> {args.output}")
+            elif not verify_container(args.input, peer, args.workers, ctx):
+                sys.exit(1)
+        except (OSError, container.ContainerError) as e:
+            print(f"Container error: {e}")
+            sys.exit(1)
+        except (SessionError, RuntimeError) as e:
+            # RuntimeError: the binding failed to wrap or unwrap the file key
+            print(f"Session error: {e}")
+            sys.exit(1)
+    elif args.stream:
+        try:
+            if args.mode == "encrypt":
+                encrypt_file_stream(args.input, args.output, peer, chunk_size, ctx)
+                print(f"Encrypted {args.input} -> {args.output}")
+            else:
+                decrypt_file_stream(args.input, args.output, peer, ctx)
+                print(f"Decrypted {args.input} -> {args.output}")
+        except Exception as e:
+            print(f"Error during streaming transfer: {e}")
+            sys.exit(1)
+    elif args.mode == "encrypt":
+        encrypt_file(args.input, args.output, peer, ctx)
     else:
-        decrypt_file(args.input, args.output, args.peer.encode())
+        decrypt_file(args.input, args.output, peer, ctx)
 
 if __name__ == "__main__":
     main()
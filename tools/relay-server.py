@@ -1,114 +1,1210 @@
+import argparse
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import select
 import socket
 import threading
 import struct
 import sys
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# In-memory storage: { public_key_bytes : [ (sender_key, message_bytes), ... ] }
+# Commands
+CMD_REGISTER = 1
+CMD_SEND = 2
+CMD_FETCH = 3
+CMD_SEND_MULTI = 4
+CMD_STATS = 5
+CMD_PING = 6
+
+# Cluster commands, accepted only on a link opened with PEER_HELLO
+CMD_PEER_HELLO = 0x10
+CMD_FORWARD = 0x11
+CMD_FETCH_FOR = 0x12
+CMD_REGISTER_FOR = 0x13
+CMD_RING = 0x14
+PEER_COMMANDS = {CMD_FORWARD, CMD_FETCH_FOR, CMD_REGISTER_FOR, CMD_RING}
+COMMAND_NAMES = {
+    CMD_REGISTER: "register", CMD_SEND: "send", CMD_FETCH: "fetch", CMD_SEND_MULTI: "send_multi",
+    CMD_STATS: "stats", CMD_PING: "ping", CMD_PEER_HELLO: "peer_hello", CMD_FORWARD: "forward",
+    CMD_FETCH_FOR: "fetch_for", CMD_REGISTER_FOR: "register_for", CMD_RING: "ring",
+}
+
+# Response status bytes
+OK = b'\x00'
+REJECTED = b'\xFD'   # Recipient unknown or over quota
+TOO_LARGE = b'\xFE'  # Frame above max_frame; the connection is closed
+ERROR = b'\xFF'
+
+
+class RelayConfig:
+    """Limits, overridable from the command line (see main)."""
+    max_frame = 1024 * 1024               # Largest message blob (bytes)
+    mailbox_max_bytes = 64 * 1024 * 1024  # Per-recipient queued bytes
+    mailbox_max_messages = 10_000         # Per-recipient queued messages
+    message_ttl = 7 * 24 * 3600           # Seconds a message waits for its recipient
+    mailbox_idle = 7 * 24 * 3600          # Seconds an empty mailbox outlives its key's last visit
+    max_mailboxes = 1_000_000             # Mailboxes on this node (0: no cap)
+    reap_interval = 1.0                   # Seconds between reaper passes
+    reap_batch = 1000                     # Mailboxes expired per lock hold
+    expiry_granularity = 60               # Width of an expiry bucket (seconds)
+    arena_segment = 1024 * 1024           # Payload arena segment size (bytes)
+    vnodes = 64                           # Hash ring points per cluster node
+    peer_timeout = 10.0                   # Seconds before a peer link call fails
+    forward_ids = 65_536                  # FORWARD message ids remembered for deduplication
+    idle_timeout = 300.0                  # Seconds a connection may stay silent
+    max_connections = 10_000              # Open connections, all clients (0: no cap)
+    max_connections_per_ip = 256          # Open connections from one address (0: no cap)
+    backlog = socket.SOMAXCONN            # Accept queue length
+
+
+CONFIG = RelayConfig()
+
+
+class Arena:
+    """
+    Message payloads packed into large preallocated bytearray segments.
+
+    A segment is dropped once no stored message refers to it. Segments are
+    never resized or reused, so a memoryview from view() stays valid after
+    MAILBOX_LOCK is released.
+    """
+
+    def __init__(self, segment_size):
+        self.segment_size = segment_size
+        self.segments = {}  # id -> bytearray
+        self.used = {}      # id -> bytes written
+        self.refs = {}      # id -> messages stored in the segment
+        self.live = {}      # id -> bytes of those messages
+        self.tail = -1      # Segment taking new payloads
+        self.next_id = 0
+
+    def _new_segment(self, size):
+        seg = self.next_id
+        self.next_id += 1
+        self.segments[seg] = bytearray(size)
+        self.used[seg] = 0
+        self.refs[seg] = 0
+        self.live[seg] = 0
+        return seg
+
+    def put(self, payload):
+        """Copy payload into the arena. Returns (segment, offset)."""
+        size = len(payload)
+        if size > self.segment_size:
+            # Oversized payloads get a segment of their own
+            seg = self._new_segment(size)
+        else:
+            seg = self.tail
+            if seg < 0 or self.used[seg] + size > self.segment_size:
+                seg = self.tail = self._new_segment(self.segment_size)
+        off = self.used[seg]
+        self.segments[seg][off:off + size] = payload
+        self.used[seg] = off + size
+        self.refs[seg] += 1
+        self.live[seg] += size
+        return seg, off
+
+    def view(self, seg, off, size):
+        return memoryview(self.segments[seg])[off:off + size]
+
+    def release(self, seg, size):
+        """Forget one payload; frees its segment once it was the last."""
+        self.live[seg] -= size
+        self.refs[seg] -= 1
+        if self.refs[seg] == 0:
+            for table in (self.segments, self.used, self.refs, self.live):
+                del table[seg]
+            if seg == self.tail:
+                self.tail = -1
+
+    def move(self, seg, off, size):
+        """Copy a payload out of seg into the tail. Returns its new (segment, offset)."""
+        dest = self.put(self.view(seg, off, size))
+        self.release(seg, size)
+        return dest
+
+    def sparse_segments(self):
+        """Segments under a quarter live, worth compacting once together they
+        hold at least a segment's worth of dead bytes."""
+        sparse = {seg for seg in self.segments if seg != self.tail and self.live[seg] * 4 < self.used[seg]}
+        dead = sum(self.used[seg] - self.live[seg] for seg in sparse)
+        return sparse if dead >= self.segment_size else set()
+
+    def stats(self):
+        return {
+            "arena_segments": len(self.segments),
+            "arena_bytes": sum(len(s) for s in self.segments.values()),
+            "arena_live_bytes": sum(self.live.values()),
+        }
+
+
+class MessageTable:
+    """
+    Stored messages as parallel arrays indexed by message id. A message sent
+    to several recipients (SEND_MULTI) has one row, referenced from each
+    mailbox and freed, with its payload, when the last reference goes.
+    Ids of freed rows are reused.
+    """
+
+    def __init__(self):
+        self.senders = array('I')   # Interned sender id
+        self.segments = array('I')  # Arena segment
+        self.offsets = array('I')   # Offset in the segment
+        self.lengths = array('I')   # Payload length
+        self.expires = array('d')   # time.monotonic() deadline
+        self.refs = array('I')      # Mailboxes still holding the message (0 = free row)
+        self.free = array('I')
+
+    def __len__(self):
+        return len(self.refs)
+
+    def add(self, sender, seg, off, size, expires, refs):
+        if self.free:
+            mid = self.free.pop()
+            self.senders[mid] = sender
+            self.segments[mid] = seg
+            self.offsets[mid] = off
+            self.lengths[mid] = size
+            self.expires[mid] = expires
+            self.refs[mid] = refs
+            return mid
+        self.senders.append(sender)
+        self.segments.append(seg)
+        self.offsets.append(off)
+        self.lengths.append(size)
+        self.expires.append(expires)
+        self.refs.append(refs)
+        return len(self.refs) - 1
+
+    def release(self, mid, arena):
+        """Drop one mailbox's reference to message mid."""
+        self.refs[mid] -= 1
+        if self.refs[mid] == 0:
+            arena.release(self.segments[mid], self.lengths[mid])
+            self.free.append(mid)
+
+
+class Mailbox:
+    """One recipient's queue of message ids, oldest first; ids before `head`
+    are gone. The TTL is the same for every message, so the queue is also in
+    expiry order. `seen` is when the key last registered, fetched or
+    disconnected."""
+    __slots__ = ("head", "ids", "bytes", "seen")
+
+    def __init__(self):
+        self.head = 0
+        self.ids = array('I')
+        self.bytes = 0
+        self.seen = time.monotonic()
+
+    def __len__(self):
+        return len(self.ids) - self.head
+
+    def trim(self):
+        """Reclaim the space of ids before head once they are the majority."""
+        if self.head > 64 and self.head * 2 > len(self.ids):
+            del self.ids[:self.head]
+            self.head = 0
+
+
+log = logging.getLogger("relay")
+
+
+class ShortKey:
+    """Key abbreviated for the log, formatted only if the record is emitted."""
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __str__(self):
+        return self.key.hex()[:8]
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """Queue records as they are; the listener thread formats and writes
+    them, so a connection thread never waits on stdout."""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level):
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(threadName)s %(message)s"))
+    listener = logging.handlers.QueueListener(records, output)
+    log.addHandler(AsyncLogHandler(records))
+    log.setLevel(level)
+    log.propagate = False
+    listener.start()
+    return listener
+
+
+# Upper bounds of the latency (seconds) and mailbox depth histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is +Inf
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def move(self, old, new):
+        """Re-file one observation whose value changed, for a histogram of
+        current values (such as mailbox depth) kept up to date in place."""
+        self.counts[bisect.bisect_left(self.bounds, old)] -= 1
+        self.counts[bisect.bisect_left(self.bounds, new)] += 1
+        self.total += new - old
+
+    def forget(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] -= 1
+        self.total -= value
+
+    def render(self, name, labels=""):
+        """Prometheus text lines: cumulative buckets, sum and count."""
+        prefix = labels + "," if labels else ""
+        suffix = f"{{{labels}}}" if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{suffix} {self.total}")
+        lines.append(f"{name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """Per-command counts and latency, and bytes on client connections."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {name: Histogram(LATENCY_BUCKETS) for name in COMMAND_NAMES.values()}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def observe(self, cmd, seconds, received, sent):
+        with self.lock:
+            self.latency[COMMAND_NAMES[cmd]].observe(seconds)
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+    def render(self):
+        """Everything in the Prometheus text exposition format."""
+        with MAILBOX_LOCK:
+            depth = DEPTH.render("relay_mailbox_depth")
+        snapshot = stats_snapshot()
+        lines = []
+        with self.lock:
+            lines.append("# TYPE relay_command_duration_seconds histogram")
+            for name, histogram in self.latency.items():
+                lines += histogram.render("relay_command_duration_seconds", f'command="{name}"')
+            lines.append("# TYPE relay_bytes_received_total counter")
+            lines.append(f"relay_bytes_received_total {self.bytes_received}")
+            lines.append("# TYPE relay_bytes_sent_total counter")
+            lines.append(f"relay_bytes_sent_total {self.bytes_sent}")
+        lines.append("# TYPE relay_mailbox_depth histogram")
+        lines += depth
+        for key, value in snapshot.items():
+            if isinstance(value, (int, float)):
+                lines.append(f"relay_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MeteredSocket:
+    """Client connection that counts the bytes of the current command."""
+    __slots__ = ("sock", "received", "sent")
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = 0
+        self.sent = 0
+
+    def recv(self, n):
+        data = self.sock.recv(n)
+        self.received += len(data)
+        return data
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+        self.sent += len(data)
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def close(self):
+        self.sock.close()
+
+
+class AdminHandler(BaseHTTPRequestHandler):
+    """GET /metrics (Prometheus text) and /stats (the STATS JSON)."""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = METRICS.render().encode(), "text/plain; version=0.0.4"
+        elif self.path == "/stats":
+            body, content_type = json.dumps(stats_snapshot()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("admin_request client=%s " + format, self.client_address[0], *args)
+
+
+METRICS = Metrics()
+
+
+def ring_hash(data):
+    return int.from_bytes(hashlib.sha256(data).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of recipient keys onto node ids. Each node has
+    `vnodes` points on the ring, so adding or removing one of N nodes moves
+    about 1/N of the keys."""
+
+    def __init__(self, nodes, vnodes):
+        points = sorted((ring_hash(f"{node}#{i}".encode()), node) for node in nodes for i in range(vnodes))
+        self.points = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def owner(self, key):
+        i = bisect.bisect(self.points, ring_hash(key))
+        return self.owners[i % len(self.owners)]
+
+
+class PeerLink:
+    """Persistent connections to one peer node, pooled so concurrent
+    forwards do not queue behind each other."""
+
+    def __init__(self, node_id, address):
+        self.node_id = node_id
+        self.address = address
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=CONFIG.peer_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        name = CLUSTER.node_id.encode()
+        sock.sendall(bytes([CMD_PEER_HELLO, len(name)]) + name + bytes([len(CLUSTER.secret)]) + CLUSTER.secret)
+        if recv_exact(sock, 1) != OK:
+            sock.close()
+            raise ConnectionError(f"peer {self.node_id} refused the link")
+        return sock
+
+    def _exchange(self, sock, frame, read_response):
+        try:
+            sock.sendall(frame)
+            return read_response(sock)
+        except OSError:
+            sock.close()
+            raise
+
+    def _take_idle(self):
+        """An idle connection the peer has not closed meanwhile, or None."""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                sock = self.idle.pop()
+            # A pooled connection has nothing to read: readable means EOF or reset.
+            if not select.select([sock], [], [], 0)[0]:
+                return sock
+            sock.close()
+
+    def call(self, frame, read_response, retry=False):
+        """Send frame and read its response on an idle connection, or a new
+        one. A request that fails on a pooled connection (peer restarted
+        between the staleness check and the send) is retried once on a new
+        one only if retry is set: the peer may have acted on it already."""
+        sock = self._take_idle()
+        if sock is None:
+            sock = self._connect()
+            result = self._exchange(sock, frame, read_response)
+        else:
+            try:
+                result = self._exchange(sock, frame, read_response)
+            except OSError:
+                if not retry:
+                    raise
+                sock = self._connect()
+                result = self._exchange(sock, frame, read_response)
+        with self.lock:
+            self.idle.append(sock)
+        return result
+
+    def forward(self, sender, recipients, msg):
+        """Queue msg on the peer; returns how many recipients accepted it.
+        The frame carries a fresh message id, so the peer stores a retried
+        forward only once."""
+        frame = b''.join((bytes([CMD_FORWARD]), os.urandom(16), sender, struct.pack('>H', len(recipients)),
+                          *recipients, struct.pack('>I', len(msg)), msg))
+        return self.call(frame, lambda sock: struct.unpack('>H', recv_exact(sock, 2))[0], retry=True)
+
+    def fetch_for(self, recipient):
+        # Not retried: the owner may have drained the mailbox already.
+        return self.call(bytes([CMD_FETCH_FOR]) + recipient, read_fetch_response)
+
+    def register_for(self, recipient):
+        reply = self.call(bytes([CMD_REGISTER_FOR]) + recipient, lambda sock: recv_exact(sock, 1), retry=True)
+        return reply == OK
+
+
+class Cluster:
+    """This node's view of the relay cluster: which node owns each recipient
+    key, and links to the others. Without peers this node owns every key."""
+
+    def __init__(self, node_id, nodes=None, secret=b""):
+        self.node_id = node_id
+        self.secret = secret
+        self.links = {}
+        self.set_nodes(nodes or {node_id: None})
+
+    def set_nodes(self, nodes):
+        """nodes: {node_id: (host, port)} of every member. A node left out of
+        its own membership owns nothing and only routes (see rebalance)."""
+        links = dict(self.links)
+        for node, address in nodes.items():
+            if node != self.node_id and (node not in links or links[node].address != address):
+                links[node] = PeerLink(node, address)
+        # Links to departed nodes are kept: a request routed just before the
+        # change may still need one.
+        self.links = links
+        self.ring = HashRing(list(nodes), CONFIG.vnodes)
+        self.nodes = sorted(nodes)
+        self.single = self.nodes == [self.node_id]
+
+    def owner(self, key):
+        return self.node_id if self.single else self.ring.owner(key)
+
+    def partition(self, recipients):
+        """Group recipients by owning node."""
+        by_node = {}
+        for recipient in recipients:
+            by_node.setdefault(self.owner(recipient), []).append(recipient)
+        return by_node
+
+
+CLUSTER = Cluster("relay")
+
+# In-memory storage: { public_key_bytes : Mailbox }, one per registered key.
+# Mailboxes hold 4-byte message ids; senders, lengths and expiry live once per
+# message in MESSAGES and payload bytes in ARENA. SEND_MULTI stores one message
+# for all its recipients; quotas and stored_bytes still charge it to each.
 MAILBOX = {}
 MAILBOX_LOCK = threading.Lock()
+MESSAGES = MessageTable()
+ARENA = Arena(CONFIG.arena_segment)
+
+# Interned sender keys: messages store a 4-byte id instead of the 32-byte key
+SENDER_IDS = {}
+SENDER_KEYS = []
+
+# FORWARD message ids already stored: { msg_id : stored count }, oldest first.
+# A peer retrying a FORWARD gets the first answer back instead of a duplicate.
+RECENT_FORWARDS = {}
+
+# Expiry wheel: { bucket : set(recipient) } with bucket = expires_at // expiry_granularity.
+# The reaper only visits recipients whose bucket has passed, a batch at a time:
+# to expire their messages, and to retire their mailbox once empty and idle.
+EXPIRY = {}
+
+# Queued messages per mailbox, updated as mailboxes change so /metrics never
+# walks MAILBOX (MAILBOX_LOCK held)
+DEPTH = Histogram(DEPTH_BUCKETS)
+
+# Counters and the stored_* gauges, updated under MAILBOX_LOCK
+STATS = {
+    "stored_messages": 0,
+    "stored_bytes": 0,
+    "accepted": 0,
+    "delivered": 0,
+    "expired": 0,
+    "retired_mailboxes": 0,
+    "rejected_unknown": 0,
+    "rejected_quota": 0,
+    "rejected_mailboxes": 0,
+    "rejected_too_large": 0,
+    "compactions": 0,
+    "forwarded": 0,
+    "forward_errors": 0,
+    "duplicate_forwards": 0,
+    "proxied_fetches": 0,
+    "rebalanced_messages": 0,
+    "connections_accepted": 0,
+    "connections_rejected": 0,
+    "connections_closed": 0,
+    "idle_timeouts": 0,
+    "pings": 0,
+    "open_connections": 0,
+    "peak_connections": 0,
+}
 
 # Registered clients map (optional, for online status check)
 ONLINE_CLIENTS = {}
+# Open connections per client address, for the connection caps
+CONNECTIONS = {}
+
+def intern_sender_locked(key):
+    sender = SENDER_IDS.get(key)
+    if sender is None:
+        sender = SENDER_IDS[key] = len(SENDER_KEYS)
+        SENDER_KEYS.append(key)
+    return sender
+
+def add_stat(name, n=1):
+    with MAILBOX_LOCK:
+        STATS[name] += n
+
+def register(pub_key, conn=None):
+    """Make sure pub_key's owner has a mailbox for it and mark it online here.
+    False if the owner is at its mailbox cap."""
+    node = CLUSTER.owner(pub_key)
+    if node == CLUSTER.node_id:
+        registered = open_mailbox(pub_key)
+    else:
+        registered = CLUSTER.links[node].register_for(pub_key)
+    if registered and conn is not None:
+        with MAILBOX_LOCK:
+            ONLINE_CLIENTS[pub_key] = conn
+    return registered
+
+def open_mailbox(key):
+    """Create key's mailbox here, or mark an existing one seen. False if the
+    node is at max_mailboxes."""
+    now = time.monotonic()
+    with MAILBOX_LOCK:
+        box = MAILBOX.get(key)
+        if box is None:
+            if CONFIG.max_mailboxes and len(MAILBOX) >= CONFIG.max_mailboxes:
+                STATS["rejected_mailboxes"] += 1
+                return False
+            box = MAILBOX[key] = Mailbox()
+            DEPTH.observe(0)
+        box.seen = now
+        schedule_retire_locked(key, box)
+    return True
+
+def schedule_retire_locked(key, box):
+    """Have the reaper look at key when its mailbox could next be retired
+    (MAILBOX_LOCK held)."""
+    due = box.seen + CONFIG.mailbox_idle
+    EXPIRY.setdefault(int(due // CONFIG.expiry_granularity), set()).add(key)
+
+def retire_locked(key, box, now):
+    """Forget key's mailbox if it is empty, key is not connected here and it
+    has not been seen for mailbox_idle; a later visit is scheduled if only
+    the idle time is short (MAILBOX_LOCK held). A mailbox with messages is
+    visited again when they expire, a connected key when it disconnects."""
+    if len(box) or key in ONLINE_CLIENTS:
+        return
+    if box.seen + CONFIG.mailbox_idle <= now:
+        del MAILBOX[key]
+        DEPTH.forget(0)
+        STATS["retired_mailboxes"] += 1
+    else:
+        schedule_retire_locked(key, box)
+
+def admit_locked(recipient, size):
+    """Recipient's mailbox if it may take size more bytes, else None (MAILBOX_LOCK held)."""
+    box = MAILBOX.get(recipient)
+    if box is None:
+        STATS["rejected_unknown"] += 1
+        return None
+    if len(box) >= CONFIG.mailbox_max_messages or box.bytes + size > CONFIG.mailbox_max_bytes:
+        STATS["rejected_quota"] += 1
+        return None
+    return box
+
+def enqueue(sender_key, recipients, msg, msg_id=None):
+    """Queue msg for each recipient (unique keys). Returns how many accepted it.
+    A message forwarded under a msg_id already seen is not stored again; the
+    count returned the first time is."""
+    expires = time.monotonic() + CONFIG.message_ttl
+    with MAILBOX_LOCK:
+        if msg_id in RECENT_FORWARDS:
+            STATS["duplicate_forwards"] += 1
+            return RECENT_FORWARDS[msg_id]
+        stored = enqueue_locked(sender_key, recipients, msg, expires)
+        if msg_id is not None:
+            RECENT_FORWARDS[msg_id] = stored
+            if len(RECENT_FORWARDS) > CONFIG.forward_ids:
+                del RECENT_FORWARDS[next(iter(RECENT_FORWARDS))]
+    return stored
+
+def enqueue_locked(sender_key, recipients, msg, expires):
+    """enqueue with MAILBOX_LOCK held."""
+    size = len(msg)
+    admitted = []
+    for recipient in recipients:
+        box = admit_locked(recipient, size)
+        if box is not None:
+            admitted.append((recipient, box))
+    if not admitted:
+        return 0
+    sender = intern_sender_locked(sender_key)
+    seg, off = ARENA.put(msg)
+    mid = MESSAGES.add(sender, seg, off, size, expires, len(admitted))
+    due = EXPIRY.setdefault(int(expires // CONFIG.expiry_granularity), set())
+    for recipient, box in admitted:
+        DEPTH.move(len(box), len(box) + 1)
+        box.ids.append(mid)
+        box.bytes += size
+        due.add(recipient)
+    STATS["accepted"] += len(admitted)
+    STATS["stored_messages"] += len(admitted)
+    STATS["stored_bytes"] += size * len(admitted)
+    return len(admitted)
+
+def drop_locked(box, start, end):
+    """Release ids start..end of box (MAILBOX_LOCK held). The caller then
+    moves box.head past them."""
+    DEPTH.move(len(box), len(box) - (end - start))
+    ids, lengths = box.ids, MESSAGES.lengths
+    released = 0
+    for i in range(start, end):
+        mid = ids[i]
+        released += lengths[mid]
+        MESSAGES.release(mid, ARENA)
+    box.bytes -= released
+    STATS["stored_messages"] -= end - start
+    STATS["stored_bytes"] -= released
+
+def expire_locked(box, now):
+    """Drop expired messages from the head of box (MAILBOX_LOCK held)."""
+    ids, expires = box.ids, MESSAGES.expires
+    end = box.head
+    while end < len(ids) and expires[ids[end]] <= now:
+        end += 1
+    if end > box.head:
+        drop_locked(box, box.head, end)
+        STATS["expired"] += end - box.head
+        box.head = end
+        box.trim()
+
+def take_locked(box):
+    """Remove and return box's unexpired messages as (sender_key, payload view)
+    pairs (MAILBOX_LOCK held). The views stay valid after the lock is released."""
+    expire_locked(box, time.monotonic())
+    messages = []
+    for i in range(box.head, len(box.ids)):
+        mid = box.ids[i]
+        messages.append((SENDER_KEYS[MESSAGES.senders[mid]],
+                         ARENA.view(MESSAGES.segments[mid], MESSAGES.offsets[mid], MESSAGES.lengths[mid])))
+    drop_locked(box, box.head, len(box.ids))
+    box.ids = array('I')
+    box.head = 0
+    return messages
+
+def drain(recipient):
+    """Take every queued message for recipient as the FETCH response parts."""
+    with MAILBOX_LOCK:
+        box = MAILBOX.get(recipient)
+        messages = []
+        if box is not None:
+            messages = take_locked(box)
+            box.seen = time.monotonic()
+        STATS["delivered"] += len(messages)
+    # Count (4), then per message Sender (32) + Len (4) + Payload
+    parts = [struct.pack('>I', len(messages))]
+    for sender, payload in messages:
+        parts += (sender, struct.pack('>I', len(payload)), payload)
+    return len(messages), parts
+
+def read_fetch_response(sock):
+    """Read a FETCH response off a peer link as (count, parts)."""
+    header = recv_exact(sock, 4)
+    count = struct.unpack('>I', header)[0]
+    parts = [header]
+    for _ in range(count):
+        meta = recv_exact(sock, 36)
+        parts += (meta, recv_exact(sock, struct.unpack_from('>I', meta, 32)[0]))
+    return count, parts
+
+def deliver(sender_key, recipients, msg):
+    """Queue msg for each recipient (unique keys) on the node that owns it.
+    Returns how many accepted it; recipients on an unreachable node did not."""
+    stored = 0
+    for node, keys in CLUSTER.partition(recipients).items():
+        if node == CLUSTER.node_id:
+            stored += enqueue(sender_key, keys, msg)
+            continue
+        try:
+            stored += CLUSTER.links[node].forward(sender_key, keys, msg)
+            add_stat("forwarded", len(keys))
+        except OSError as e:
+            add_stat("forward_errors", len(keys))
+            log.warning("forward_failed node=%s recipients=%d error=%s", node, len(keys), e)
+    return stored
+
+def fetch(recipient):
+    """FETCH for recipient, proxied to the owning node if that is not us."""
+    node = CLUSTER.owner(recipient)
+    if node == CLUSTER.node_id:
+        return drain(recipient)
+    add_stat("proxied_fetches")
+    return CLUSTER.links[node].fetch_for(recipient)
+
+def rebalance():
+    """Hand every mailbox this node no longer owns (after a ring change) to
+    its owner, messages in order. A message leaves this node only once the
+    owner has stored it; whatever the owner rejects or cannot be sent stays
+    here until the next rebalance."""
+    with MAILBOX_LOCK:
+        moving = [key for key in MAILBOX if CLUSTER.owner(key) != CLUSTER.node_id]
+    moved = {"mailboxes": 0, "messages": 0, "kept": 0, "errors": 0}
+    for recipient in moving:
+        link = CLUSTER.links[CLUSTER.owner(recipient)]
+        try:
+            link.register_for(recipient)
+            sent, kept = hand_off(recipient, link)
+        except OSError as e:
+            log.warning("rebalance_failed recipient=%s node=%s error=%s", ShortKey(recipient), link.node_id, e)
+            moved["errors"] += 1
+            continue
+        moved["messages"] += sent
+        if kept:
+            log.warning("rebalance_rejected recipient=%s node=%s kept=%d", ShortKey(recipient), link.node_id, kept)
+            moved["kept"] += kept
+        else:
+            moved["mailboxes"] += 1
+    add_stat("rebalanced_messages", moved["messages"])
+    return moved
+
+def hand_off(recipient, link):
+    """Forward recipient's mailbox to link oldest first, dropping each message
+    once the owner reports it stored. Stops at the first message the owner
+    rejects; an OSError leaves the unsent messages here. Deletes the emptied
+    mailbox. Returns (forwarded, kept) message counts."""
+    sent = 0
+    while True:
+        with MAILBOX_LOCK:
+            box = MAILBOX.get(recipient)
+            if box is None:
+                return sent, 0
+            expire_locked(box, time.monotonic())
+            if not len(box):
+                del MAILBOX[recipient]
+                DEPTH.forget(0)
+                return sent, 0
+            mid = box.ids[box.head]
+            expires = MESSAGES.expires[mid]
+            sender = SENDER_KEYS[MESSAGES.senders[mid]]
+            payload = ARENA.view(MESSAGES.segments[mid], MESSAGES.offsets[mid], MESSAGES.lengths[mid])
+        if not link.forward(sender, [recipient], payload):
+            with MAILBOX_LOCK:
+                return sent, len(box)
+        with MAILBOX_LOCK:
+            # A FETCH may have taken the message meanwhile; drop it only if it is still here.
+            if len(box) and box.ids[box.head] == mid and MESSAGES.expires[mid] == expires:
+                drop_locked(box, box.head, box.head + 1)
+                box.head += 1
+                box.trim()
+        sent += 1
+
+def reaper():
+    """Free expired messages in the background, a batch of mailboxes per lock
+    hold, so senders and fetchers never wait behind a full sweep. Then compact
+    the arena if drains have left segments mostly empty."""
+    cursor = int(time.monotonic() // CONFIG.expiry_granularity)
+    while True:
+        time.sleep(CONFIG.reap_interval)
+        now = time.monotonic()
+        # Buckets strictly before the current one are fully expired.
+        current = int(now // CONFIG.expiry_granularity)
+        while cursor < current:
+            with MAILBOX_LOCK:
+                due = list(EXPIRY.pop(cursor, ()))
+            cursor += 1
+            for i in range(0, len(due), CONFIG.reap_batch):
+                with MAILBOX_LOCK:
+                    for recipient in due[i:i + CONFIG.reap_batch]:
+                        box = MAILBOX.get(recipient)
+                        if box is not None:
+                            expire_locked(box, now)
+                            retire_locked(recipient, box, now)
+        compact()
+
+def compact():
+    """Copy the payloads still stored in sparse segments to the tail, a batch
+    of messages per lock hold, so those segments are freed. New payloads only
+    go to the tail, so nothing new lands in a sparse segment meanwhile."""
+    with MAILBOX_LOCK:
+        sparse = ARENA.sparse_segments()
+        if not sparse:
+            return
+        total = len(MESSAGES)
+        STATS["compactions"] += 1
+    batch = CONFIG.reap_batch * 16
+    for start in range(0, total, batch):
+        with MAILBOX_LOCK:
+            refs, segments, offsets, lengths = MESSAGES.refs, MESSAGES.segments, MESSAGES.offsets, MESSAGES.lengths
+            for mid in range(start, min(start + batch, len(refs))):
+                if refs[mid] and segments[mid] in sparse:
+                    segments[mid], offsets[mid] = ARENA.move(segments[mid], offsets[mid], lengths[mid])
+
+def admit_connection(ip):
+    """Count a new connection from ip against the caps; False if over one."""
+    with MAILBOX_LOCK:
+        if (CONFIG.max_connections and STATS["open_connections"] >= CONFIG.max_connections) or \
+                (CONFIG.max_connections_per_ip and CONNECTIONS.get(ip, 0) >= CONFIG.max_connections_per_ip):
+            STATS["connections_rejected"] += 1
+            return False
+        CONNECTIONS[ip] = CONNECTIONS.get(ip, 0) + 1
+        STATS["connections_accepted"] += 1
+        STATS["open_connections"] += 1
+        STATS["peak_connections"] = max(STATS["peak_connections"], STATS["open_connections"])
+    return True
+
+def release_connection(ip):
+    with MAILBOX_LOCK:
+        CONNECTIONS[ip] -= 1
+        if not CONNECTIONS[ip]:
+            del CONNECTIONS[ip]
+        STATS["connections_closed"] += 1
+        STATS["open_connections"] -= 1
+
+def stats_snapshot():
+    with MAILBOX_LOCK:
+        snapshot = dict(STATS)
+        snapshot["mailboxes"] = len(MAILBOX)
+        snapshot["online_clients"] = len(ONLINE_CLIENTS)
+        snapshot["senders"] = len(SENDER_KEYS)
+        snapshot["message_rows"] = len(MESSAGES)
+        snapshot["node_id"] = CLUSTER.node_id
+        snapshot["ring_nodes"] = CLUSTER.nodes
+        snapshot.update(ARENA.stats())
+    return snapshot
 
 def handle_client(conn, addr):
-    print(f"[+] New connection from {addr}")
+    log.debug("connection_opened addr=%s:%d", *addr)
+    conn = MeteredSocket(conn)
     client_pub_key = None
-    
+    peer = None  # Node id, once the connection has opened with PEER_HELLO
+
+    # Any read, between or inside frames, that waits longer than idle_timeout
+    # ends the connection; clients with nothing to send PING to stay online.
+    conn.settimeout(CONFIG.idle_timeout or None)
     try:
         while True:
             # Read Command (1 byte)
             cmd_byte = conn.recv(1)
             if not cmd_byte:
                 break
-                
+
+            started = time.perf_counter()
             cmd = cmd_byte[0]
-            
-            if cmd == 1: # REGISTER
+
+            if cmd == CMD_REGISTER:
                 # Expect 32 bytes public key
                 pub_key = recv_exact(conn, 32)
-                if len(pub_key) != 32: break
-                
-                client_pub_key = pub_key
-                with MAILBOX_LOCK:
-                    ONLINE_CLIENTS[client_pub_key] = conn
-                    if client_pub_key not in MAILBOX:
-                        MAILBOX[client_pub_key] = []
-                
-                conn.sendall(b'\x00') # OK
-                print(f"[*] Registered user: {pub_key.hex()[:8]}...")
-                
-            elif cmd == 2: # SEND
+
+                if register(pub_key, conn):
+                    client_pub_key = pub_key
+                    conn.sendall(OK)
+                    log.debug("registered key=%s", ShortKey(pub_key))
+                else:
+                    conn.sendall(REJECTED)
+                    log.warning("register_refused key=%s reason=mailbox_cap", ShortKey(pub_key))
+
+            elif cmd == CMD_SEND:
                 # Recipient (32) + Len (4) + Msg (Len)
                 recipient = recv_exact(conn, 32)
-                len_bytes = recv_exact(conn, 4)
-                msg_len = struct.unpack('>I', len_bytes)[0]
+                msg_len = struct.unpack('>I', recv_exact(conn, 4))[0]
+                if not check_frame(conn, msg_len):
+                    break
                 msg = recv_exact(conn, msg_len)
-                
-                # Store message
-                with MAILBOX_LOCK:
-                    if recipient not in MAILBOX:
-                        MAILBOX[recipient] = []
-                    # We assume the sender is the current authenticated client (client_pub_key)
-                    # Ideally we verify signature, but for demo we trust the socket connection after Register.
-                    sender = client_pub_key if client_pub_key else b'\x00'*32
-                    MAILBOX[recipient].append((sender, msg))
-                
-                conn.sendall(b'\x00') # OK
-                print(f"[*] Stored message for {recipient.hex()[:8]}...")
-                
-            elif cmd == 3: # FETCH
+
+                # We assume the sender is the current authenticated client (client_pub_key)
+                # Ideally we verify signature, but for demo we trust the socket connection after Register.
+                sender = client_pub_key if client_pub_key else b'\x00'*32
+                stored = deliver(sender, (recipient,), msg)
+
+                conn.sendall(OK if stored else REJECTED)
+                log.debug("send recipient=%s size=%d stored=%d", ShortKey(recipient), msg_len, stored)
+
+            elif cmd == CMD_FETCH:
                 # Return all messages for current user
                 if not client_pub_key:
-                    conn.sendall(b'\xFF') # Error: Not registered
-                    continue
-                    
-                with MAILBOX_LOCK:
-                    messages = MAILBOX.get(client_pub_key, [])
-                    # Clear mailbox after fetch (POP3 style)
-                    MAILBOX[client_pub_key] = []
-                    
-                # Response: Count (4)
-                conn.sendall(struct.pack('>I', len(messages)))
-                
-                for sender, payload in messages:
-                    # Sender (32) + Len (4) + Payload
-                    conn.sendall(sender)
-                    conn.sendall(struct.pack('>I', len(payload)))
-                    conn.sendall(payload)
-                    
-                print(f"[*] Delivered {len(messages)} messages to {client_pub_key.hex()[:8]}...")
-                
+                    conn.sendall(ERROR) # Error: Not registered
+                else:
+                    delivered, parts = fetch(client_pub_key)
+                    conn.sendall(b''.join(parts))
+                    log.debug("fetch key=%s delivered=%d", ShortKey(client_pub_key), delivered)
+
+            elif cmd == CMD_SEND_MULTI:
+                # Count (2) + Recipients (32 * Count) + Len (4) + Msg (Len)
+                count = struct.unpack('>H', recv_exact(conn, 2))[0]
+                recipients = recv_exact(conn, 32 * count)
+                msg_len = struct.unpack('>I', recv_exact(conn, 4))[0]
+                if not check_frame(conn, msg_len):
+                    break
+                msg = recv_exact(conn, msg_len)
+                if count == 0:
+                    conn.sendall(ERROR) # Error: No recipients
+                else:
+                    # One shared payload; duplicate recipients get it once
+                    sender = client_pub_key if client_pub_key else b'\x00'*32
+                    unique = dict.fromkeys(recipients[i:i + 32] for i in range(0, len(recipients), 32))
+                    stored = deliver(sender, unique, msg)
+
+                    # REJECTED if any recipient was refused; the others still got it
+                    conn.sendall(OK if stored == len(unique) else REJECTED)
+                    log.debug("send_multi recipients=%d size=%d stored=%d", len(unique), msg_len, stored)
+
+            elif cmd == CMD_STATS:
+                # Response: Len (4) + JSON counters
+                body = json.dumps(stats_snapshot()).encode()
+                conn.sendall(struct.pack('>I', len(body)) + body)
+
+            elif cmd == CMD_PING:
+                # Keepalive; the PONG is OK
+                add_stat("pings")
+                conn.sendall(OK)
+
+            elif cmd == CMD_PEER_HELLO:
+                # Node id len (1) + Node id + Secret len (1) + Secret
+                node = recv_exact(conn, recv_exact(conn, 1)[0]).decode()
+                secret = recv_exact(conn, recv_exact(conn, 1)[0])
+                # A relay without a secret is not in a cluster and takes no peers.
+                if not CLUSTER.secret or not hmac.compare_digest(secret, CLUSTER.secret):
+                    conn.sendall(ERROR)
+                    log.warning("peer_refused node=%s addr=%s:%d reason=secret", node, *addr)
+                    break
+                peer = node
+                conn.sendall(OK)
+                log.info("peer_link node=%s addr=%s:%d", node, *addr)
+
+            elif cmd in PEER_COMMANDS and peer is None:
+                log.warning("peer_refused cmd=%d addr=%s:%d reason=no_hello", cmd, *addr)
+                break
+
+            # Peer commands are always served locally, so a node whose ring
+            # is briefly out of date never bounces a message back and forth.
+            elif cmd == CMD_FORWARD:
+                # Msg id (16) + Sender (32) + Count (2) + Recipients (32 * Count) + Len (4) + Msg (Len)
+                msg_id = recv_exact(conn, 16)
+                sender = recv_exact(conn, 32)
+                count = struct.unpack('>H', recv_exact(conn, 2))[0]
+                recipients = recv_exact(conn, 32 * count)
+                msg_len = struct.unpack('>I', recv_exact(conn, 4))[0]
+                if not check_frame(conn, msg_len):
+                    break
+                msg = recv_exact(conn, msg_len)
+                unique = dict.fromkeys(recipients[i:i + 32] for i in range(0, len(recipients), 32))
+                # Response: Stored count (2)
+                conn.sendall(struct.pack('>H', enqueue(sender, unique, msg, msg_id)))
+
+            elif cmd == CMD_FETCH_FOR:
+                # Recipient (32); response as for FETCH
+                _, parts = drain(recv_exact(conn, 32))
+                conn.sendall(b''.join(parts))
+
+            elif cmd == CMD_REGISTER_FOR:
+                # Recipient (32)
+                conn.sendall(OK if open_mailbox(recv_exact(conn, 32)) else REJECTED)
+
+            elif cmd == CMD_RING:
+                # Len (4) + JSON {"nodes": {node_id: "host:port"}, "rebalance": bool}
+                body_len = struct.unpack('>I', recv_exact(conn, 4))[0]
+                if not check_frame(conn, body_len):
+                    break
+                body = json.loads(recv_exact(conn, body_len))
+                CLUSTER.set_nodes(parse_nodes(body["nodes"]))
+                moved = rebalance() if body.get("rebalance") else {}
+                # Response: OK + Len (4) + JSON move counts
+                reply = json.dumps(moved).encode()
+                conn.sendall(OK + struct.pack('>I', len(reply)) + reply)
+                log.info("ring_changed nodes=%s by=%s moved=%s", ",".join(sorted(body["nodes"])), peer, moved)
+
             else:
-                print(f"[!] Unknown command: {cmd}")
+                log.warning("unknown_command cmd=%d addr=%s:%d", cmd, *addr)
                 break
-                
+
+            METRICS.observe(cmd, time.perf_counter() - started, conn.received, conn.sent)
+            conn.received = conn.sent = 0
+
+    except socket.timeout:
+        add_stat("idle_timeouts")
+        log.debug("idle_timeout addr=%s:%d", *addr)
     except Exception as e:
-        print(f"[!] Error handling client {addr}: {e}")
+        log.warning("connection_error addr=%s:%d error=%s", *addr, e)
     finally:
         if client_pub_key:
             with MAILBOX_LOCK:
-                if client_pub_key in ONLINE_CLIENTS:
+                if ONLINE_CLIENTS.get(client_pub_key) is conn:
                     del ONLINE_CLIENTS[client_pub_key]
+                    # Start the idle clock for retiring its mailbox.
+                    box = MAILBOX.get(client_pub_key)
+                    if box is not None:
+                        box.seen = time.monotonic()
+                        schedule_retire_locked(client_pub_key, box)
         conn.close()
-        print(f"[-] Connection closed {addr}")
+        release_connection(addr[0])
+        log.debug("connection_closed addr=%s:%d", *addr)
+
+def check_frame(conn, msg_len):
+    """Refuse a blob above max_frame before reading it. The unread body
+    cannot be skipped safely, so the caller drops the connection."""
+    if msg_len <= CONFIG.max_frame:
+        return True
+    with MAILBOX_LOCK:
+        STATS["rejected_too_large"] += 1
+    conn.sendall(TOO_LARGE)
+    log.info("frame_refused size=%d max=%d", msg_len, CONFIG.max_frame)
+    return False
 
 def recv_exact(sock, n):
     data = b''
     while len(data) < n:
         packet = sock.recv(n - len(data))
-        if not packet: return data
+        if not packet:
+            raise ConnectionError("connection closed mid-frame")
         data += packet
     return data
 
+def parse_nodes(spec):
+    """'a=host:port,b=host:port' (or {id: 'host:port'}) to {id: (host, port)}"""
+    if isinstance(spec, str):
+        spec = dict(item.split('=', 1) for item in spec.split(',') if item)
+    nodes = {}
+    for node, address in spec.items():
+        host, port = address.rsplit(':', 1)
+        nodes[node] = (host, int(port))
+    return nodes
+
+def apply_ring(nodes, retire, secret):
+    """Give every node in nodes and retire the new membership, then have each
+    move the mailboxes it no longer owns. Routing switches everywhere before
+    any data moves; run it again to sweep up messages that raced the switch."""
+    global CLUSTER
+    CLUSTER = Cluster("admin", None, secret)
+    body = {"nodes": {node: f"{host}:{port}" for node, (host, port) in nodes.items()}}
+    targets = {**nodes, **retire}
+    for rebalance_now in (False, True):
+        frame = json.dumps(dict(body, rebalance=rebalance_now)).encode()
+        for node, address in targets.items():
+            link = PeerLink(node, address)
+            reply = link.call(bytes([CMD_RING]) + struct.pack('>I', len(frame)) + frame, read_ring_response)
+            if rebalance_now:
+                print(f"{node}: {reply}")
+
+def read_ring_response(sock):
+    if recv_exact(sock, 1) != OK:
+        raise ConnectionError("ring change refused")
+    return json.loads(recv_exact(sock, struct.unpack('>I', recv_exact(sock, 4))[0]))
+
 def main():
-    port = 5000
+    global ARENA, CLUSTER
+    parser = argparse.ArgumentParser(description="Store-and-forward relay server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--max-frame", type=int, default=CONFIG.max_frame, help="largest message blob (bytes)")
+    parser.add_argument("--mailbox-max-bytes", type=int, default=CONFIG.mailbox_max_bytes)
+    parser.add_argument("--mailbox-max-messages", type=int, default=CONFIG.mailbox_max_messages)
+    parser.add_argument("--ttl", type=float, default=CONFIG.message_ttl, help="seconds a message is kept")
+    parser.add_argument("--mailbox-idle", type=float,
+                        help="seconds an empty mailbox of a key not connected here is kept (default: --ttl)")
+    parser.add_argument("--max-mailboxes", type=int, default=CONFIG.max_mailboxes,
+                        help="mailboxes on this node; REGISTER of a new key beyond it is refused (0 = no cap)")
+    parser.add_argument("--reap-interval", type=float, default=CONFIG.reap_interval)
+    parser.add_argument("--arena-segment", type=int, default=CONFIG.arena_segment,
+                        help="payload arena segment size (bytes)")
+    parser.add_argument("--idle-timeout", type=float, default=CONFIG.idle_timeout,
+                        help="close connections silent for this long (seconds, 0 = never)")
+    parser.add_argument("--max-connections", type=int, default=CONFIG.max_connections,
+                        help="open connection cap (0 = none)")
+    parser.add_argument("--max-connections-per-ip", type=int, default=CONFIG.max_connections_per_ip,
+                        help="open connection cap per client address (0 = none)")
+    parser.add_argument("--backlog", type=int, default=CONFIG.backlog, help="listen() accept queue length")
+    parser.add_argument("--admin-host", default="127.0.0.1")
+    parser.add_argument("--admin-port", type=int, default=0,
+                        help="serve GET /metrics and /stats over HTTP on this port (0 = off)")
+    parser.add_argument("--log-level", default="INFO", type=str.upper, choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG logs every command")
+    parser.add_argument("--node-id", default="relay", help="this node's name in the cluster")
+    parser.add_argument("--peers", default="", help="other cluster nodes, as id=host:port,...")
+    parser.add_argument("--vnodes", type=int, default=CONFIG.vnodes)
+    parser.add_argument("--cluster-secret", default=os.environ.get("RELAY_CLUSTER_SECRET", ""),
+                        help="shared secret for peer links (default: $RELAY_CLUSTER_SECRET)")
+    parser.add_argument("--apply-ring", metavar="NODES",
+                        help="instead of serving, push membership id=host:port,... to those nodes and rebalance")
+    parser.add_argument("--retire", default="", metavar="NODES",
+                        help="with --apply-ring: nodes leaving the cluster, which hand off their mailboxes")
+    args = parser.parse_args()
+
+    CONFIG.vnodes = args.vnodes
+    secret = args.cluster_secret.encode()
+    if (args.peers or args.apply_ring) and not secret:
+        parser.error("--peers and --apply-ring need --cluster-secret (or RELAY_CLUSTER_SECRET)")
+    if args.apply_ring:
+        apply_ring(parse_nodes(args.apply_ring), parse_nodes(args.retire), secret)
+        return
+
+    CONFIG.max_frame = args.max_frame
+    CONFIG.mailbox_max_bytes = args.mailbox_max_bytes
+    CONFIG.mailbox_max_messages = args.mailbox_max_messages
+    CONFIG.message_ttl = args.ttl
+    CONFIG.mailbox_idle = args.ttl if args.mailbox_idle is None else args.mailbox_idle
+    CONFIG.max_mailboxes = args.max_mailboxes
+    CONFIG.reap_interval = args.reap_interval
+    # About a thousand buckets across the TTL, and never coarser than a minute
+    CONFIG.expiry_granularity = max(0.001, min(60, args.ttl / 1000))
+    CONFIG.arena_segment = args.arena_segment
+    CONFIG.idle_timeout = args.idle_timeout
+    CONFIG.max_connections = args.max_connections
+    CONFIG.max_connections_per_ip = args.max_connections_per_ip
+    CONFIG.backlog = args.backlog
+    ARENA = Arena(CONFIG.arena_segment)
+    CLUSTER = Cluster(args.node_id, {args.node_id: (args.host, args.port), **parse_nodes(args.peers)}, secret)
+
+    setup_logging(args.log_level)
+    threading.Thread(target=reaper, daemon=True).start()
+    if args.admin_port:
+        admin = ThreadingHTTPServer((args.admin_host, args.admin_port), AdminHandler)
+        admin.daemon_threads = True
+        threading.Thread(target=admin.serve_forever, daemon=True).start()
+        log.info("admin_listening addr=%s:%d", args.admin_host, args.admin_port)
+
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(('0.0.0.0', port))
-    server.listen(5)
-    print(f"[*] Relay Server listening on port {port}")
-    
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((args.host, args.port))
+    # The kernel caps this at net.core.somaxconn
+    server.listen(CONFIG.backlog)
+    log.info("listening node=%s addr=%s:%d", args.node_id, args.host, args.port)
+
     while True:
         conn, addr = server.accept()
+        if not admit_connection(addr[0]):
+            # Over a cap: shed it before it costs a thread
+            conn.close()
+            continue
+        # Let the kernel notice peers that vanished without closing
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
         t = threading.Thread(target=handle_client, args=(conn, addr))
         t.daemon = True
         t.start()